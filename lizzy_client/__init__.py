@@ -0,0 +1,4 @@
+import time
+
+# reference point for the "startup" phase reported with --trace
+STARTED_AT = time.perf_counter()
@@ -4,14 +4,19 @@ Common parameter types
 
 import os
 import re
+from typing import Optional
 from urllib.error import URLError
 from urllib.parse import quote
 from urllib.request import urlopen
 
 import click
+import requests
 import yaml
 
+from . import remote, tracing
+
 VERSION_PATTERN = re.compile(r'^[a-zA-Z0-9]+$')
+PARAMETER_FILE_DOWNLOADS = 'lizzy.parameter_file_downloads'
 
 
 class DefinitionParamType(click.ParamType):
@@ -23,9 +28,13 @@ class DefinitionParamType(click.ParamType):
                 url = (value if '://' in value
                        else 'file://{}'.format(quote(os.path.abspath(value))))
 
-                response = urlopen(url)
-                data = yaml.safe_load(response.read())
-            except URLError:
+                with tracing.phase('definition'):
+                    if remote.is_remote(url):
+                        content = remote.fetch(url)
+                    else:
+                        content = urlopen(url, timeout=remote.FETCH_TIMEOUT).read()
+                    data = yaml.safe_load(content)
+            except (URLError, requests.RequestException):
                 self.fail('"{}" not found'.format(value), param, ctx)
         else:
             data = value
@@ -36,6 +45,21 @@ class DefinitionParamType(click.ParamType):
         return data
 
 
+def prefetch_parameter_files(ctx, param, value):
+    """
+    Starts downloading remote parameter files while the other arguments,
+    like the definition, are being read. The downloads are kept in the
+    context (see :func:`parameter_file_downloads`) until the command ends.
+    """
+    downloads = ctx.meta[PARAMETER_FILE_DOWNLOADS] = remote.prefetch(value)
+    ctx.call_on_close(lambda: remote.cancel(downloads))
+    return value
+
+
+def parameter_file_downloads() -> Optional[remote.Downloads]:
+    return click.get_current_context().meta.get(PARAMETER_FILE_DOWNLOADS)
+
+
 def validate_version(ctx, param, value):
     if not VERSION_PATTERN.match(value):
         raise click.BadParameter('Version must satisfy regular expression '
@@ -47,11 +71,20 @@ dry_run_option = click.option('--dry-run',
                               is_flag=True,
                               help='No-op mode: show what would be deleted')
 
+from_snapshot_option = click.option('--from-snapshot', metavar='PATH',
+                                    help='Read the stacks from a snapshot taken with '
+                                         '"lizzy snapshot" instead of the agent')
+
 output_option = click.option('-o', '--output',
-                             type=click.Choice(['text', 'json', 'tsv']),
+                             type=click.Choice(['text', 'json', 'tsv', 'ndjson']),
                              default='text',
                              help='Use alternative output format')
 
+page_size_option = click.option('--page-size',
+                                type=click.IntRange(1, None),
+                                envvar='LIZZY_PAGE_SIZE',
+                                help='Number of stacks to request per page')
+
 region_option = click.option('--region',
                              envvar='AWS_DEFAULT_REGION',
                              metavar='AWS_REGION_ID',
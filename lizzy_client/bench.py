@@ -0,0 +1,119 @@
+"""
+Benchmarks for the Lizzy client
+
+Runs the client end-to-end over HTTP against a local fake agent (see
+:mod:`lizzy_client.fake_agent`) and measures latency and throughput of each
+operation.
+"""
+
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Callable, List
+
+import tokens
+
+from .fake_agent import FakeAgent
+from .lizzy import Lizzy
+from .token import get_token
+from .utils import percentile
+from .version import VERSION
+
+SCENARIOS = ['token', 'create', 'wait_for_deployment', 'list', 'traffic', 'delete']
+
+
+def summarize(durations: List[float]) -> dict:
+    total = sum(durations)
+    return {'iterations': len(durations),
+            'total_s': round(total, 6),
+            'ops_per_s': round(len(durations) / total, 2) if total else None,
+            'mean_ms': round(total / len(durations) * 1000, 3) if durations else None,
+            'p50_ms': round(percentile(durations, 50) * 1000, 3),
+            'p90_ms': round(percentile(durations, 90) * 1000, 3),
+            'p99_ms': round(percentile(durations, 99) * 1000, 3),
+            'max_ms': round(max(durations, default=0) * 1000, 3)}
+
+
+def measure(iterations: int, operation: Callable[[int], object]) -> dict:
+    durations = []
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        operation(iteration)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def write_credentials(credentials_dir: str):
+    user = {'application_username': 'bench', 'application_password': 'bench'}
+    client = {'client_id': 'bench', 'client_secret': 'bench'}
+    for name, data in (('user.json', user), ('client.json', client)):
+        with open(os.path.join(credentials_dir, name), 'w') as fd:
+            json.dump(data, fd)
+
+
+def run_benchmarks(stacks: int=100, latency: float=0.0, iterations: int=20) -> dict:
+    """
+    Runs every scenario ``iterations`` times against a fake agent serving
+    ``stacks`` stacks and answering after ``latency`` seconds.
+    """
+    results = {}
+    with FakeAgent(stacks=stacks, latency=latency) as agent, \
+            tempfile.TemporaryDirectory() as credentials_dir:
+        write_credentials(credentials_dir)
+
+        def fetch_token(i):
+            tokens.TOKENS.pop('lizzy', None)  # measure a full fetch, not the cached token
+            return get_token(agent.token_url, 'uid', credentials_dir)
+
+        results['token'] = measure(iterations, fetch_token)
+
+        lizzy = Lizzy(agent.url, get_token(agent.token_url, 'uid', credentials_dir))
+        definition = {'SenzaInfo': {'StackName': 'bench'}}
+        stack_ids = ['bench-b{}'.format(i) for i in range(iterations)]
+
+        results['create'] = measure(
+            iterations, lambda i: lizzy.new_stack(None, None, definition, 'b{}'.format(i),
+                                                  False, [], region=None,
+                                                  dry_run=False, tags=[]))
+        results['wait_for_deployment'] = measure(
+            iterations, lambda i: list(lizzy.wait_for_deployment(stack_ids[i])))
+        results['list'] = measure(iterations, lambda i: lizzy.get_stacks())
+
+        def change_traffic(i):
+            lizzy.traffic(stack_ids[i], 100)
+            lizzy.get_traffic(stack_ids[i])
+
+        results['traffic'] = measure(iterations, change_traffic)
+        results['delete'] = measure(iterations, lambda i: lizzy.delete(stack_ids[i]))
+
+    return {'environment': {'client_version': VERSION,
+                            'python': platform.python_version(),
+                            'stacks': stacks,
+                            'latency_ms': latency * 1000,
+                            'iterations': iterations},
+            'results': results}
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[dict]:
+    """
+    Compares the median latency of each scenario with the baseline.
+
+    A scenario regressed when it got more than ``max_regression`` percent
+    slower.
+    """
+    rows = []
+    for scenario in SCENARIOS:
+        current = report['results'].get(scenario)
+        previous = baseline.get('results', {}).get(scenario)
+        if not current or not previous:
+            continue
+        change = ((current['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+                  if previous['p50_ms'] else 0.0)
+        rows.append({'scenario': scenario,
+                     'baseline_p50_ms': previous['p50_ms'],
+                     'p50_ms': current['p50_ms'],
+                     'change%': round(change, 1),
+                     'regression': change > max_regression})
+    return rows
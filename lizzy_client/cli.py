@@ -1,31 +1,45 @@
-import datetime
+import cProfile
+import json
 import os.path
+import sys
 import time
 import traceback
+from collections import OrderedDict
+from contextlib import ExitStack
 from functools import wraps
 from json.decoder import JSONDecodeError
 from typing import List, Optional
 
 import click
-import dateutil.parser
 import requests
-import yaml
-from clickclick import (Action, AliasedGroup, OutputFormat, error, fatal_error,
-                        info, print_table, warning)
+from clickclick import Action, AliasedGroup, error, fatal_error, info, warning
 from tokens import InvalidCredentialsError
-from yaml.error import YAMLError
 
-from . import metrics
-from .arguments import (DefinitionParamType, dry_run_option, output_option,
+from . import STARTED_AT
+from . import (daemon, deadlines, events, history, metrics, progress,
+               snapshots, tracing, validation, workflows)
+from .arguments import (DefinitionParamType, dry_run_option,
+                        from_snapshot_option, output_option, page_size_option,
+                        parameter_file_downloads, prefetch_parameter_files,
                         region_option, remote_option, validate_version,
                         watch_option)
 from .configuration import Configuration
+from .exceptions import (DeadlineExceeded, DeploymentError,
+                         InvalidTrafficWeights, StackRolledBack,
+                         TrafficMismatch)
 from .lizzy import Lizzy
 from .metrics import report_metric
-from .token import get_token
-from .utils import get_stack_refs, read_parameter_file
+from .models import AgentOutput, Stack, TrafficWeight, make_stack_id
+from .output import print_rows
+from .token import TokenProvider, get_token, refresh_token
+from .utils import (StackReference, get_scale_targets, get_stack_refs,
+                    match_stack_refs, read_parameter_files, read_scale_file,
+                    read_stack_name)
 from .version import VERSION
 
+# scheduler.PRIORITIES, the scheduler is only imported with --max-concurrent
+DEPLOYMENT_PRIORITIES = ['hotfix', 'normal', 'low']
+
 STYLES = {
     'RUNNING': {'fg': 'green'},
     'TERMINATED': {'fg': 'red'},
@@ -41,6 +55,10 @@ STYLES = {
     'UPDATE_COMPLETE': {'fg': 'green'}
 }
 
+PLAN_STYLES = dict(STYLES,
+                   create={'fg': 'green', 'bold': True},
+                   delete={'fg': 'red', 'bold': True})
+
 TITLES = {
     'creation_time': 'Created',
     'logical_resource_id': 'Resource ID',
@@ -55,24 +73,60 @@ TITLES = {
     'version': 'Ver.'
 }
 
-COMPLETE_STATES = [
-    'CREATE_COMPLETE',
-    'ROLLBACK_COMPLETE',
-    'UPDATE_COMPLETE',
-    'UPDATE_ROLLBACK_COMPLETE'
-]
-
 requests.packages.urllib3.disable_warnings()  # Disable the security warnings
 
-main = AliasedGroup(context_settings=dict(help_option_names=['-h', '--help']))
+
+@click.group(cls=AliasedGroup,
+             context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('--trace', is_flag=True, envvar='LIZZY_TRACE',
+              help='Print a timeline of the phases and HTTP requests')
+@click.option('--trace-file', metavar='PATH', envvar='LIZZY_TRACE_FILE',
+              help='Write the timeline as a Chrome trace (JSON) file')
+@click.option('--profile', metavar='PATH', envvar='LIZZY_PROFILE',
+              help='Write cProfile statistics of the run')
+@click.pass_context
+def main(ctx: click.Context, trace: bool, trace_file: Optional[str],
+         profile: Optional[str]):
+    if trace or trace_file:
+        tracer = tracing.Tracer(started_at=STARTED_AT)
+        tracing.add_recorder(tracer)
+        tracing.record_phase('startup', STARTED_AT,
+                             time.perf_counter() - STARTED_AT)
+
+        def finish_trace():
+            tracing.remove_recorder(tracer)
+            if trace:
+                tracer.print_summary()
+            if trace_file:
+                tracer.write_chrome_trace(trace_file)
+
+        ctx.call_on_close(finish_trace)
+
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def finish_profile():
+            profiler.disable()
+            profiler.dump_stats(profile)
+
+        ctx.call_on_close(finish_profile)
 
 
 def main_with_metrics():
     """
-    Runs main() and reports success and failure metrics
+    Runs main(), in the daemon if one is running, and reports success and
+    failure metrics
     """
+    if sys.argv[1:2] == ['completion']:
+        # runs on every TAB press, it can't wait for the daemon or metrics
+        return main()
     try:
-        main()
+        exit_code = daemon.forward(sys.argv[1:])
+        if exit_code is None:
+            main()
+        else:
+            sys.exit(exit_code)
     except Exception:
         report_metric("bus.lizzy-client.failed", 1)
         raise
@@ -90,6 +144,7 @@ def connection_error(e: requests.ConnectionError, fatal=True):
     reason = e.args[0].reason  # type: requests.packages.urllib3.exceptions.NewConnectionError
     _, pretty_reason = str(reason).split(':', 1)
     msg = ' {}'.format(pretty_reason)
+    events.emit('error', message=pretty_reason.strip())
     if fatal:
         fatal_error(msg)
     else:
@@ -100,12 +155,20 @@ def agent_error(e: requests.HTTPError, fatal=True):
     """
     Prints an agent error and exits
     """
+    request = e.request
+    if request is not None and request.method == 'PATCH' and request.body:
+        # the traffic or scale change the agent rejected
+        body = request.body.decode() if isinstance(request.body, bytes) else request.body
+        warning('Data Json:')
+        click.echo(json.dumps(json.loads(body), indent=4))
+
     try:
         data = e.response.json()
         details = data['detail']  # type: str
     except JSONDecodeError:
         details = e.response.text or str(e.response)
 
+    events.emit('error', message=details, status=e.response.status_code)
     lines = ('[AGENT] {}'.format(line) for line in details.splitlines())
     msg = '\n' + '\n'.join(lines)
 
@@ -124,10 +187,88 @@ def display_user_friendly_agent_errors(func):
             connection_error(e)
         except requests.HTTPError as e:
             agent_error(e)
+        except DeadlineExceeded as e:
+            events.emit('error', message=str(e))
+            fatal_error('Error: {}'.format(e))
+
+    return _wrapper
+
+
+def stream_events(func):
+    """
+    Streams the events of the command as NDJSON when called with
+    ``--output ndjson``
+    """
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        if kwargs.get('output') != 'ndjson':
+            return func(*args, **kwargs)
+        with events.EventStream(click.get_current_context().info_name):
+            return func(*args, **kwargs)
 
     return _wrapper
 
 
+def show_agent_output(output: Optional[AgentOutput], stack_id: str):
+    """
+    Prints the lines of the agent output as they arrive
+    """
+    for line in output or ():
+        click.echo(line)
+        events.emit('agent_output', stack_id=stack_id, line=line)
+
+
+def validate_definition(definition: dict, version: str, parameters: List[str],
+                        tags: List[str], force: bool):
+    """
+    Checks the definition locally, failing on issues unless ``force`` is set
+    """
+    with Action('Validating definition..') as action, tracing.phase('validation'):
+        issues = validation.validate(definition, version, parameters, tags)
+        for issue in issues:
+            events.emit('validation_issue', check=issue.check, message=issue.message)
+            if force:
+                action.warning(issue.message)
+            else:
+                action.error(issue.message)
+    if issues and not force:
+        fatal_error('Invalid definition, use --force to create the stack anyway')
+
+
+def definition_stack_name(definition) -> Optional[str]:
+    """
+    Stack name in the definition, None if it has none (only with --force)
+    """
+    senza_info = definition.get('SenzaInfo') if isinstance(definition, dict) else None
+    return senza_info.get('StackName') if isinstance(senza_info, dict) else None
+
+
+def acquire_deployment_slot(lizzy: Lizzy, stack_name: Optional[str], version: str,
+                            priority: str, max_concurrent: int):
+    """
+    Waits in the local queue until fewer than ``max_concurrent`` deployments
+    to the agent are running and returns the slot. It is released when the
+    command ends.
+    """
+    from . import scheduler  # only needed with --max-concurrent
+
+    label = make_stack_id(stack_name, version) if stack_name else version
+    slot = scheduler.DeploymentSlot(str(lizzy.api_url), max_concurrent, priority, label=label)
+    click.get_current_context().call_on_close(slot.release)
+    start = time.perf_counter()
+    with Action('Waiting for a deployment slot ({priority})..', priority=priority) as action, \
+            tracing.phase('queue'):
+        def show_wait(ahead: int):
+            events.emit('queued', priority=priority, ahead=ahead)
+            action.progress()
+
+        if not slot.acquire(timeout=deadlines.remaining(), on_wait=show_wait):
+            raise DeadlineExceeded('Waiting for a deployment slot')
+    events.emit('slot_acquired', priority=priority,
+                waited_ms=round((time.perf_counter() - start) * 1000, 3))
+    return slot
+
+
 # TODO fix scopes to be really a list
 def fetch_token(token_url: str, scopes: str, credentials_dir: str) -> str:
     """
@@ -135,7 +276,7 @@ def fetch_token(token_url: str, scopes: str, credentials_dir: str) -> str:
     :return:
     """
 
-    with Action('Fetching authentication token..') as action:
+    with Action('Fetching authentication token..') as action, tracing.phase('token'):
         try:
             access_token = get_token(token_url, scopes, credentials_dir)
             action.progress()
@@ -151,24 +292,14 @@ def parse_stack_refs(stack_references: List[str]) -> List[str]:
     substitute the definition file path by the stack name in the same
     position on the list.
     '''
-    stack_names = []
-    references = list(stack_references)
-    references.reverse()
-    while references:
-        current = references.pop()
-        # current that might be a file
-        file_path = os.path.abspath(current)
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            try:
-                with open(file_path) as fd:
-                    data = yaml.safe_load(fd)
-                current = data['SenzaInfo']['StackName']
-            except (KeyError, TypeError, YAMLError):
-                raise click.UsageError(
-                    'Invalid senza definition {}'.format(current)
-                )
-        stack_names.append(current)
-    return stack_names
+    return [read_stack_name(reference) for reference in stack_references]
+
+
+def load_snapshot(path: str) -> snapshots.Snapshot:
+    try:
+        return snapshots.load(path)
+    except snapshots.SnapshotError as e:
+        fatal_error('Error: {}'.format(e))
 
 
 def setup_lizzy_client(explicit_agent_url=None):
@@ -183,13 +314,51 @@ def setup_lizzy_client(explicit_agent_url=None):
     credentials_dir = config.credentials_dir
 
     access_token = fetch_token(token_url, scopes, credentials_dir)
+    # long running commands, like create with a big --timeout or list
+    # --watch, outlive the token
+    token_provider = TokenProvider(lambda: get_token(token_url, scopes, credentials_dir),
+                                   refresh=lambda: refresh_token(token_url, scopes, credentials_dir),
+                                   token=access_token).start()
 
     try:
         lizzy_url = explicit_agent_url or config.lizzy_url
     except AttributeError:
         fatal_error('Environment variable LIZZY_URL is not set.')
 
-    return Lizzy(lizzy_url, access_token)
+    if not daemon.is_serving():
+        return Lizzy(lizzy_url, token_provider)
+
+    # the daemon runs many commands in the same process, reuse its clients
+    lizzy = daemon.clients.get(lizzy_url)
+    if lizzy is None:
+        lizzy = daemon.clients[lizzy_url] = Lizzy(lizzy_url, token_provider,
+                                                  session=requests.Session())
+    else:
+        lizzy.token_provider.stop()
+        lizzy.access_token = token_provider
+    return lizzy
+
+
+def show_deployment_plan(plan: workflows.DeploymentPlan, output: str):
+    current = plan.current_weights or {}
+    weights = plan.weights or {}
+    rows = [{'action': 'create', 'stack_id': plan.stack_id,
+             'weight_before': 0.0 if plan.weights else None,
+             'weight_after': weights.get(plan.stack_id)}]
+    deleted = {stack.stack_id for stack in plan.delete}
+    for stack in plan.existing:
+        row = stack.as_row()
+        row.update(action='delete' if stack.stack_id in deleted else 'keep',
+                   stack_id=stack.stack_id,
+                   weight_before=current.get(stack.stack_id),
+                   weight_after=weights.get(stack.stack_id))
+        rows.append(row)
+    for message in plan.warnings:
+        warning(message)
+    cols = 'action stack_id status creation_time weight_before weight_after'.split()
+    print_rows(cols, rows, output, styles=PLAN_STYLES,
+               titles=dict(TITLES, weight_before='Weight Before%', weight_after='Weight After%'),
+               event='plan')
 
 
 @main.command()
@@ -200,140 +369,204 @@ def setup_lizzy_client(explicit_agent_url=None):
 @click.option('--disable-rollback', is_flag=True,
               help='Disable Cloud Formation rollback on failure')
 @dry_run_option
+@click.option('--plan', is_flag=True,
+              help='Only show the stack that would be created, the old stacks deleted and the traffic shift')
 @click.option('-f', '--force', is_flag=True, help='Ignore failing validation checks')
 @click.option('-t', '--tag', help='Tags to associate with the stack.', multiple=True)
 @click.option('--timeout', type=int, default=120, help='Total seconds to wait for related stacks to be ready')
+@click.option('--deadline', type=click.IntRange(1, None), metavar='SECS', envvar='LIZZY_DEADLINE',
+              help='Fail if the whole deployment, from the request to the cleanup, takes longer')
 @click.option('--keep-stacks', type=int, help='Number of old stacks to keep')
+@click.option('--priority', type=click.Choice(DEPLOYMENT_PRIORITIES),
+              default='normal', show_default=True,
+              help='Priority in the local deployment queue (see --max-concurrent)')
+@click.option('--max-concurrent', type=click.IntRange(1, None), metavar='N',
+              envvar='LIZZY_MAX_CONCURRENT_CREATES',
+              help='Deploy at most N stacks to the agent at a time from this machine, queueing the others')
 @click.option('--traffic', type=click.IntRange(0, 100, clamp=True),
               help='Percentage of traffic for the new stack')
-@click.option('--parameter-file',
-              help='Config file for params',
+@click.option('--parameter-file', multiple=True, is_eager=True,
+              callback=prefetch_parameter_files,
+              help='Config file for params, local or remote (can be given many times, later files win)',
               metavar='PATH')
 @remote_option
+@page_size_option
+@output_option
 @click.option('--verbose', '-v', is_flag=True)
+@stream_events
 @display_user_friendly_agent_errors
 def create(definition: dict, version: str, parameter: tuple,
            region: str,
            disable_rollback: bool,
            dry_run: bool,
+           plan: bool,
            force: bool,
            tag: List[str],
            timeout: int,
+           deadline: Optional[int],
            keep_stacks: Optional[int],
+           priority: str,
+           max_concurrent: Optional[int],
            traffic: int,
            verbose: bool,
            remote: str,
-           parameter_file: Optional[str]
+           page_size: Optional[int],
+           output: str,
+           parameter_file: List[str]
            ):
     """
     Create a new Cloud Formation stack from the given Senza definition file
     """
-    lizzy = setup_lizzy_client(remote)
     parameter = list(parameter) or []
     if parameter_file:
-        parameter.extend(read_parameter_file(parameter_file))
-
-    if not force:  # pragma: no cover
-        # supporting artifact checking would imply copying a large amount of code
-        # from senza, so it should be considered out of scope until senza
-        # and lizzy client are merged
-        warning("WARNING: "
-                "Artifact checking is still not supported by lizzy-client.")
-
-    with Action('Requesting new stack..') as action:
-        new_stack, output = lizzy.new_stack(keep_stacks, traffic,
-                                            definition, version,
-                                            disable_rollback, parameter,
-                                            region=region,
-                                            dry_run=dry_run,
-                                            tags=tag)
-
-    stack_id = '{stack_name}-{version}'.format_map(new_stack)
-    print(output)
+        parameter.extend(read_parameter_files(parameter_file,
+                                              downloads=parameter_file_downloads()))
+
+    validate_definition(definition, version, parameter, tag, force)
+
+    lizzy = setup_lizzy_client(remote)
+
+    # every step gets the time left until the deadline
+    scope = ExitStack()
+    click.get_current_context().call_on_close(scope.close)
+    scope.enter_context(deadlines.deadline(deadline))
+
+    if plan:
+        with Action('Planning deployment..'), tracing.phase('plan'):
+            deployment_plan = workflows.plan_deployment(lizzy, definition, version,
+                                                        region=region, traffic=traffic,
+                                                        keep_stacks=keep_stacks,
+                                                        page_size=page_size)
+        show_deployment_plan(deployment_plan, output)
+        exit(0)
+
+    deployment = history.DeploymentRecorder(definition_stack_name(definition), version, region)
+    deployment.start()
+    click.get_current_context().call_on_close(deployment.finish)
+
+    slot = None
+    if max_concurrent is not None and not dry_run:
+        slot = acquire_deployment_slot(lizzy, definition_stack_name(definition),
+                                       version, priority, max_concurrent)
+
+    with Action('Requesting new stack..') as action, tracing.phase('new_stack'):
+        new_stack, agent_output = workflows.request_stack(lizzy, definition, version,
+                                                          parameter,
+                                                          region=region,
+                                                          disable_rollback=disable_rollback,
+                                                          dry_run=dry_run,
+                                                          tags=tag,
+                                                          keep_stacks=keep_stacks,
+                                                          traffic=traffic)
+
+    stack_id = new_stack.stack_id
+    deployment.stack_name = new_stack.stack_name
+    events.emit('stack_requested', stack_id=stack_id, dry_run=dry_run)
+    show_agent_output(agent_output, stack_id)
 
     info('Stack ID: {}'.format(stack_id))
 
     if dry_run:
+        deployment.cancel()
         info("Post deployment steps skipped")
+        events.emit('result', stack_id=stack_id, status=None)
         exit(0)
 
-    with Action('Waiting for new stack...') as action:
+    with Action('Waiting for new stack...') as action, tracing.phase('wait_for_deployment'):
         if verbose:
             print()  # ensure that new states will not be printed on the same line as the action
 
         last_state = None
-        for state in lizzy.wait_for_deployment(stack_id, region=region):
+
+        def show_state(state: str):
+            nonlocal last_state
+            deployment.on_state(state)
+            if state != last_state:
+                events.emit('state', stack_id=stack_id, status=state)
             if state != last_state and verbose:
                 click.echo(' {}'.format(state))
             else:
                 action.progress()
             last_state = state
 
-        # TODO be prepared to handle all final AWS CF states
-        if last_state == 'ROLLBACK_COMPLETE':
+        try:
+            workflows.wait_for_stack(lizzy, stack_id, region=region,
+                                     on_state=show_state)
+        except StackRolledBack:
+            events.emit('result', stack_id=stack_id, status=last_state)
             fatal_error(
                 'Stack was rollback after deployment. Check your application log for possible reasons.')
-        elif last_state != 'CREATE_COMPLETE':
-            fatal_error('Deployment failed: {}'.format(last_state))
+        except DeploymentError as e:
+            events.emit('result', stack_id=stack_id, status=e.final_status)
+            fatal_error('Deployment failed: {}'.format(e.final_status))
+
+    if slot is not None:
+        slot.release()
 
     info('Deployment Successful')
+    deployment.result = history.DEPLOYED
+    completed = True
+    events.emit('deployed', stack_id=stack_id, status=last_state)
 
     if traffic is not None:
-        with Action('Requesting traffic change..'):
+        with Action('Requesting traffic change..'), tracing.phase('traffic'):
             try:
                 lizzy.traffic(stack_id, traffic, region=region)
             except requests.ConnectionError as e:
                 connection_error(e, fatal=False)
+                completed = False
             except requests.HTTPError as e:
                 agent_error(e, fatal=False)
+                completed = False
+            else:
+                events.emit('traffic_changed', stack_id=stack_id, weight=traffic)
 
-    # TODO unit test this
     if keep_stacks is not None:
-        versions_to_keep = keep_stacks + 1
-        stacks_to_remove_counter = 1
-        end_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=timeout)
-        while stacks_to_remove_counter > 0 and datetime.datetime.utcnow() <= end_time:
+        def show_delete(stack: Stack):
+            click.echo(' {}'.format(stack.stack_id))
+            events.emit('stack_deleting', stack_id=stack.stack_id)
+
+        def show_pending(stack: Stack):
+            click.echo(' > {} current status is {} trying again later'.format(stack.stack_id,
+                                                                              stack.status))
+            events.emit('stack_pending', stack_id=stack.stack_id, status=stack.status)
+
+        def handle_delete_error(stack: Stack, e: requests.RequestException):
+            if isinstance(e, requests.ConnectionError):
+                connection_error(e, fatal=False)
+            elif isinstance(e, requests.HTTPError):
+                agent_error(e, fatal=False)
+            else:  # pragma: no cover
+                error(' {}'.format(e))
+
+        cleanup = None
+        with Action('Deleting old stacks..'), tracing.phase('cleanup'):
+            print()
             try:
-                all_stacks = lizzy.get_stacks([new_stack['stack_name']],
-                                              region=region)
+                cleanup = workflows.remove_old_stacks(
+                    lizzy, new_stack.stack_name, keep_stacks,
+                    region=region, timeout=timeout, page_size=page_size,
+                    on_delete=show_delete,
+                    on_pending=show_pending,
+                    on_error=handle_delete_error)
             except requests.ConnectionError as e:
                 connection_error(e, fatal=False)
-                error("Failed to fetch old stacks. "
-                      "Old stacks WILL NOT BE DELETED")
-                exit(1)
             except requests.HTTPError as e:
                 agent_error(e, fatal=False)
-                error("Failed to fetch old stacks. "
-                      "Old stacks WILL NOT BE DELETED")
-                exit(1)
-            else:
-                sorted_stacks = sorted(all_stacks,
-                                       key=lambda stack: stack['creation_time'])
-                stacks_to_remove = sorted_stacks[:-versions_to_keep]
-                stacks_to_remove_counter = len(stacks_to_remove)
-                with Action('Deleting old stacks..'):
-                    print()
-                    for old_stack in stacks_to_remove:
-                        old_stack_id = '{stack_name}-{version}'.format_map(
-                            old_stack)
-                        if old_stack['status'] in COMPLETE_STATES:
-                            click.echo(' {}'.format(old_stack_id))
-                            try:
-                                lizzy.delete(old_stack_id, region=region)
-                                stacks_to_remove_counter -= 1
-                            except requests.ConnectionError as e:
-                                connection_error(e, fatal=False)
-                            except requests.HTTPError as e:
-                                agent_error(e, fatal=False)
-                        else:
-                            click.echo(' > {} current status is {} trying '
-                                       'again later'.format(old_stack_id,
-                                                            old_stack['status']))
-                if stacks_to_remove_counter > 0:
-                    time.sleep(5)
-
-        if datetime.datetime.utcnow() > end_time:
+
+        if cleanup is None:
+            error("Failed to fetch old stacks. "
+                  "Old stacks WILL NOT BE DELETED")
+            exit(1)
+        if cleanup.timed_out:
             click.echo('Timeout waiting for related stacks to be ready.')
+        completed = completed and not cleanup.failed and not cleanup.timed_out
+        events.emit('cleanup', removed=[stack.stack_id for stack in cleanup.removed],
+                    failed=sorted(cleanup.failed), timed_out=cleanup.timed_out)
+
+    if completed:
+        deployment.result = history.SUCCESS
+    events.emit('result', stack_id=stack_id, status=last_state)
 
 
 @main.command('list')
@@ -344,28 +577,32 @@ def create(definition: dict, version: str, parameter: tuple,
 @region_option
 @watch_option
 @output_option
+@page_size_option
+@from_snapshot_option
+@stream_events
 @display_user_friendly_agent_errors
 def list_stacks(stack_ref: List[str], all: bool, remote: str, region: str,
-                watch: int, output: str):
+                watch: int, output: str, page_size: Optional[int],
+                from_snapshot: Optional[str]):
     """List Lizzy stacks"""
-    lizzy = setup_lizzy_client(remote)
     stack_references = parse_stack_refs(stack_ref)
+    if not from_snapshot:
+        lizzy = setup_lizzy_client(remote)
 
+    cols = 'stack_name version status creation_time description'.split()
     while True:
-        rows = []
-        for stack in lizzy.get_stacks(stack_references, region=region):
-            creation_time = dateutil.parser.parse(stack['creation_time'])
-            rows.append({'stack_name': stack['stack_name'],
-                         'version': stack['version'],
-                         'status': stack['status'],
-                         'creation_time': creation_time.timestamp(),
-                         'description': stack['description']})
-
-        rows.sort(key=lambda x: (x['stack_name'], x['version']))
-        with OutputFormat(output):
-            print_table(
-                'stack_name version status creation_time description'.split(),
-                rows, styles=STYLES, titles=TITLES)
+        if from_snapshot:
+            stacks = load_snapshot(from_snapshot).stacks(region)
+            if stack_references:
+                stacks = match_stack_refs([StackReference(name, None) for name in stack_references],
+                                          stacks)
+        else:
+            stacks = lizzy.iter_stacks(stack_references, region=region,
+                                       page_size=page_size)
+        if output != 'ndjson':  # events are streamed as the stacks arrive
+            stacks = sorted(stacks, key=lambda stack: (stack.stack_name, stack.version))
+        print_rows(cols, (stack.as_row() for stack in stacks), output,
+                   styles=STYLES, titles=TITLES, event='stack', pager=not watch)
 
         if watch:  # pragma: no cover
             time.sleep(watch)
@@ -383,59 +620,159 @@ def list_stacks(stack_ref: List[str], all: bool, remote: str, region: str,
 @region_option
 @remote_option
 @output_option
+@from_snapshot_option
+@stream_events
 @display_user_friendly_agent_errors
 def traffic(stack_name: str,
             stack_version: Optional[str],
             percentage: Optional[int],
             region: Optional[str],
             remote: Optional[str],
-            output: Optional[str]):
+            output: Optional[str],
+            from_snapshot: Optional[str]):
     '''Manage stack traffic'''
-    lizzy = setup_lizzy_client(remote)
+    if from_snapshot and percentage is not None:
+        raise click.UsageError('Traffic can\'t be changed in a snapshot')
 
     if percentage is None:
-        stack_reference = [stack_name]
-
-        with Action('Requesting traffic info..'):
-            stack_weights = []
-            for stack in lizzy.get_stacks(stack_reference, region=region):
-                if stack['status'] in ['CREATE_COMPLETE', 'UPDATE_COMPLETE']:
-                    stack_id = '{stack_name}-{version}'.format_map(stack)
-                    traffic = lizzy.get_traffic(stack_id, region=region)
-                    stack_weights.append({
-                        'stack_name': stack_name,
-                        'version': stack['version'],
-                        'identifier': stack_id,
-                        'weight%': traffic['weight']
-                    })
+        if from_snapshot:
+            stack_weights = [TrafficWeight(stack_name, version, weight)
+                             for version, weight in load_snapshot(from_snapshot).weights(
+                                 stack_name, region).items()]
+        else:
+            lizzy = setup_lizzy_client(remote)
+            with Action('Requesting traffic info..'):
+                stack_weights = []
+                for stack in lizzy.get_stacks([stack_name], region=region):
+                    if stack.status in workflows.SERVING_STATES:
+                        traffic = lizzy.get_traffic(stack.stack_id, region=region)
+                        stack_weights.append(TrafficWeight(stack_name,
+                                                           stack.version,
+                                                           traffic['weight']))
         cols = 'stack_name version identifier weight%'.split()
-        with OutputFormat(output):
-            print_table(cols,
-                        sorted(stack_weights, key=lambda x: x['identifier']))
+        stack_weights.sort(key=lambda weight: weight.stack_id)
+        print_rows(cols, [weight.as_row() for weight in stack_weights], output,
+                   event='traffic')
     else:
+        lizzy = setup_lizzy_client(remote)
         with Action('Requesting traffic change..'):
-            stack_id = '{stack_name}-{stack_version}'.format_map(locals())
+            stack_id = make_stack_id(stack_name, stack_version)
             lizzy.traffic(stack_id, percentage, region=region)
+        events.emit('traffic_changed', stack_id=stack_id, weight=percentage)
 
 
-@main.command('scale')
+@main.command('rebalance')
 @click.argument('stack_name')
-@click.argument('stack_version')
-@click.argument('new_scale', type=click.IntRange(0, 999, clamp=True))
+@click.argument('assignments', nargs=-1, required=True, metavar='VERSION=PERCENTAGE...')
 @region_option
 @remote_option
+@output_option
+@stream_events
 @display_user_friendly_agent_errors
-def scale(stack_name: str,
-          stack_version: Optional[str],
-          new_scale: int,
+def rebalance(stack_name: str,
+              assignments: List[str],
+              region: Optional[str],
+              remote: Optional[str],
+              output: Optional[str]):
+    '''Set the traffic of all versions of a stack at once, versions left out get none'''
+    targets = {}
+    for assignment in assignments:
+        version, _, weight = assignment.partition('=')
+        try:
+            targets[version] = int(weight)
+        except ValueError:
+            raise click.UsageError('Invalid traffic weight "{}"'.format(assignment))
+        if not version or not 0 <= targets[version] <= 100:
+            raise click.UsageError('Invalid traffic weight "{}"'.format(assignment))
+
+    lizzy = setup_lizzy_client(remote)
+
+    def show_change(stack_id: str, weight: float):
+        action.progress()
+        events.emit('traffic_changed', stack_id=stack_id, weight=weight)
+
+    with Action('Rebalancing traffic of {stack_name}..', stack_name=stack_name) as action:
+        try:
+            result = workflows.rebalance_traffic(lizzy, stack_name, targets, region=region,
+                                                 on_change=show_change)
+        except InvalidTrafficWeights as e:
+            action.fatal_error(str(e))
+        except TrafficMismatch as e:
+            action.fatal_error('Final traffic differs: {}'.format(
+                ', '.join('{}={:.1f}'.format(stack_id, weight)
+                          for stack_id, weight in sorted(e.actual.items()))))
+    if result.batch:
+        info('Set all weights with a single request')
+    else:
+        info('Set the weights with {} traffic change(s)'.format(len(result.changes)))
+    for stack_id, weight in sorted(result.weights.items()):
+        events.emit('traffic', identifier=stack_id, weight=weight)
+
+
+@main.command('scale')
+@click.argument('targets', nargs=-1, metavar='[STACK_NAME STACK_VERSION NEW_SCALE]...')
+@click.option('--from-file', type=click.File('r'), metavar='PATH',
+              help='Read "STACK_NAME STACK_VERSION NEW_SCALE" lines from a file (- for stdin)')
+@click.option('-j', '--max-workers', type=click.IntRange(1, 64),
+              default=workflows.MAX_SCALE_WORKERS, show_default=True,
+              help='Maximum number of stacks rescaled at the same time')
+@region_option
+@remote_option
+@output_option
+@stream_events
+@display_user_friendly_agent_errors
+def scale(targets: List[str],
+          from_file,
+          max_workers: int,
           region: Optional[str],
-          remote: Optional[str]):
-    '''Rescale a stack'''
+          remote: Optional[str],
+          output: str):
+    '''Rescale one or many stacks'''
+    scale_targets = get_scale_targets(targets)
+    if from_file is not None:
+        scale_targets += read_scale_file(from_file)
+    if not scale_targets:
+        raise click.UsageError('No stacks to rescale')
+
     lizzy = setup_lizzy_client(remote)
 
-    with Action('Requesting rescale..'):
-        stack_id = '{stack_name}-{stack_version}'.format_map(locals())
-        lizzy.scale(stack_id, new_scale, region=region)
+    if len(scale_targets) == 1:
+        target, = scale_targets
+        with Action('Requesting rescale..'):
+            stack_id = make_stack_id(target.name, target.version)
+            lizzy.scale(stack_id, target.new_scale, region=region)
+        events.emit('scaled', stack_id=stack_id, scale=target.new_scale)
+        return
+
+    def show_result(result: workflows.ScaleResult):
+        if result.error is None:
+            events.emit('scaled', stack_id=result.stack_id, scale=result.new_scale)
+        else:
+            events.emit('error', stack_id=result.stack_id, message=str(result.error))
+
+    start = time.perf_counter()
+    results = workflows.scale_stacks(lizzy, scale_targets, region=region,
+                                     max_workers=max_workers, on_result=show_result)
+    duration = time.perf_counter() - start
+
+    if output != 'ndjson':
+        rows = [{'stack_id': result.stack_id,
+                 'new_scale': result.new_scale,
+                 'status': 'FAILED' if result.error else 'OK',
+                 'duration_ms': round(result.duration * 1000, 1),
+                 'error': str(result.error) if result.error else ''}
+                for result in results]
+        print_rows('stack_id new_scale status duration_ms error'.split(), rows, output,
+                   styles={'OK': {'fg': 'green'}, 'FAILED': {'fg': 'red'}})
+
+    failed = [result for result in results if result.error is not None]
+    events.emit('result', scaled=len(results) - len(failed), failed=len(failed),
+                duration_ms=round(duration * 1000, 3))
+    message = 'Rescaled {} of {} stacks in {:.2f}s'.format(len(results) - len(failed),
+                                                           len(results), duration)
+    if failed:
+        fatal_error(message)
+    info(message)
 
 
 @main.command()
@@ -445,37 +782,333 @@ def scale(stack_name: str,
 @click.option('-f', '--force', is_flag=True,
               help='Allow deleting multiple stacks')
 @remote_option
+@output_option
+@stream_events
 @display_user_friendly_agent_errors
 def delete(stack_ref: List[str],
-           region: str, dry_run: bool, force: bool, remote: str):
+           region: str, dry_run: bool, force: bool, remote: str, output: str):
     """Delete Cloud Formation stacks"""
     lizzy = setup_lizzy_client(remote)
     stack_refs = get_stack_refs(stack_ref)
     all_with_version = all(stack.version is not None
                            for stack in stack_refs)
 
-    # this is misleading but it's the current behaviour of senza
-    # TODO Lizzy list (stack_refs) to see if it actually matches more than one stack
-    # to match senza behaviour
-    if (not all_with_version and not dry_run and not force):
+    with Action('Looking up matching stacks..'):
+        stack_ids = workflows.resolve_stack_refs(lizzy, stack_refs, region=region)
+    if not stack_ids:
+        events.emit('error', message='No matching stack found')
+        fatal_error('Error: No matching stack found.')
+
+    # same safety check as senza
+    if not all_with_version and len(stack_ids) > 1 and not dry_run and not force:
         fatal_error(
-            'Error: {} matching stacks found. '.format(len(stack_refs)) +
+            'Error: {} matching stacks found. '.format(len(stack_ids)) +
             'Please use the "--force" flag if you really want to delete multiple stacks.')
 
     # TODO pass force option to agent
 
-    output = ''
-    for stack in stack_refs:
-        if stack.version is not None:
-            stack_id = '{stack.name}-{stack.version}'.format(stack=stack)
-        else:
-            stack_id = stack.name
-
+    for stack_id in stack_ids:
         with Action("Requesting stack '{stack_id}' deletion..",
                     stack_id=stack_id):
-            output = lizzy.delete(stack_id, region=region, dry_run=dry_run)
+            agent_output = lizzy.delete(stack_id, region=region, dry_run=dry_run)
+        events.emit('stack_deleted', stack_id=stack_id, dry_run=dry_run)
+        show_agent_output(agent_output, stack_id)
+
+
+def resolve_stacks_to_wait(lizzy: Lizzy, stack_refs: list, region: Optional[str]) -> List[str]:
+    """
+    Stack ids of the references, with stack names standing for their stacks
+    still in progress or, if none is, all their versions
+    """
+    if not stack_refs:
+        return []
+    names = list(OrderedDict.fromkeys(ref.name for ref in stack_refs))
+    stacks = lizzy.get_stacks(names, region=region)
+
+    stack_ids = []
+    for ref in stack_refs:
+        matched = match_stack_refs([ref], stacks)
+        if ref.version is None:
+            in_progress = [stack for stack in matched if not workflows.is_final_state(stack.status)]
+            matched = in_progress or matched
+        stack_ids.extend(stack.stack_id for stack in matched)
+    return list(OrderedDict.fromkeys(stack_ids))
+
+
+@main.command('wait')
+@click.argument('stack_ref', nargs=-1, required=True)
+@click.option('--interval', type=click.IntRange(1, None), default=workflows.WAIT_INTERVAL,
+              show_default=True, metavar='SECONDS', help='Seconds between polls')
+@click.option('--timeout', type=click.IntRange(1, None), default=3600, show_default=True,
+              metavar='SECONDS', help='Maximum seconds to wait for the stacks')
+@region_option
+@remote_option
+@output_option
+@stream_events
+@display_user_friendly_agent_errors
+def wait(stack_ref: List[str], interval: int, timeout: int,
+         region: Optional[str], remote: Optional[str], output: str):
+    """Wait until stacks are created, updated or deleted"""
+    lizzy = setup_lizzy_client(remote)
+    stack_ids = resolve_stacks_to_wait(lizzy, get_stack_refs(stack_ref), region)
+    if not stack_ids:
+        fatal_error('No matching stacks found')
+
+    view = progress.make_view(styles=STYLES) if output == 'text' else None
+    last_states = {}
+
+    def show_progress(states: dict):
+        for stack_id, state in states.items():
+            if last_states.get(stack_id) != state:
+                events.emit('state', stack_id=stack_id, state=state)
+        last_states.update(states)
+        if view is not None:
+            view.update(states)
+
+    start = time.perf_counter()
+    states = workflows.wait_for_stacks(lizzy, stack_ids, region=region, interval=interval,
+                                       timeout=timeout, on_update=show_progress)
+    duration = time.perf_counter() - start
+    if view is not None:
+        view.finish()
+
+    if output in ('json', 'tsv'):
+        rows = [{'stack_id': stack_id, 'status': state} for stack_id, state in states.items()]
+        print_rows(['stack_id', 'status'], rows, output, styles=STYLES)
+
+    succeeded = [stack_id for stack_id, state in states.items()
+                 if state in ('CREATE_COMPLETE', 'UPDATE_COMPLETE', workflows.DELETE_COMPLETE)]
+    pending = [stack_id for stack_id, state in states.items()
+               if not workflows.is_final_state(state)]
+    events.emit('result', succeeded=len(succeeded), pending=len(pending),
+                failed=len(states) - len(succeeded) - len(pending),
+                duration_ms=round(duration * 1000, 3))
+    message = '{} of {} stacks succeeded in {:.0f}s'.format(len(succeeded), len(states), duration)
+    if pending:
+        fatal_error('Timed out: ' + message)
+    if len(succeeded) < len(states):
+        fatal_error(message)
+    info(message)
+
+
+@main.command()
+@click.argument('path')
+@click.option('--region', 'regions', multiple=True, envvar='AWS_DEFAULT_REGION',
+              metavar='AWS_REGION_ID', help='AWS region ID (e.g. eu-west-1), can be given many times')
+@click.option('--full', is_flag=True,
+              help='Request the traffic of all stacks instead of reusing the weights in PATH')
+@click.option('--max-age', type=click.IntRange(0, None), default=snapshots.TRAFFIC_MAX_AGE,
+              metavar='SECS', show_default=True,
+              help='Request the traffic of stacks whose weights are older than this')
+@remote_option
+@page_size_option
+@output_option
+@stream_events
+@display_user_friendly_agent_errors
+def snapshot(path: str, regions: List[str], full: bool, max_age: int,
+             remote: Optional[str], page_size: Optional[int], output: str):
+    """
+    Save the stacks and their traffic to a file
+
+    If PATH already has a snapshot of the same agent, only the traffic of
+    the applications that changed since then is requested.
+    """
+    lizzy = setup_lizzy_client(remote)
+    previous = None
+    if not full and os.path.exists(path):
+        try:
+            previous = snapshots.load(path)
+        except snapshots.SnapshotError as e:
+            warning('{}, taking a full snapshot'.format(e))
+
+    with Action('Taking snapshot..'):
+        result, traffic_requests = snapshots.take(lizzy, regions or [None], previous=previous,
+                                                  max_age=max_age, page_size=page_size)
+        snapshots.save(result, path)
+    info('Saved {} stacks to {} ({} traffic requests)'.format(
+        len(result.entries), path, traffic_requests))
+    events.emit('snapshot', path=path, stacks=len(result.entries),
+                traffic_requests=traffic_requests)
+
+
+@main.command()
+@click.option('--stacks', type=click.IntRange(0, None), default=100,
+              help='Number of stacks served by the fake agent')
+@click.option('--latency', type=float, default=0, metavar='MS',
+              help='Milliseconds the fake agent waits before each response')
+@click.option('--iterations', type=click.IntRange(1, None), default=20,
+              help='Number of times each scenario is run')
+@click.option('--save', metavar='PATH', help='Write the results as JSON')
+@click.option('--baseline', metavar='PATH',
+              type=click.Path(exists=True, dir_okay=False),
+              help='JSON results to compare against')
+@click.option('--max-regression', type=float, default=20, metavar='PERCENT',
+              help='Fail if a scenario got slower than this versus the baseline')
+@output_option
+@stream_events
+def bench(stacks: int, latency: float, iterations: int, save: Optional[str],
+          baseline: Optional[str], max_regression: float, output: str):
+    """
+    Benchmark the client against a local fake agent
+    """
+    from . import bench as benchmarks  # starts a fake agent, only needed here
+
+    with Action('Running benchmarks..'):
+        report = benchmarks.run_benchmarks(stacks=stacks,
+                                           latency=latency / 1000,
+                                           iterations=iterations)
+
+    rows = [dict(report['results'][scenario], scenario=scenario)
+            for scenario in benchmarks.SCENARIOS]
+    print_rows('scenario iterations ops_per_s mean_ms p50_ms p90_ms p99_ms'.split(),
+               rows, output, event='benchmark')
+
+    if save:
+        with open(save, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+        info('Results written to {}'.format(save))
+
+    if baseline:
+        with open(baseline) as fd:
+            comparison = benchmarks.compare(report, json.load(fd), max_regression)
+        print_rows('scenario baseline_p50_ms p50_ms change% regression'.split(),
+                   comparison, output, event='comparison')
+        regressions = [row['scenario'] for row in comparison if row['regression']]
+        if regressions:
+            fatal_error('Slower than the baseline: {}'.format(', '.join(regressions)))
+
+
+@main.group('daemon')
+def daemon_group():
+    """
+    Manage the local lizzy daemon
+    """
+
+
+@daemon_group.command('start')
+@click.option('--socket', 'socket_path', metavar='PATH',
+              help='Unix socket to listen on')
+def daemon_start(socket_path: Optional[str]):
+    """
+    Run the daemon in the foreground
+    """
+    path = socket_path or daemon.socket_path()
+    info('Lizzy daemon listening on {}'.format(path))
+    daemon.serve(main, path)
+
+
+@daemon_group.command('stop')
+@click.option('--socket', 'socket_path', metavar='PATH',
+              help='Unix socket the daemon listens on')
+def daemon_stop(socket_path: Optional[str]):
+    """
+    Stop the running daemon
+    """
+    if daemon.stop(socket_path):
+        info('Lizzy daemon stopped')
+    else:
+        fatal_error('No lizzy daemon is running')
+
+
+@daemon_group.command('status')
+@click.option('--socket', 'socket_path', metavar='PATH',
+              help='Unix socket the daemon listens on')
+def daemon_status(socket_path: Optional[str]):
+    """
+    Show whether the daemon is running
+    """
+    status = daemon.status(socket_path)
+    if status is None:
+        fatal_error('No lizzy daemon is running')
+    print('Lizzy daemon running with PID {pid} ({commands_run} commands run)'.format_map(status))
 
-    print(output)
+
+@main.command()
+@click.argument('stack_name', nargs=-1)
+@click.option('--days', type=click.IntRange(1, None), metavar='DAYS',
+              help='Only use the deployments of the last DAYS days')
+@click.option('--include-failed', is_flag=True,
+              help='Include the durations of failed deployments')
+@output_option
+@stream_events
+def stats(stack_name: List[str], days: Optional[int], include_failed: bool, output: str):
+    """
+    Show how long the phases of past deployments took
+    """
+    since = time.time() - days * 24 * 60 * 60 if days else None
+    rows = history.summarize(history.read(), stack_name, since=since,
+                             include_failed=include_failed)
+    if not rows:
+        info('No deployments recorded in {}'.format(history.history_path()))
+        return
+    print_rows('stack_name phase deployments failed samples p50_s p90_s p99_s max_s'.split(),
+               rows, output, titles={'stack_name': 'Stack Name'}, event='stats')
+
+
+@main.group('completion')
+def completion_group():
+    """
+    Shell completion of commands, stack names and versions
+    """
+
+
+def write_completion_options():
+    """
+    Saves the commands and the options taking a value, by command name (None
+    for the global ones), for the completion
+    """
+    from . import completion
+
+    value_options = {}
+    for name, command in [(None, main)] + sorted(main.commands.items()):
+        value_options[name] = {opt
+                               for param in command.params
+                               if isinstance(param, click.Option) and not param.is_flag
+                               for opt in param.opts + param.secondary_opts}
+    completion.write_option_table(sorted(main.commands), value_options)
+
+
+@completion_group.command('script')
+@click.argument('shell', type=click.Choice(['bash', 'zsh']))
+def completion_script(shell: str):
+    """
+    Print the completion script, e.g. eval "$(lizzy completion script bash)"
+    """
+    from . import completion
+
+    write_completion_options()
+    click.echo(completion.SCRIPTS[shell], nl=False)
+
+
+@completion_group.command('candidates')
+@click.argument('words', nargs=-1)
+def completion_candidates(words: List[str]):
+    """
+    Print the completion candidates of the last word, using cached stacks
+    """
+    from . import completion
+
+    for candidate in completion.candidates(list(words)):
+        click.echo(candidate)
+
+
+@completion_group.command('refresh')
+@region_option
+@remote_option
+def completion_refresh(region: Optional[str], remote: Optional[str]):
+    """
+    Update the cached stack names and versions
+    """
+    from . import completion
+
+    write_completion_options()
+    path = completion.cache_path(remote or os.environ.get('LIZZY_URL', ''), region)
+    try:
+        lizzy = setup_lizzy_client(remote)
+        stacks = lizzy.get_stacks(region=region)
+        completion.write_cache(path, completion.group_versions(stacks))
+    finally:
+        completion.release_refresh(path)
 
 
 @main.command()
@@ -0,0 +1,255 @@
+"""
+Shell completion
+
+Stack names and versions are completed from a small JSON cache in
+``LIZZY_HOME``, one file per agent and region. Completing never talks to the
+agent: when the cache is missing or older than :data:`CACHE_TTL` whatever is
+cached is used and a detached ``lizzy completion refresh`` process updates it
+for the next TAB press.
+
+The shell scripts run ``lizzy-complete``, which only imports this module. The
+commands and their options are read from a table the full command line writes
+next to the caches, see :func:`read_option_table`.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .configuration import Configuration
+from .version import VERSION
+
+CACHE_TTL = 300  # seconds
+REFRESH_LOCK_TTL = 60  # seconds a refresh is assumed to be still running
+
+# commands whose arguments are stack names and versions
+STACK_COMMANDS = {'delete', 'list', 'scale', 'traffic', 'wait'}
+
+BASH_SCRIPT = '''\
+_lizzy_completion() {
+    local IFS=$'\\n'
+    COMPREPLY=( $(lizzy-complete -- "${COMP_WORDS[@]:1:$COMP_CWORD}" 2>/dev/null) )
+}
+complete -o default -F _lizzy_completion lizzy please pretty-please
+'''
+
+ZSH_SCRIPT = '''\
+#compdef lizzy please pretty-please
+_lizzy() {
+    local -a candidates
+    candidates=("${(@f)$(lizzy-complete -- "${(@)words[2,$CURRENT]}" 2>/dev/null)}")
+    compadd -a candidates
+}
+compdef _lizzy lizzy please pretty-please
+'''
+
+SCRIPTS = {'bash': BASH_SCRIPT, 'zsh': ZSH_SCRIPT}
+
+
+def cache_path(agent_url: str, region: Optional[str]) -> str:
+    key = '{}|{}'.format(agent_url, region or '')
+    name = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(Configuration().home_dir, 'completion', name + '.json')
+
+
+def option_table_path() -> str:
+    return os.path.join(Configuration().home_dir, 'completion', 'options.json')
+
+
+def read_cache(path: str) -> Optional[dict]:
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: dict):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as fd:
+        json.dump(data, fd)
+    os.replace(fd.name, path)
+
+
+def write_cache(path: str, stacks: Dict[str, List[str]]):
+    """
+    Atomically replaces the cache with the versions of each stack name
+    """
+    _write_json(path, {'fetched_at': time.time(), 'stacks': stacks})
+
+
+def write_option_table(commands: List[str], value_options: Dict[Optional[str], set]):
+    """
+    Saves the commands and the options taking a value, by command name (None
+    for the global ones), for this version of the client
+    """
+    _write_json(option_table_path(),
+                {'version': VERSION,
+                 'commands': commands,
+                 'value_options': {name or '': sorted(options) for name, options in value_options.items()}})
+
+
+def read_option_table() -> Optional[tuple]:
+    """
+    Returns the commands and options saved by :func:`write_option_table`, or
+    None if there are none for this version of the client
+    """
+    table = read_cache(option_table_path())
+    if table is None or table.get('version') != VERSION:
+        return None
+    value_options = {name or None: set(options) for name, options in table['value_options'].items()}
+    return table['commands'], value_options
+
+
+def is_stale(cache: Optional[dict], ttl: float=CACHE_TTL) -> bool:
+    return cache is None or time.time() - cache.get('fetched_at', 0) > ttl
+
+
+def group_versions(stacks: Iterable) -> Dict[str, List[str]]:
+    versions = {}
+    for stack in stacks:
+        versions.setdefault(stack.stack_name, []).append(stack.version)
+    return {name: sorted(stack_versions) for name, stack_versions in versions.items()}
+
+
+def _claim_refresh(path: str) -> bool:
+    """
+    Makes sure only one refresh of the cache runs at a time
+    """
+    lock_path = path + '.lock'
+    os.makedirs(os.path.dirname(lock_path), mode=0o700, exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(lock_path) > REFRESH_LOCK_TTL:
+            os.unlink(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+    except FileExistsError:
+        return False
+    return True
+
+
+def release_refresh(path: str):
+    try:
+        os.unlink(path + '.lock')
+    except OSError:
+        pass
+
+
+def spawn_refresh(path: str, remote: Optional[str], region: Optional[str]):
+    """
+    Starts a detached ``lizzy completion refresh`` unless one is running
+    """
+    import subprocess  # only needed once in a while
+
+    if not _claim_refresh(path):
+        return
+    args = [sys.executable, '-m', 'lizzy_client', 'completion', 'refresh']
+    if remote:
+        args += ['--remote', remote]
+    if region:
+        args += ['--region', region]
+    env = dict(os.environ, LIZZY_NO_DAEMON='1')
+    try:
+        subprocess.Popen(args, env=env, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError:
+        release_refresh(path)
+
+
+def parse_words(words: List[str], value_options: Dict[str, set]) -> (Optional[str], List[str], dict):
+    """
+    Splits the words before the cursor into the command, its positional
+    arguments and the values of its options
+    """
+    command = None
+    arguments = []
+    options = {}
+    expecting = None
+    for word in words:
+        if expecting is not None:
+            options[expecting] = word
+            expecting = None
+        elif word.startswith('-'):
+            name, _, value = word.partition('=')
+            if name in value_options.get(command, ()):
+                if value:
+                    options[name] = value
+                else:
+                    expecting = name
+        elif command is None:
+            command = word
+        else:
+            arguments.append(word)
+    return command, arguments, options
+
+
+def complete(words: List[str], commands: List[str], value_options: Dict[str, set],
+             stacks: Dict[str, List[str]]) -> List[str]:
+    """
+    Candidates for the last of ``words``, the one being completed
+    """
+    *previous, incomplete = words or ['']
+    command, arguments, _ = parse_words(previous, value_options)
+    if previous and previous[-1] in value_options.get(command, ()):
+        return []  # completing the value of an option
+    if incomplete.startswith('-'):
+        return []
+    if command is None:
+        candidates = commands
+    elif command not in STACK_COMMANDS:
+        return []
+    elif not arguments or command == 'list':
+        candidates = sorted(stacks)
+    elif command in ('scale', 'traffic'):
+        candidates = stacks.get(arguments[0], []) if len(arguments) == 1 else []
+    else:  # delete and wait take a name followed by versions
+        candidates = stacks.get(arguments[0], [])
+    return [candidate for candidate in candidates if candidate.startswith(incomplete)]
+
+
+def candidates(words: List[str]) -> List[str]:
+    """
+    Candidates for the last of the ``words`` typed after ``lizzy``, starting
+    a refresh of the cached stacks if they are old
+    """
+    table = read_option_table()
+    if table is None:
+        # first completion after installing or upgrading the client
+        from .cli import write_completion_options
+        write_completion_options()
+        table = read_option_table()
+    commands, value_options = table
+
+    command, _, options = parse_words(words[:-1], value_options)
+    stacks = {}
+    if command in STACK_COMMANDS:
+        remote = options.get('--remote') or options.get('-r')
+        region = options.get('--region') or os.environ.get('AWS_DEFAULT_REGION')
+        agent_url = remote or os.environ.get('LIZZY_URL')
+        if agent_url:
+            path = cache_path(agent_url, region)
+            cache = read_cache(path)
+            if is_stale(cache):
+                spawn_refresh(path, remote, region)
+            stacks = (cache or {}).get('stacks', {})
+    return complete(words, commands, value_options, stacks)
+
+
+def main():
+    """
+    Prints the candidates for the words given after ``--``, the entry point of
+    ``lizzy-complete``
+    """
+    words = sys.argv[1:]
+    if words[:1] == ['--']:
+        words = words[1:]
+    for candidate in candidates(words):
+        print(candidate)
@@ -11,6 +11,8 @@ Unless required by applicable law or agreed to in writing, software distributed
  language governing permissions and limitations under the License.
 """
 
+import os.path
+
 from environmental import Str
 
 
@@ -20,3 +22,4 @@ class Configuration:
     token_url = Str('OAUTH2_ACCESS_TOKEN_URL')
     credentials_dir = Str('CREDENTIALS_DIR', '/meta/credentials')
     kairosdb_url = Str('KAIROSDB_URL')
+    home_dir = Str('LIZZY_HOME', os.path.expanduser('~/.lizzy'))
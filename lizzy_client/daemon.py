@@ -0,0 +1,329 @@
+"""
+Long-lived local lizzy process
+
+The daemon listens on a Unix socket and runs the commands forwarded by
+``main_with_metrics`` in its already warmed up process, so imports, the
+configuration, the access token and the connections to the agent are only
+paid for once.
+
+Commands are run one at a time, as each one takes over the process' working
+directory, environment and standard streams while it runs. After the JSON
+request line, both sides exchange frames of a one byte channel, the payload
+length and the payload:
+
+* ``o`` and ``e``: output of the command, written to stdout and stderr as
+  it is produced
+* ``r``: the command reads up to the given number of bytes of stdin, the
+  client answers with an ``i`` frame, empty at the end of the input
+* ``x``: the command finished with the given exit code
+"""
+
+import io
+import json
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import traceback
+from typing import BinaryIO, Optional, Tuple
+
+import click
+
+from .configuration import Configuration
+
+# commands that make no sense to run in the daemon
+LOCAL_COMMANDS = {'completion', 'daemon'}
+# options of commands that never end or measure the process, with or
+# without an attached value (--watch=5, -w5)
+LOCAL_OPTIONS = {'-w', '--watch', '--profile'}
+
+STDOUT, STDERR, STDIN, READ, EXIT = b'o', b'e', b'i', b'r', b'x'
+_HEADER = struct.Struct('!cI')
+
+# Lizzy clients kept by the daemon, by agent URL
+clients = {}
+
+_serving = False
+
+
+def is_serving() -> bool:
+    """
+    Whether the current process is a daemon serving commands
+    """
+    return _serving
+
+
+def socket_path() -> str:
+    config = Configuration()
+    return os.environ.get('LIZZY_DAEMON_SOCKET',
+                          os.path.join(config.home_dir, 'daemon.sock'))
+
+
+def _send(path: str, request: dict, timeout: Optional[float]=None) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as response:
+            return json.loads(response.readline().decode())
+
+
+def write_frame(connection: socket.socket, channel: bytes, payload: bytes=b''):
+    connection.sendall(_HEADER.pack(channel, len(payload)) + payload)
+
+
+def read_frame(stream: BinaryIO) -> Tuple[Optional[bytes], bytes]:
+    """
+    Returns the channel and payload of the next frame, ``(None, b'')`` once
+    the other side closed the connection
+    """
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None, b''
+    channel, length = _HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None, b''
+    return channel, payload
+
+
+def runs_locally(args: list) -> bool:
+    """
+    Whether the command has to run in the calling process
+    """
+    for arg in args:
+        if arg in LOCAL_COMMANDS:
+            return True
+        for option in LOCAL_OPTIONS:
+            if option.startswith('--'):
+                if arg == option or arg.startswith(option + '='):
+                    return True
+            elif arg.startswith(option) and not arg.startswith('--'):
+                return True
+    return False
+
+
+def _isatty(stream) -> bool:
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def forward(args: list, path: Optional[str]=None) -> Optional[int]:
+    """
+    Runs the command in the daemon, passing its output and input through as
+    it goes, and returns its exit code, or None if no daemon is running or
+    the command has to run locally.
+    """
+    if os.environ.get('LIZZY_NO_DAEMON') or runs_locally(args):
+        return None
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+
+    env = dict(os.environ)
+    ttys = {'stdin': _isatty(sys.stdin), 'stdout': _isatty(sys.stdout), 'stderr': _isatty(sys.stderr)}
+    if ttys['stdout']:
+        # the daemon has no terminal to measure
+        columns, lines = shutil.get_terminal_size()
+        env.setdefault('COLUMNS', str(columns))
+        env.setdefault('LINES', str(lines))
+    request = {'args': args, 'cwd': os.getcwd(), 'env': env, 'tty': ttys}
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        connection.close()
+        return None
+
+    stdin, outputs = sys.stdin, {STDOUT: sys.stdout, STDERR: sys.stderr}
+    with connection, connection.makefile('rb') as stream:
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        while True:
+            channel, payload = read_frame(stream)
+            if channel is None:
+                click.echo('The lizzy daemon closed the connection', err=True)
+                return 1
+            if channel == EXIT:
+                return int(payload)
+            if channel == READ:
+                data = stdin.buffer.read1(int(payload)) if stdin else b''
+                write_frame(connection, STDIN, data)
+            elif channel in outputs:
+                output = outputs[channel]
+                output.flush()
+                output.buffer.write(payload)
+                output.buffer.flush()
+
+
+def status(path: Optional[str]=None) -> Optional[dict]:
+    try:
+        return _send(path or socket_path(), {'action': 'status'}, timeout=5)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+
+
+def stop(path: Optional[str]=None) -> bool:
+    try:
+        _send(path or socket_path(), {'action': 'stop'}, timeout=5)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    return True
+
+
+class _ChannelWriter(io.RawIOBase):
+    """
+    Output stream of a forwarded command, sent to the client as it is written
+    """
+
+    def __init__(self, connection: socket.socket, channel: bytes, tty: bool):
+        self.connection = connection
+        self.channel = channel
+        self.tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data) -> int:
+        write_frame(self.connection, self.channel, bytes(data))
+        return len(data)
+
+
+class _ChannelReader(io.RawIOBase):
+    """
+    Input stream of a forwarded command, read from the client on demand
+    """
+
+    def __init__(self, connection: socket.socket, stream: BinaryIO):
+        self.connection = connection
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        # the daemon can't drive the client's terminal, e.g. with a pager
+        return False
+
+    def readinto(self, buffer) -> int:
+        write_frame(self.connection, READ, str(len(buffer)).encode())
+        channel, payload = read_frame(self.stream)
+        if channel != STDIN:
+            return 0
+        buffer[:len(payload)] = payload
+        return len(payload)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode())
+        if request.get('action', 'run') == 'run':
+            self.server.run_command(request, self.connection, self.rfile)
+            return
+        response = self.server.handle_request_data(request)
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """
+    Runs the forwarded commands with ``command``, the click entry point
+    """
+
+    def __init__(self, path: str, command: click.BaseCommand):
+        self.path = path
+        self.command = command
+        self.commands_run = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            if status(path) is not None:
+                raise click.UsageError('A lizzy daemon is already listening on {}'.format(path))
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+    def handle_request_data(self, request: dict) -> dict:
+        action = request.get('action', 'run')
+        if action == 'status':
+            return {'pid': os.getpid(), 'commands_run': self.commands_run}
+        if action == 'stop':
+            threading.Thread(target=self.shutdown).start()
+            return {'stopped': True}
+        raise ValueError('Unknown action: {}'.format(action))
+
+    def run_command(self, request: dict, connection: socket.socket, stream: BinaryIO):
+        """
+        Runs the command with the client's environment, working directory and
+        standard streams and sends its exit code
+        """
+        ttys = request.get('tty', {})
+        stdin = io.TextIOWrapper(io.BufferedReader(_ChannelReader(connection, stream)), encoding='utf-8')
+        stdout, stderr = (io.TextIOWrapper(io.BufferedWriter(_ChannelWriter(connection, channel,
+                                                                            bool(ttys.get(name)))),
+                                           encoding='utf-8', line_buffering=True)
+                          for channel, name in ((STDOUT, 'stdout'), (STDERR, 'stderr')))
+
+        old_streams = sys.stdin, sys.stdout, sys.stderr
+        old_environ = dict(os.environ)
+        cwd = os.getcwd()
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        os.environ.clear()
+        os.environ.update(request.get('env', {}))
+        try:
+            os.chdir(request.get('cwd', cwd))
+            self.command.main(request['args'], prog_name='lizzy')
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                click.echo(e.code, err=True)
+                exit_code = 1
+        except Exception:
+            try:
+                traceback.print_exc()
+            except OSError:
+                pass
+            exit_code = 1
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(old_environ)
+            sys.stdin, sys.stdout, sys.stderr = old_streams
+            self.commands_run += 1
+
+        try:
+            for output in (stdout, stderr):
+                output.flush()
+            write_frame(connection, EXIT, str(exit_code).encode())
+        except OSError:
+            pass  # the client is gone, e.g. interrupted
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(command: click.BaseCommand, path: Optional[str]=None):
+    global _serving
+
+    server = DaemonServer(path or socket_path(), command)
+    _serving = True
+    try:
+        server.serve_forever()
+    finally:
+        _serving = False
+        for lizzy in clients.values():
+            lizzy.session.close()
+        clients.clear()
+        server.server_close()
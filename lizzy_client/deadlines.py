@@ -0,0 +1,111 @@
+"""
+Deadlines of agent operations
+
+A deadline bounds the time that all the agent requests and waits inside a
+block may take, e.g. every step of a deployment::
+
+    with deadline(600):
+        deploy(lizzy, definition, 'v42')
+
+Deadlines are kept per thread, so concurrent operations sharing a
+:class:`lizzy_client.lizzy.Lizzy` client don't affect each other. Work handed
+to other threads keeps the deadline of the caller with :func:`bind`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional, Tuple
+
+from .exceptions import DeadlineExceeded
+
+_local = threading.local()
+
+
+def current() -> Optional[float]:
+    """
+    Returns the deadline of the thread as a ``time.monotonic`` value
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns the seconds left until the deadline, if there is one
+    """
+    end = current()
+    return None if end is None else end - time.monotonic()
+
+
+@contextmanager
+def at(end: Optional[float]):
+    """
+    Runs the block with the ``time.monotonic`` deadline ``end``, or the
+    deadline already set if it is earlier
+    """
+    previous = current()
+    if previous is not None and (end is None or previous < end):
+        end = previous
+    _local.deadline = end
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def deadline(seconds: Optional[float]):
+    """
+    Runs the block with a deadline ``seconds`` from now, ``None`` for none
+    """
+    return at(None if seconds is None else time.monotonic() + seconds)
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(operation: str='Operation'):
+    """
+    :raises DeadlineExceeded: if the deadline passed
+    """
+    if expired():
+        raise DeadlineExceeded(operation)
+
+
+def bound(seconds: float) -> float:
+    """
+    Returns ``seconds`` or the time left until the deadline if that's shorter,
+    0 once it passed
+    """
+    left = remaining()
+    return seconds if left is None else max(min(seconds, left), 0)
+
+
+def bound_timeout(timeout: Tuple[float, float], operation: str='Operation') -> Tuple[float, float]:
+    """
+    Shortens the ``(connect, read)`` timeout of a request to the time left
+
+    :raises DeadlineExceeded: if no time is left, requests rejects a timeout
+                              of 0
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(operation)
+    connect, read = timeout
+    return bound(connect), bound(read)
+
+
+def bind(function: Callable) -> Callable:
+    """
+    Returns ``function`` running with the deadline of the calling thread,
+    to be run by another thread
+    """
+    end = current()
+
+    @wraps(function)
+    def with_deadline(*args, **kwargs):
+        with at(end):
+            return function(*args, **kwargs)
+    return with_deadline
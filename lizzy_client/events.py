@@ -0,0 +1,84 @@
+"""
+Newline delimited JSON (NDJSON) event stream
+
+With ``-o ndjson`` commands write one JSON object per line to stdout as things
+happen: state transitions, agent output, HTTP requests with their timings and
+the final results. Code reports events with :func:`emit`, which does nothing
+unless an :class:`EventStream` is active.
+"""
+
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Optional
+
+from . import tracing
+
+_active = None  # type: Optional[EventStream]
+
+
+def emit(event: str, **data):
+    if _active is not None:
+        _active.emit(event, **data)
+
+
+def is_streaming() -> bool:
+    return _active is not None
+
+
+class EventStream:
+    """
+    Streams the events of ``command`` to the current stdout.
+
+    While the stream is active everything else printed to stdout, like the
+    human-readable progress, is sent to stderr instead.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.stream = None
+        self._redirect = None
+        self._started_at = None
+
+    def emit(self, event: str, **data):
+        data['event'] = event
+        data['time'] = round(time.time(), 6)
+        self.stream.write(json.dumps(data, sort_keys=True, default=str) + '\n')
+        self.stream.flush()
+
+    def on_phase(self, name: str, start: float, duration: float):
+        self.emit('phase', name=name, duration_ms=round(duration * 1000, 3))
+
+    def on_request(self, method: str, url: str, status: Optional[int],
+                   size: Optional[int], start: float, duration: float):
+        self.emit('request', method=method, url=url, status=status,
+                  bytes=size, duration_ms=round(duration * 1000, 3))
+
+    def __enter__(self) -> 'EventStream':
+        global _active
+        self.stream = sys.stdout
+        self._redirect = redirect_stdout(sys.stderr)
+        self._redirect.__enter__()
+        self._started_at = time.perf_counter()
+        _active = self
+        tracing.add_recorder(self)
+        self.emit('start', command=self.command)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active
+        if exc_type is None:
+            exit_code = 0
+        elif issubclass(exc_type, SystemExit):
+            exit_code = (exc_val.code or 0) if isinstance(exc_val.code, (int, type(None))) else 1
+        else:
+            exit_code = 1
+        end = {'command': self.command, 'exit_code': exit_code,
+               'duration_ms': round((time.perf_counter() - self._started_at) * 1000, 3)}
+        if exc_type is not None and not issubclass(exc_type, SystemExit):
+            end['error'] = repr(exc_val)
+        self.emit('end', **end)
+        tracing.remove_recorder(self)
+        _active = None
+        self._redirect.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,71 @@
+"""
+Errors raised by the lizzy client workflows
+"""
+
+from typing import Optional
+
+
+class LizzyError(Exception):
+    """
+    Base class for the errors of the lizzy client
+    """
+
+
+class DeploymentError(LizzyError):
+    """
+    The new stack did not reach a successful final state
+    """
+
+    def __init__(self, stack_id: str, final_status: Optional[str]):
+        self.stack_id = stack_id
+        self.final_status = final_status
+        super().__init__('Deployment of {} failed: {}'.format(stack_id, final_status))
+
+
+class StackRolledBack(DeploymentError):
+    """
+    Cloud Formation rolled the new stack back
+    """
+
+    def __init__(self, stack_id: str, final_status: str='ROLLBACK_COMPLETE'):
+        super().__init__(stack_id, final_status)
+        self.args = ('Stack {} was rolled back after deployment'.format(stack_id),)
+
+
+class TrafficChangeError(LizzyError):
+    """
+    The stack was deployed but its traffic could not be changed
+    """
+
+    def __init__(self, stack_id: str, cause: Exception):
+        self.stack_id = stack_id
+        self.cause = cause
+        super().__init__('Failed to change traffic of {}: {}'.format(stack_id, cause))
+
+
+class InvalidTrafficWeights(LizzyError):
+    """
+    The requested traffic distribution can't be applied
+    """
+
+
+class TrafficMismatch(LizzyError):
+    """
+    The traffic weights after a change differ from the requested ones
+    """
+
+    def __init__(self, stack_name: str, expected: dict, actual: dict):
+        self.stack_name = stack_name
+        self.expected = expected
+        self.actual = actual
+        super().__init__('Traffic of {} is {} instead of {}'.format(stack_name, actual, expected))
+
+
+class DeadlineExceeded(LizzyError):
+    """
+    An operation didn't finish before its deadline
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        super().__init__('{} exceeded its deadline'.format(operation))
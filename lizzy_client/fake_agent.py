@@ -0,0 +1,512 @@
+"""
+Local stand-in for a Lizzy agent
+
+Serves the ``/api/stacks`` endpoints used by :class:`lizzy_client.lizzy.Lizzy`,
+an OAuth2 token endpoint and a KairosDB-like metrics sink from a single local
+HTTP server, so the client can be exercised without any remote service.
+
+New and deleted stacks can go through Cloud Formation like progress states,
+which can also be pushed as Server-Sent Events, and requests can be slowed
+down or fail at a given rate. Run it standalone
+for load tests with::
+
+    python -m lizzy_client.fake_agent --stacks 1000 --latency 0.02 --error-rate 0.01
+"""
+
+import datetime
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import click
+import yaml
+
+from .models import make_stack_id
+
+TOKEN_PATH = '/oauth2/access_token'
+METRICS_PATH = '/api/v1/datapoints'
+STACK_PATH = re.compile(r'^/api/stacks/(?P<stack_id>[^/]+)(?P<traffic>/traffic)?$')
+OUTPUT_PATH = re.compile(r'^/api/outputs/(?P<output_id>\d+)$')
+EVENTS_PATH = '/api/events'
+KEEP_ALIVE_INTERVAL = 15  # seconds between comments on idle event streams
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients hanging up, e.g. after a timeout, are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeLizzy'
+
+    @property
+    def agent(self) -> 'FakeAgent':
+        return self.server.agent
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _read_json(self) -> dict:
+        body = self._read_body()
+        return json.loads(body.decode()) if body else {}
+
+    def _send(self, status: int, body=None, headers: Optional[dict]=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if self.agent.events and self.path.startswith('/api/stacks'):
+            self.send_header('X-Lizzy-Events', EVENTS_PATH)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _not_found(self, what: str):
+        self._send(404, {'detail': '{} not found'.format(what)})
+
+    def _dispatch(self, method: str):
+        self.agent.wait_latency()
+        with self.agent.lock:
+            self.agent.request_count += 1
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        token = self.headers.get('Authorization', '').partition('Bearer ')[2]
+        if url.path.startswith(('/api/stacks', '/api/outputs', EVENTS_PATH)) and \
+                token in self.agent.expired_tokens:
+            self._read_body()
+            return self._send(401, {'detail': 'Invalid token'})
+
+        if url.path.startswith('/api/stacks') and self.agent.should_fail():
+            self._read_body()  # keep the connection usable
+            return self._send(503, {'detail': 'Simulated failure'})
+
+        if url.path == TOKEN_PATH and method == 'POST':
+            self._read_body()
+            with self.agent.lock:
+                self.agent.token_requests += 1
+            return self._send(200, {'access_token': self.agent.access_token,
+                                    'expires_in': 3600,
+                                    'token_type': 'Bearer'})
+        if url.path == METRICS_PATH and method == 'POST':
+            self.agent.metrics.extend(self._read_json() or [])
+            return self._send(204)
+
+        if url.path == '/api/stacks':
+            if method == 'GET':
+                return self._send(200, self.agent.list_stacks(query.get('references')))
+            if method == 'POST':
+                return self._create_stack(self._read_json())
+
+        if url.path == EVENTS_PATH and method == 'GET' and self.agent.events:
+            return self._stream_events(query['stack_id'])
+
+        match = OUTPUT_PATH.match(url.path)
+        if match and method == 'GET':
+            return self._stream_output(int(match.group('output_id')))
+
+        match = STACK_PATH.match(url.path)
+        if match:
+            stack_id = match.group('stack_id')
+            if match.group('traffic') and method == 'GET':
+                return self._get_traffic(stack_id)
+            if match.group('traffic') and method == 'PATCH' and self.agent.batch_traffic:
+                return self._set_traffic_weights(stack_id, self._read_json())
+            if method == 'GET':
+                return self._get_stack(stack_id)
+            if method == 'PATCH':
+                return self._patch_stack(stack_id, self._read_json())
+            if method == 'DELETE':
+                return self._delete_stack(stack_id, self._read_json())
+
+        self._not_found(url.path)
+
+    def _get_stack(self, stack_id: str):
+        stack = self.agent.read_stack(stack_id)
+        if stack is None:
+            return self._not_found(stack_id)
+        self._send(200, stack)
+
+    def _get_traffic(self, stack_id: str):
+        if stack_id not in self.agent.stacks:
+            return self._not_found(stack_id)
+        self._send(200, {'weight': self.agent.weights.get(stack_id, 0.0)})
+
+    def _set_traffic_weights(self, stack_name: str, data: dict):
+        weights = data.get('weights', {})
+        stack_ids = {stack_id for stack_id, stack in self.agent.stacks.items()
+                     if stack['stack_name'] == stack_name}
+        if not stack_ids or not set(weights) <= stack_ids:
+            return self._not_found(stack_name)
+        with self.agent.lock:
+            for stack_id in stack_ids:
+                self.agent.weights[stack_id] = float(weights.get(stack_id, 0))
+        self._send(200, {stack_id: self.agent.weights[stack_id] for stack_id in stack_ids})
+
+    def _create_stack(self, data: dict):
+        definition = yaml.safe_load(data.get('senza_yaml') or '{}') or {}
+        try:
+            stack_name = definition['SenzaInfo']['StackName']
+        except (KeyError, TypeError):
+            return self._send(400, {'detail': 'SenzaInfo.StackName is missing'})
+        stack = self.agent.add_stack(stack_name, data['stack_version'],
+                                     dry_run=data.get('dry_run', False),
+                                     statuses=self.agent.create_statuses())
+        output = ['Generating Cloud Formation template.. OK',
+                  'Creating Cloud Formation stack {}.. OK'.format(stack['stack_name'])]
+        self._send(201, stack, headers=self.agent.output_headers(output))
+
+    def _patch_stack(self, stack_id: str, data: dict):
+        if stack_id not in self.agent.stacks:
+            return self._not_found(stack_id)
+        if 'new_traffic' in data:
+            self.agent.set_traffic(stack_id, float(data['new_traffic']))
+        if 'new_scale' in data:
+            self.agent.scales[stack_id] = data['new_scale']
+        self._send(200, self.agent.stacks[stack_id])
+
+    def _delete_stack(self, stack_id: str, data: dict):
+        if stack_id not in self.agent.stacks:
+            return self._not_found(stack_id)
+        if not data.get('dry_run'):
+            self.agent.delete_stack(stack_id)
+        output = ['Deleting Cloud Formation stack {}.. OK'.format(stack_id)]
+        self._send(200, {}, headers=self.agent.output_headers(output))
+
+    def _stream_output(self, output_id: int):
+        lines = self.agent.outputs.pop(output_id, None)
+        if lines is None:
+            return self._not_found('Output {}'.format(output_id))
+        self._start_chunked('text/plain; charset=utf-8')
+        for line in lines:
+            if line is None:  # drop the connection in the middle of the output
+                self.close_connection = True
+                return
+            self._write_chunk((line + '\n').encode())
+        self._write_chunk(b'')
+
+    def _stream_events(self, stack_id: str):
+        """
+        Pushes the states of the stack, moving it to its next state every
+        ``event_interval`` seconds, until it reaches a final one
+        """
+        if self.agent.read_stack(stack_id) is None:
+            return self._not_found(stack_id)
+        with self.agent.lock:
+            self.agent.event_streams += 1
+        self._start_chunked('text/event-stream')
+        last_status = None
+        last_write = time.monotonic()
+        while not self.agent.stopped.wait(self.agent.event_interval):
+            stack = self.agent.read_stack(stack_id)
+            status = stack['status'] if stack is not None else 'DELETE_COMPLETE'
+            if status != last_status:
+                event = {'stack_id': stack_id, 'status': status}
+                self._write_chunk('event: stack\ndata: {}\n\n'.format(json.dumps(event)).encode())
+                last_status, last_write = status, time.monotonic()
+                if status.endswith('_COMPLETE') or status.endswith('_FAILED'):
+                    break
+            elif time.monotonic() - last_write > KEEP_ALIVE_INTERVAL:
+                self._write_chunk(b': keep-alive\n\n')
+                last_write = time.monotonic()
+        self._write_chunk(b'')
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+class FakeAgent:
+    """
+    Serves a fake Lizzy agent from a background thread::
+
+        with FakeAgent(stacks=100, latency=0.01) as agent:
+            lizzy = Lizzy(agent.url, agent.access_token)
+
+    :param stacks: number of stacks to create on start
+    :param latency: seconds to wait before answering each request
+    :param batch_traffic: whether all weights of an application can be set
+                          with a single request
+    :param create_polls: number of reads that see a new stack in
+                         CREATE_IN_PROGRESS before it reaches ``final_status``
+    :param final_status: final status of new stacks, e.g. ROLLBACK_COMPLETE
+    :param delete_polls: number of reads that see a deleted stack in
+                         DELETE_IN_PROGRESS before it's gone
+    :param error_rate: fraction of the ``/api/stacks`` requests that fail with
+                       503 Service Unavailable
+    :param seed: seed of the random failures
+    :param stream_output: whether the senza output is streamed from a
+                          separate endpoint (``X-Lizzy-Output-Location``)
+                          besides being sent in the ``X-Lizzy-Output`` header
+    :param events: whether the states of stacks are pushed as Server-Sent
+                   Events (advertised with ``X-Lizzy-Events``)
+    :param event_interval: seconds between the states pushed to a stream
+    """
+
+    def __init__(self, stacks: int=0, latency: float=0.0,
+                 host: str='127.0.0.1', port: int=0, batch_traffic: bool=False,
+                 create_polls: int=0, final_status: str='CREATE_COMPLETE',
+                 delete_polls: int=0, error_rate: float=0.0,
+                 seed: Optional[int]=None, stream_output: bool=False,
+                 events: bool=False, event_interval: float=0.05):
+        self.latency = latency
+        self.batch_traffic = batch_traffic
+        self.create_polls = create_polls
+        self.final_status = final_status
+        self.delete_polls = delete_polls
+        self.error_rate = error_rate
+        self.stream_output = stream_output
+        self.events = events
+        self.event_interval = event_interval
+        self.event_streams = 0
+        self.stopped = threading.Event()
+        self.outputs = {}
+        self._output_ids = itertools.count()
+        self.failures = 0  # number of next requests to fail
+        self.errors_served = 0
+        self._random = random.Random(seed)
+        self._progress = {}
+        self.access_token = 'FAKE-TOKEN'
+        self.expired_tokens = set()
+        self._token_generation = 0
+        self.lock = threading.Lock()
+        self.stacks = {}
+        self.weights = {}
+        self.scales = {}
+        self.metrics = []
+        self.request_count = 0
+        self.token_requests = 0
+        self._server = _Server((host, port), _Handler)
+        self._server.agent = self
+        self._thread = None
+
+        for index in range(stacks):
+            self.add_stack('fake-app-{}'.format(index % 10), 'v{}'.format(index))
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def token_url(self) -> str:
+        return self.url + TOKEN_PATH
+
+    @property
+    def metrics_url(self) -> str:
+        return self.url
+
+    def start(self) -> 'FakeAgent':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        name='fake-lizzy-agent', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'FakeAgent':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def wait_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def output_headers(self, lines: List[str]) -> dict:
+        headers = {'X-Lizzy-Output': '\\n'.join(lines)}
+        if self.stream_output:
+            with self.lock:
+                output_id = next(self._output_ids)
+                self.outputs[output_id] = lines
+            headers['X-Lizzy-Output-Location'] = '/api/outputs/{}'.format(output_id)
+        return headers
+
+    def rotate_token(self) -> str:
+        """
+        Replaces the access token, the old one is rejected from now on
+        """
+        with self.lock:
+            self.expired_tokens.add(self.access_token)
+            self._token_generation += 1
+            self.access_token = 'FAKE-TOKEN-{}'.format(self._token_generation)
+        return self.access_token
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+            elif not self.error_rate or self._random.random() >= self.error_rate:
+                return False
+            self.errors_served += 1
+        return True
+
+    def create_statuses(self) -> List[str]:
+        return ['CREATE_IN_PROGRESS'] * self.create_polls + [self.final_status]
+
+    def add_stack(self, stack_name: str, version: str, dry_run: bool=False,
+                  statuses: Optional[List[str]]=None) -> dict:
+        """
+        Adds a stack that goes through ``statuses``, one for each time it is
+        read, and then stays in the last one
+        """
+        statuses = statuses or ['CREATE_COMPLETE']
+        stack = {'stack_name': stack_name,
+                 'version': version,
+                 'status': statuses[0],
+                 'creation_time': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                 'description': '{} ({})'.format(stack_name, version)}
+        if not dry_run:
+            with self.lock:
+                stack_id = make_stack_id(stack_name, version)
+                self.stacks[stack_id] = stack
+                self.weights.setdefault(stack_id, 0.0)
+                self._progress[stack_id] = statuses[1:]
+        return stack
+
+    def remove_stack(self, stack_id: str):
+        with self.lock:
+            self._remove_stack(stack_id)
+
+    def _remove_stack(self, stack_id: str):
+        self.stacks.pop(stack_id, None)
+        self.weights.pop(stack_id, None)
+        self._progress.pop(stack_id, None)
+
+    def delete_stack(self, stack_id: str):
+        """
+        Deletes the stack right away, or after ``delete_polls`` reads
+        """
+        if not self.delete_polls:
+            return self.remove_stack(stack_id)
+        with self.lock:
+            self.stacks[stack_id]['status'] = 'DELETE_IN_PROGRESS'
+            self._progress[stack_id] = ['DELETE_IN_PROGRESS'] * (self.delete_polls - 1) + [None]
+
+    def _read(self, stack_id: str) -> dict:
+        """
+        Returns a copy of the stack and moves it to its next status
+        """
+        stack = dict(self.stacks[stack_id])
+        progress = self._progress.get(stack_id)
+        if progress:
+            status = progress.pop(0)
+            if status is None:
+                self._remove_stack(stack_id)
+            else:
+                self.stacks[stack_id]['status'] = status
+        return stack
+
+    def read_stack(self, stack_id: str) -> Optional[dict]:
+        with self.lock:
+            return self._read(stack_id) if stack_id in self.stacks else None
+
+    def list_stacks(self, references: Optional[str]=None) -> list:
+        """
+        Reads the stacks whose name matches one of the comma separated
+        ``references``
+        """
+        patterns = [re.compile(reference + '$')
+                    for reference in (references or '').split(',') if reference]
+        with self.lock:
+            stack_ids = [stack_id for stack_id, stack in self.stacks.items()
+                         if not patterns or any(pattern.match(stack['stack_name'])
+                                                for pattern in patterns)]
+            return [self._read(stack_id) for stack_id in stack_ids]
+
+    def set_traffic(self, stack_id: str, percentage: float):
+        """
+        Gives ``percentage`` of the traffic to the stack and rescales the
+        other versions of the same application proportionally.
+        """
+        with self.lock:
+            stack_name = self.stacks[stack_id]['stack_name']
+            others = [other_id for other_id, stack in self.stacks.items()
+                      if stack['stack_name'] == stack_name and other_id != stack_id]
+            remaining = sum(self.weights.get(other_id, 0.0) for other_id in others)
+            for other_id in others:
+                if remaining:
+                    share = self.weights.get(other_id, 0.0) / remaining
+                else:
+                    share = 1 / len(others)
+                self.weights[other_id] = (100 - percentage) * share
+            self.weights[stack_id] = percentage
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8080, show_default=True)
+@click.option('--stacks', type=click.IntRange(0, None), default=0,
+              help='Number of stacks to create on start')
+@click.option('--latency', type=float, default=0.0, help='Seconds to wait before each answer')
+@click.option('--create-polls', type=click.IntRange(0, None), default=0,
+              help='Number of reads a new stack stays in CREATE_IN_PROGRESS')
+@click.option('--final-status', default='CREATE_COMPLETE', show_default=True,
+              help='Final status of new stacks')
+@click.option('--delete-polls', type=click.IntRange(0, None), default=0,
+              help='Number of reads a deleted stack stays in DELETE_IN_PROGRESS')
+@click.option('--error-rate', type=float, default=0.0,
+              help='Fraction of the stack requests that fail')
+@click.option('--batch-traffic', is_flag=True, help='Serve the batch traffic endpoint')
+@click.option('--stream-output', is_flag=True, help='Stream the senza output from a separate endpoint')
+@click.option('--events', is_flag=True, help='Push the states of stacks as Server-Sent Events')
+def main(host: str, port: int, **options):
+    """
+    Serve a fake Lizzy agent until interrupted
+    """
+    with FakeAgent(host=host, port=port, **options) as agent:
+        click.echo('Fake Lizzy agent listening on {} (token URL {})'.format(
+            agent.url, agent.token_url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+History of deployments
+
+``create`` appends one compact JSON line per deployment to
+``LIZZY_HOME/history.jsonl`` with the duration of each phase and the time
+of each state change, which ``lizzy stats`` summarizes per application.
+"""
+
+import json
+import os
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from . import tracing
+from .configuration import Configuration
+from .utils import percentile
+
+DEPLOYMENT_PHASES = ['queue', 'new_stack', 'wait_for_deployment', 'traffic', 'cleanup']
+STATS_PHASES = DEPLOYMENT_PHASES + ['total']
+
+# outcomes of a deployment
+FAILED = 'failed'  # the stack didn't reach CREATE_COMPLETE
+DEPLOYED = 'deployed'  # the stack was created but switching traffic or the cleanup failed
+SUCCESS = 'success'
+
+
+def history_path() -> str:
+    return os.path.join(Configuration().home_dir, 'history.jsonl')
+
+
+def append(record: dict, path: Optional[str]=None):
+    path = path or history_path()
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    line = json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n'
+    # a single small write to a file opened for appending doesn't interleave
+    # with other lizzy processes
+    with open(path, 'a') as fd:
+        fd.write(line)
+
+
+def read(path: Optional[str]=None) -> Iterator[dict]:
+    try:
+        fd = open(path or history_path())
+    except FileNotFoundError:
+        return
+    with fd:
+        for line in fd:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # e.g. a line cut short by a full disk
+
+
+class DeploymentRecorder:
+    """
+    Collects the phases and state changes of a deployment from the tracing
+    hooks and saves them to the history
+    """
+
+    def __init__(self, stack_name: str, version: str, region: Optional[str]=None):
+        self.stack_name = stack_name
+        self.version = version
+        self.region = region
+        self.result = FAILED
+        self.final_status = None
+        self.phases = {}
+        self.states = []
+        self._started_at = None
+        self._started_time = None
+        self._cancelled = False
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._started_time = time.time()
+        tracing.add_recorder(self)
+
+    def cancel(self):
+        """
+        Don't save the deployment, e.g. in dry run mode
+        """
+        self._cancelled = True
+        tracing.remove_recorder(self)
+
+    def on_phase(self, name: str, start: float, duration: float):
+        if name in DEPLOYMENT_PHASES:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def on_request(self, method: str, url: str, status: Optional[int],
+                   size: Optional[int], start: float, duration: float):
+        pass
+
+    def on_state(self, state: str):
+        if not self.states or self.states[-1][0] != state:
+            self.states.append([state, round(time.perf_counter() - self._started_at, 3)])
+        self.final_status = state
+
+    def as_record(self) -> dict:
+        phases = {name: round(duration, 3) for name, duration in self.phases.items()}
+        phases['total'] = round(time.perf_counter() - self._started_at, 3)
+        return {'stack_name': self.stack_name,
+                'version': self.version,
+                'region': self.region,
+                'started': round(self._started_time, 3),
+                'result': self.result,
+                'status': self.final_status,
+                'phases': phases,
+                'states': self.states}
+
+    def finish(self, path: Optional[str]=None):
+        tracing.remove_recorder(self)
+        if self._cancelled:
+            return
+        try:
+            append(self.as_record(), path)
+        except OSError:
+            pass  # the history must never break a deployment
+
+
+def summarize(records: Iterable[dict], stack_names: Iterable[str]=(),
+              since: Optional[float]=None, include_failed: bool=False) -> List[dict]:
+    """
+    Percentiles of the phase durations per application
+    """
+    stack_names = set(stack_names)
+    durations = {}
+    counts = {}
+    for record in records:
+        if stack_names and record.get('stack_name') not in stack_names:
+            continue
+        if since is not None and record.get('started', 0) < since:
+            continue
+        count = counts.setdefault(record.get('stack_name'), {'deployments': 0, 'failed': 0})
+        count['deployments'] += 1
+        if record.get('result') == FAILED:
+            count['failed'] += 1
+            if not include_failed:
+                continue
+        for phase, duration in record.get('phases', {}).items():
+            durations.setdefault((record.get('stack_name'), phase), []).append(duration)
+
+    rows = []
+    for stack_name in sorted(counts, key=str):
+        for phase in STATS_PHASES:
+            values = durations.get((stack_name, phase))
+            if not values:
+                continue
+            rows.append({'stack_name': stack_name,
+                         'phase': phase,
+                         'deployments': counts[stack_name]['deployments'],
+                         'failed': counts[stack_name]['failed'],
+                         'samples': len(values),
+                         'p50_s': round(percentile(values, 50), 1),
+                         'p90_s': round(percentile(values, 90), 1),
+                         'p99_s': round(percentile(values, 99), 1),
+                         'max_s': round(max(values), 1)})
+    return rows
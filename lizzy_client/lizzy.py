@@ -1,12 +1,53 @@
 import json
 import time
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urljoin
 
 import requests
 import yaml
-from clickclick import warning
 from urlpath import URL
 
+from . import deadlines, tracing
+from .exceptions import DeadlineExceeded
+from .models import AgentOutput, Stack
+from .token import TokenProvider
+
+
+def unescape_output(output: str) -> str:
+    return output.replace('\\n', '\n')  # new lines are escaped in the header
+
+
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 60  # seconds, the agent runs senza before answering some requests
+EVENTS_READ_TIMEOUT = 60  # seconds without any data, agents send keep-alive comments
+
+
+def iter_server_sent_events(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Parses a ``text/event-stream`` into ``(event, data)`` tuples
+    """
+    event, data = None, []
+    for line in lines:
+        if not line:
+            if data:
+                yield event or 'message', '\n'.join(data)
+            event, data = None, []
+            continue
+        if line.startswith(':'):
+            continue  # comment, e.g. keep-alive
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+
+
+def is_final_status(status: str) -> bool:
+    return status.endswith('_FAILED') or status.endswith('_COMPLETE')
+
 
 def make_header(access_token: str):
     headers = dict()
@@ -16,10 +57,35 @@ def make_header(access_token: str):
 
 
 class Lizzy:
-    def __init__(self, base_url: str, access_token: str):
+    # (connect, read) timeout of each request, shortened to the time left
+    # until the deadline of the operation (see lizzy_client.deadlines)
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    # keeps the connections to the agent alive between requests, e.g. in the
+    # daemon, instead of connecting for every request
+    session = None  # type: Optional[requests.Session]
+
+    def __init__(self, base_url: str, access_token: Union[str, TokenProvider],
+                 timeout: Optional[Tuple[float, float]]=None,
+                 session: Optional[requests.Session]=None):
         base_url = URL(base_url.rstrip('/'))
         self.api_url = base_url if base_url.path == '/api' else base_url / 'api'
         self.access_token = access_token
+        if timeout is not None:
+            self.timeout = timeout
+        if session is not None:
+            self.session = session
+        # stream of stack events, if the agent advertises one
+        self.events_url = None  # type: Optional[URL]
+
+    @property
+    def access_token(self) -> str:
+        return self.token_provider.get()
+
+    @access_token.setter
+    def access_token(self, access_token: Union[str, TokenProvider]):
+        if not isinstance(access_token, TokenProvider):
+            access_token = TokenProvider.fixed(access_token)
+        self.token_provider = access_token
 
     @classmethod
     def get_output(cls, response: requests.Response) -> str:
@@ -27,14 +93,85 @@ class Lizzy:
         Extracts the senza cli output from the response
         """
         output = response.headers['X-Lizzy-Output']  # type: str
-        output = output.replace('\\n', '\n')  # unescape new lines
-        lines = ('[AGENT] {}'.format(line) for line in output.splitlines())
-        return '\n'.join(lines)
+        return str(AgentOutput.from_text(unescape_output(output)))
+
+    def read_output(self, response: requests.Response) -> AgentOutput:
+        """
+        Returns the senza cli output of the response, streamed line by line
+        from the ``X-Lizzy-Output-Location`` the agent points to, if any, or
+        read from the ``X-Lizzy-Output`` header
+        """
+        header = response.headers['X-Lizzy-Output'] if 'X-Lizzy-Output' in response.headers else None
+        if 'X-Lizzy-Output-Location' not in response.headers:
+            return AgentOutput.from_text(unescape_output(header or ''))
+        url = urljoin(str(response.url or self.api_url), response.headers['X-Lizzy-Output-Location'])
+        return AgentOutput(self._stream_output(URL(url), header))
+
+    def _stream_output(self, url: URL, fallback: Optional[str]) -> Iterator[str]:
+        try:
+            response = self._request('get', url, headers=make_header(self.access_token),
+                                     stream=True, verify=False)
+            response.raise_for_status()
+        except requests.RequestException:
+            if fallback is None:
+                raise
+            # the header may be cut off by size limits but it's better than nothing
+            yield from AgentOutput.from_text(unescape_output(fallback))
+            return
+        try:
+            for line in response.iter_lines():
+                yield AgentOutput.PREFIX + line.decode('utf-8', 'replace')
+        except requests.RequestException as e:
+            # e.g. the connection dropped, the lines so far were shown already
+            yield 'Agent output cut off: {}'.format(e)
+        finally:
+            response.close()
 
     @property
     def stacks_url(self) -> URL:
         return self.api_url / 'stacks'
 
+    def _request(self, method: str, url: URL, **kwargs) -> requests.Response:
+        """
+        Sends a request to the agent, reporting it to the active tracing
+        recorders. If the agent rejects the token, it is sent again once with
+        a new token.
+        """
+        response = self._send(method, url, **kwargs)
+        if response.status_code != 401 or 'headers' not in kwargs:
+            return response
+        old_token = kwargs['headers'].get('Authorization')
+        try:
+            headers = dict(kwargs['headers'],
+                           Authorization='Bearer {}'.format(self.token_provider.refresh()))
+        except Exception:
+            return response  # e.g. the credentials are gone, report the 401
+        if headers['Authorization'] == old_token:
+            return response
+        response.close()
+        return self._send(method, url, **dict(kwargs, headers=headers))
+
+    def _send(self, method: str, url: URL, **kwargs) -> requests.Response:
+        operation = '{} {}'.format(method.upper(), url)
+        deadlines.check(operation)
+        kwargs['timeout'] = deadlines.bound_timeout(kwargs.get('timeout', self.timeout), operation)
+        start = time.perf_counter()
+        response = None
+        try:
+            if self.session is None:
+                response = getattr(url, method)(**kwargs)
+            else:
+                response = self.session.request(method, str(url), **kwargs)
+            if 'X-Lizzy-Events' in response.headers:
+                self.events_url = URL(urljoin(str(url), response.headers['X-Lizzy-Events']))
+            return response
+        except requests.Timeout as e:
+            if deadlines.expired():
+                raise DeadlineExceeded(operation) from e
+            raise
+        finally:
+            tracing.record_request(method.upper(), str(url), response, start)
+
     def delete(self, stack_id: str, region: str=None, dry_run: bool=False):
         url = self.stacks_url / stack_id
 
@@ -43,35 +180,87 @@ class Lizzy:
         if region:
             data["region"] = region
 
-        request = url.delete(headers=header, json=data, verify=False)
+        request = self._request('delete', url, headers=header, json=data,
+                                verify=False)
         request.raise_for_status()
-        return self.get_output(request)
+        return self.read_output(request)
 
-    def get_stack(self, stack_id: str, region: Optional[str]=None) -> dict:
+    def get_stack(self, stack_id: str, region: Optional[str]=None) -> Stack:
         header = make_header(self.access_token)
         url = self.stacks_url / stack_id
         query = {}
         if region:
             query['region'] = region
-        request = url.with_query(query).get(headers=header, verify=False)
+        request = self._request('get', url.with_query(query), headers=header,
+                                verify=False)
         request.raise_for_status()
-        return request.json()
+        return Stack.from_dict(request.json())
 
     def get_stacks(self, stack_reference: Optional[List[str]]=None,
-                   region: Optional[str]=None) -> list:
-        fetch_stacks_url = self.stacks_url
+                   region: Optional[str]=None,
+                   page_size: Optional[int]=None) -> List[Stack]:
+        return list(self.iter_stacks(stack_reference, region=region,
+                                     page_size=page_size))
+
+    def iter_stacks(self, stack_reference: Optional[List[str]]=None,
+                    region: Optional[str]=None,
+                    page_size: Optional[int]=None) -> Iterator[Stack]:
+        """
+        Lazily yields the stacks, following the pagination cursors returned by
+        the agent. The next page is requested in the background while the
+        current one is being consumed.
+        """
         query = {}
         if region:
             query['region'] = region
         if stack_reference:
             query['references'] = ','.join(stack_reference)
+        if page_size:
+            query['page_size'] = page_size
+
+        fetch_stacks_url = self.stacks_url.with_query(query)  # type: URL
 
-        fetch_stacks_url = fetch_stacks_url.with_query(query)  # type: URL
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fetch_page = deadlines.bind(self._fetch_stacks_page)
+            next_page = executor.submit(fetch_page, fetch_stacks_url, query)
+            while next_page is not None:
+                stacks, next_url = next_page.result()
+                if next_url is not None:
+                    next_page = executor.submit(fetch_page, next_url, query)
+                else:
+                    next_page = None
+                for stack in stacks:
+                    yield Stack.from_dict(stack)
 
-        response = fetch_stacks_url.get(headers=make_header(self.access_token),
-                                        verify=False)
+    def _fetch_stacks_page(self, url: URL, query: dict) -> Tuple[list, Optional[URL]]:
+        """
+        Fetches one page of stacks and returns it together with the URL of
+        the next page, if there is one.
+
+        Agents without pagination support return a plain list. Paginated
+        responses either point to the next page with a ``Link: <...>;
+        rel="next"`` header or return ``{"stacks": [...], "next_cursor": ...}``.
+        """
+        response = self._request('get', url,
+                                 headers=make_header(self.access_token),
+                                 verify=False)
         response.raise_for_status()
-        return response.json()
+        body = response.json()
+
+        next_url = None
+        if isinstance(body, dict):
+            stacks = body['stacks']
+            cursor = body.get('next_cursor')
+            if cursor:
+                next_url = self.stacks_url.with_query(dict(query, cursor=cursor))
+        else:
+            stacks = body
+
+        next_link = response.links.get('next', {}).get('url')
+        if next_link:
+            next_url = URL(urljoin(str(url), next_link))
+
+        return stacks, next_url
 
     def new_stack(self,
                   keep_stacks: int,
@@ -82,7 +271,7 @@ class Lizzy:
                   parameters: List[str],
                   region: Optional[str],
                   dry_run: bool,
-                  tags: List[str]) -> (Dict[str, str], str):  # TODO put arguments in a more logical order
+                  tags: List[str]) -> (Stack, AgentOutput):  # TODO put arguments in a more logical order
         """
         Requests a new stack.
         """
@@ -98,9 +287,10 @@ class Lizzy:
         if region:
             data['region'] = region
 
-        request = self.stacks_url.post(json=data, headers=header, verify=False)
+        request = self._request('post', self.stacks_url, json=data,
+                                headers=header, verify=False)
         request.raise_for_status()
-        return request.json(), self.get_output(request)
+        return Stack.from_dict(request.json()), self.read_output(request)
 
     def traffic(self, stack_id: str, percentage: int,
                 region: Optional[str]=None):
@@ -110,13 +300,28 @@ class Lizzy:
             data['region'] = region
 
         header = make_header(self.access_token)
-        request = url.patch(json=data, headers=header, verify=False)
-        try:
-            request.raise_for_status()
-        except requests.RequestException:
-            warning('Data Json:')
-            print(json.dumps(data, indent=4))
-            raise
+        request = self._request('patch', url, json=data, headers=header,
+                                verify=False)
+        request.raise_for_status()
+
+    def set_traffic_weights(self, stack_name: str, weights: dict,
+                            region: Optional[str]=None) -> bool:
+        """
+        Sets the weights of all versions of ``stack_name`` in one request.
+        Returns False if the agent doesn't support it.
+        """
+        url = self.stacks_url / stack_name / 'traffic'
+        data = {'weights': weights}
+        if region:
+            data['region'] = region
+
+        header = make_header(self.access_token)
+        response = self._request('patch', url, json=data, headers=header,
+                                 verify=False)
+        if response.status_code in (404, 405):
+            return False
+        response.raise_for_status()
+        return True
 
     def get_traffic(self, stack_id: str, region: Optional[str]=None) -> dict:
         url = self.stacks_url / stack_id / 'traffic'
@@ -126,7 +331,7 @@ class Lizzy:
         url = url.with_query(query)
 
         header = make_header(self.access_token)
-        response = url.get(headers=header, verify=False)
+        response = self._request('get', url, headers=header, verify=False)
         response.raise_for_status()
         return response.json()
 
@@ -138,27 +343,77 @@ class Lizzy:
             data['region'] = region
 
         header = make_header(self.access_token)
-        response = url.patch(json=data, headers=header, verify=False)
+        response = self._request('patch', url, json=data, headers=header,
+                                 verify=False)
+        response.raise_for_status()
+
+    def follow_stack_events(self, stack_id: str,
+                            region: Optional[str]=None) -> Iterator[str]:
+        """
+        Yields the states of the stack pushed by the agent as Server-Sent
+        Events until it reaches a final state or the stream ends.
+
+        :raises requests.RequestException: if the stream can't be read
+        """
+        query = {'stack_id': stack_id}
+        if region:
+            query['region'] = region
+        headers = make_header(self.access_token)
+        headers['Accept'] = 'text/event-stream'
+        response = self._request('get', self.events_url.with_query(query), headers=headers,
+                                 stream=True, verify=False,
+                                 timeout=(CONNECT_TIMEOUT, EVENTS_READ_TIMEOUT))
         try:
             response.raise_for_status()
-        except requests.RequestException:
-            warning('Data Json:')
-            print(json.dumps(data, indent=4))
-            raise
+            lines = (line.decode('utf-8', 'replace')
+                     for line in response.iter_lines(chunk_size=None))
+            for event, data in iter_server_sent_events(lines):
+                if event != 'stack':
+                    continue
+                stack = json.loads(data)
+                if stack.get('stack_id', stack_id) != stack_id:
+                    continue
+                yield stack['status']
+                if is_final_status(stack['status']):
+                    return
+        finally:
+            response.close()
 
     def wait_for_deployment(self, stack_id: str, region: Optional[str]=None) -> [str]:
+        """
+        Yields the states of the stack until it reaches a final one.
+
+        After the first read the states are pushed by the agent if it
+        advertises a stream of events, the stack is polled otherwise or if
+        the stream breaks off.
+        """
         retries = 3
+        push = True
         while retries:
             try:
-                stack = self.get_stack(stack_id, region=region)
-                status = stack["status"]
+                status = self.get_stack(stack_id, region=region).status
                 retries = 3  # reset the number of retries
                 yield status
-                if status.endswith('_FAILED') or status.endswith('_COMPLETE'):
+                if is_final_status(status):
                     return status
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 retries -= 1
                 yield 'Failed to get stack ({retries} retries left): {exception}.'.format(retries=retries,
                                                                                           exception=repr(e))
+            else:
+                if push and self.events_url is not None:
+                    push = False  # fall back to polling if the stream breaks off
+                    try:
+                        with tracing.phase('events'):
+                            for status in self.follow_stack_events(stack_id, region=region):
+                                yield status
+                                if is_final_status(status):
+                                    return status
+                    except (requests.RequestException, ValueError, KeyError):
+                        pass
+                    continue  # read the state right away
 
-            time.sleep(10)
+            with tracing.phase('sleep'):
+                time.sleep(deadlines.bound(10))
@@ -0,0 +1,163 @@
+"""
+Records for the data returned by the Lizzy agent
+"""
+
+import datetime
+from numbers import Number
+from typing import Iterable, Iterator, Optional, Union
+
+from .utils import parse_timestamp
+
+
+def make_stack_id(stack_name: str, version: str) -> str:
+    return '{}-{}'.format(stack_name, version)
+
+
+class Stack:
+    """
+    A Cloud Formation stack as listed by the agent.
+
+    The creation time is kept as sent by the agent and only parsed when it
+    is first needed.
+    """
+
+    __slots__ = ('stack_name', 'version', 'status', 'description', 'stack_id',
+                 'raw_creation_time', '_creation_time')
+
+    def __init__(self, stack_name: str, version: str,
+                 status: Optional[str]=None,
+                 creation_time: Union[str, Number, None]=None,
+                 description: Optional[str]=None):
+        self.stack_name = stack_name
+        self.version = version
+        self.status = status
+        self.description = description
+        self.stack_id = make_stack_id(stack_name, version)
+        self.raw_creation_time = creation_time
+        self._creation_time = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Stack':
+        return cls(data['stack_name'], data['version'],
+                   status=data['status'],
+                   creation_time=data.get('creation_time'),
+                   description=data.get('description'))
+
+    @property
+    def creation_time(self) -> Optional[datetime.datetime]:
+        if self._creation_time is None and self.raw_creation_time is not None:
+            self._creation_time = parse_timestamp(self.raw_creation_time)
+        return self._creation_time
+
+    def creation_order(self) -> tuple:
+        """
+        Sort key for stacks, oldest first. Times without a timezone are taken
+        as UTC and stacks without a creation time come last.
+        """
+        creation_time = self.creation_time
+        if creation_time is None:
+            return (1, 0.0)
+        if creation_time.tzinfo is None:
+            creation_time = creation_time.replace(tzinfo=datetime.timezone.utc)
+        return (0, creation_time.timestamp())
+
+    def as_row(self) -> dict:
+        """
+        Row used to print the stack with ``print_table``
+        """
+        creation_time = self.creation_time
+        return {'stack_name': self.stack_name,
+                'version': self.version,
+                'status': self.status,
+                'creation_time': creation_time and creation_time.timestamp(),
+                'description': self.description}
+
+    def __eq__(self, other):
+        if not isinstance(other, Stack):
+            return NotImplemented
+        return (self.stack_id == other.stack_id and
+                self.status == other.status and
+                self.description == other.description and
+                self.raw_creation_time == other.raw_creation_time)
+
+    def __hash__(self):
+        return hash((self.stack_id, self.status, self.description, self.raw_creation_time))
+
+    def __repr__(self):
+        return '<Stack {} ({})>'.format(self.stack_id, self.status)
+
+
+class TrafficWeight:
+    """
+    Share of the traffic that a stack version receives
+    """
+
+    __slots__ = ('stack_name', 'version', 'stack_id', 'weight')
+
+    def __init__(self, stack_name: str, version: str, weight: float):
+        self.stack_name = stack_name
+        self.version = version
+        self.stack_id = make_stack_id(stack_name, version)
+        self.weight = weight
+
+    def as_row(self) -> dict:
+        return {'stack_name': self.stack_name,
+                'version': self.version,
+                'identifier': self.stack_id,
+                'weight%': self.weight}
+
+    def __eq__(self, other):
+        if not isinstance(other, TrafficWeight):
+            return NotImplemented
+        return self.stack_id == other.stack_id and self.weight == other.weight
+
+    def __hash__(self):
+        return hash((self.stack_id, self.weight))
+
+    def __repr__(self):
+        return '<TrafficWeight {} {}%>'.format(self.stack_id, self.weight)
+
+
+class AgentOutput:
+    """
+    Output of a senza command run by the agent, as ``[AGENT]`` prefixed
+    lines.
+
+    The lines are read from ``lines`` as they are iterated, e.g. while the
+    agent streams them, and not kept, so the output can only be iterated
+    once. Turning it into a string reads the remaining lines and keeps the
+    string instead.
+    """
+
+    PREFIX = '[AGENT] '
+
+    def __init__(self, lines: Iterable[str]=()):
+        self._source = iter(lines)
+        self._text = None
+
+    @classmethod
+    def from_text(cls, text: str) -> 'AgentOutput':
+        return cls(cls.PREFIX + line for line in text.splitlines())
+
+    def __iter__(self) -> Iterator[str]:
+        if self._text is not None:
+            return iter(self._text.splitlines())
+        return self._source
+
+    def __str__(self):
+        if self._text is None:
+            self._text = '\n'.join(self._source)
+        return self._text
+
+    def __contains__(self, text: str) -> bool:
+        return text in str(self)
+
+    def __eq__(self, other):
+        if isinstance(other, AgentOutput):
+            return str(self) == str(other)
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return '<AgentOutput {!r}>'.format(str(self))
@@ -0,0 +1,145 @@
+"""
+Output of tabular results
+"""
+
+import datetime
+import numbers
+import shutil
+import sys
+import time
+from typing import Iterable, List, Optional
+
+import click
+from clickclick import OutputFormat, print_table
+
+from . import events
+
+HEADER_STYLE = {'fg': 'black', 'bg': 'white'}
+
+
+def format_age(timestamp: Optional[numbers.Number], now: datetime.datetime) -> str:
+    """
+    Formats a timestamp like clickclick's ``format_time``, e.g. "3h ago"
+    """
+    if not timestamp:
+        return ''
+    seconds = (now - datetime.datetime.fromtimestamp(timestamp)).total_seconds()
+    if seconds > 3600 * 49:
+        age = '{:.0f}d'.format(seconds / (3600 * 24))
+    elif seconds > 3600:
+        age = '{:.0f}h'.format(seconds / 3600)
+    elif seconds > 70:
+        age = '{:.0f}m'.format(seconds / 60)
+    else:
+        age = '{:.0f}s'.format(seconds)
+    return '{} ago'.format(age)
+
+
+def format_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    return str(value)
+
+
+def _age_style(timestamp, now: float) -> dict:
+    age = now - timestamp
+    if age < 900:
+        return {'fg': 'green', 'bold': True}
+    if age < 3600:
+        return {'fg': 'green'}
+    return {}
+
+
+def render_column(col: str, values: list, title: str, styles: dict) -> List[str]:
+    """
+    Returns the header and the cells of a column, padded to the same width.
+
+    The formatter is chosen once for the column and the style of each
+    distinct value is only looked up and rendered once.
+    """
+    is_time = col.endswith('_time')
+    if is_time:
+        now = datetime.datetime.now()
+        texts = [format_age(value, now) if isinstance(value, numbers.Number) else format_value(value)
+                 for value in values]
+    else:
+        texts = [format_value(value) for value in values]
+    width = max([len(title)] + [len(text) for text in texts])
+    left, right = '{:' + str(width) + '}', '{:>' + str(width) + '}'
+
+    timestamp_now = time.time()
+    cells = [click.style(left.format(title), **HEADER_STYLE)]
+    cache = {}  # (value, text) -> cell, most values repeat, e.g. the status
+    for value, text in zip(values, texts):
+        try:
+            cells.append(cache[value, text])
+            continue
+        except KeyError:
+            hashable = True
+        except TypeError:
+            hashable = False
+        number = isinstance(value, numbers.Number)
+        if is_time and number:
+            style = _age_style(value, timestamp_now)
+        else:
+            style = styles.get(value, {}) if hashable else {}
+        cell = (right if number else left).format(text)
+        if style:
+            cell = click.style(cell, **style)
+        if hashable:
+            cache[value, text] = cell
+        cells.append(cell)
+    return cells
+
+
+def render_table(cols: List[str], rows: List[dict], styles: Optional[dict]=None,
+                 titles: Optional[dict]=None) -> str:
+    """
+    Renders the rows as a text table like clickclick's ``print_table``,
+    column by column
+    """
+    styles = styles or {}
+    titles = titles or {}
+    columns = [render_column(col, [row.get(col) for row in rows],
+                             titles.get(col, col.title().replace('_', ' ')), styles)
+               for col in cols]
+    separator = click.style('│', **HEADER_STYLE)
+    header = separator.join(column[0] for column in columns)
+    lines = [header] + [' '.join(cells) + ' ' for cells in zip(*(column[1:] for column in columns))]
+    return '\n'.join(lines) + '\n'
+
+
+def _fits_screen(text: str) -> bool:
+    return text.count('\n') < shutil.get_terminal_size().lines
+
+
+def write_text(text: str, pager: bool=True):
+    """
+    Writes ``text`` to stdout at once, through a pager if it is longer than
+    the terminal
+    """
+    if pager and sys.stdout.isatty() and not _fits_screen(text):
+        click.echo_via_pager(text)
+    else:
+        click.echo(text, nl=False)
+
+
+def print_rows(cols: List[str], rows: Iterable[dict], output: str,
+               styles: Optional[dict]=None, titles: Optional[dict]=None,
+               event: str='row', pager: bool=True):
+    """
+    Prints the rows as a table in the chosen ``output`` format, or emits one
+    ``event`` per row in NDJSON mode. Long text tables are shown in a pager
+    unless ``pager`` is False, e.g. when the table is refreshed.
+    """
+    if output == 'ndjson':
+        for row in rows:
+            events.emit(event, **{col: row.get(col) for col in cols})
+        return
+    if output == 'text':
+        write_text(render_table(cols, list(rows), styles=styles, titles=titles), pager=pager)
+        return
+    with OutputFormat(output):
+        print_table(cols, list(rows), styles=styles, titles=titles)
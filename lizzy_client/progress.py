@@ -0,0 +1,149 @@
+"""
+Live progress of many stacks
+
+:func:`make_view` returns a view that redraws a table with one row per stack
+on terminals, or prints one line per state change otherwise (e.g. in CI
+logs). Views are fed the statuses of all stacks at once, e.g. by the poll
+loop of :func:`lizzy_client.workflows.wait_for_stacks`.
+"""
+
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import click
+
+CURSOR_UP = '\x1b[{}A'
+CLEAR_LINE = '\x1b[2K'
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return '{}s'.format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return '{}m{:02d}s'.format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m'.format(hours, minutes)
+
+
+class StackProgress:
+    __slots__ = ('stack_id', 'status', 'previous_status', 'changed_at')
+
+    def __init__(self, stack_id: str, changed_at: float):
+        self.stack_id = stack_id
+        self.status = None
+        self.previous_status = None
+        self.changed_at = changed_at
+
+
+class ProgressView(ABC):
+    """
+    Keeps the status of each stack and when it last changed, subclasses show
+    the changes
+    """
+
+    def __init__(self, stream=None, styles: Optional[dict]=None,
+                 clock: Callable[[], float]=time.monotonic):
+        self.stream = stream or sys.stdout
+        self.styles = styles or {}
+        self.clock = clock
+        self.started_at = clock()
+        self.stacks = OrderedDict()  # type: Dict[str, StackProgress]
+
+    def update(self, statuses: Dict[str, Optional[str]]):
+        now = self.clock()
+        changed = []
+        for stack_id, status in statuses.items():
+            stack = self.stacks.get(stack_id)
+            if stack is None:
+                stack = self.stacks[stack_id] = StackProgress(stack_id, now)
+                stack.status = status
+                changed.append(stack)
+            elif status != stack.status:
+                stack.previous_status, stack.status = stack.status, status
+                stack.changed_at = now
+                changed.append(stack)
+        self.render(changed, now)
+
+    @abstractmethod
+    def render(self, changed: List[StackProgress], now: float):
+        """
+        Shows the stacks whose status changed with the last update
+        """
+
+    def finish(self):
+        pass
+
+    def _style(self, status: Optional[str], text: str) -> str:
+        return click.style(text, **self.styles.get(status, {}))
+
+    def _write(self, text: str):
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class LineProgressView(ProgressView):
+    """
+    Prints a line for each state change
+    """
+
+    def render(self, changed: List[StackProgress], now: float):
+        elapsed = format_duration(now - self.started_at)
+        lines = ['[{:>6}] {} {}'.format(elapsed, stack.stack_id, stack.status or 'WAITING')
+                 for stack in changed]
+        if lines:
+            self._write('\n'.join(lines) + '\n')
+
+
+class TableProgressView(ProgressView):
+    """
+    Redraws a table with one row per stack in place
+    """
+
+    columns = ('Stack', 'Status', 'Elapsed', 'Last change')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lines_drawn = 0
+
+    def _rows(self, now: float) -> List[tuple]:
+        rows = []
+        for stack in self.stacks.values():
+            if stack.previous_status is None:
+                change = '{} ago'.format(format_duration(now - stack.changed_at))
+            else:
+                change = 'from {} {} ago'.format(stack.previous_status,
+                                                 format_duration(now - stack.changed_at))
+            rows.append((stack.stack_id, stack.status or 'WAITING',
+                         format_duration(now - self.started_at), change))
+        return rows
+
+    def render(self, changed: List[StackProgress], now: float):
+        rows = self._rows(now)
+        widths = [max(len(str(row[index])) for row in rows + [self.columns])
+                  for index in range(len(self.columns))]
+
+        lines = [' '.join(click.style(title.ljust(width), bold=True)
+                          for title, width in zip(self.columns, widths))]
+        for stack_id, status, elapsed, change in rows:
+            lines.append(' '.join([stack_id.ljust(widths[0]),
+                                   self._style(status, status.ljust(widths[1])),
+                                   elapsed.rjust(widths[2]),
+                                   change]))
+
+        # the whole table is drawn with a single write to avoid flickering
+        output = CURSOR_UP.format(self._lines_drawn) if self._lines_drawn else ''
+        output += ''.join(CLEAR_LINE + line + '\n' for line in lines)
+        self._lines_drawn = len(lines)
+        self._write(output)
+
+
+def make_view(stream=None, styles: Optional[dict]=None) -> ProgressView:
+    stream = stream or sys.stdout
+    is_tty = hasattr(stream, 'isatty') and stream.isatty()
+    view_class = TableProgressView if is_tty else LineProgressView
+    return view_class(stream, styles=styles)
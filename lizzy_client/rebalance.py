@@ -0,0 +1,105 @@
+"""
+Planning of traffic changes
+
+Every traffic change request gives one stack the requested percentage and
+rescales the other versions of the application proportionally to their
+current weights (like ``senza traffic``). These functions find a short list
+of such requests that turns the current weights into the target ones.
+
+The requests only take whole percentages, so the targets are apportioned to
+integers first and the planned changes are rounded as they go.
+"""
+
+from typing import Dict, List, Tuple
+
+TOLERANCE = 0.5  # percent
+PLAN_TOLERANCE = 1  # percent, what rounding the changes to integers can leave
+
+Weights = Dict[str, float]
+Plan = List[Tuple[str, int]]
+
+
+def apply_change(weights: Weights, stack_id: str, percentage: float) -> Weights:
+    """
+    Weights after giving ``percentage`` of the traffic to ``stack_id``
+    """
+    others = [other_id for other_id in weights if other_id != stack_id]
+    remaining = sum(weights[other_id] for other_id in others)
+    new_weights = {stack_id: percentage}
+    for other_id in others:
+        share = weights[other_id] / remaining if remaining else 1 / len(others)
+        new_weights[other_id] = (100 - percentage) * share
+    return new_weights
+
+
+def simulate(weights: Weights, plan: Plan) -> Weights:
+    for stack_id, percentage in plan:
+        weights = apply_change(weights, stack_id, percentage)
+    return weights
+
+
+def apportion(weights: Weights) -> Dict[str, int]:
+    """
+    Rounds ``weights`` that add up to about 100 to integers that add up to
+    exactly 100, giving the points left over to the largest remainders
+    """
+    apportioned = {stack_id: int(weight) for stack_id, weight in weights.items()}
+    by_remainder = sorted(weights, key=lambda stack_id: (apportioned[stack_id] - weights[stack_id],
+                                                         stack_id))
+    for stack_id in by_remainder[:100 - sum(apportioned.values())]:
+        apportioned[stack_id] += 1
+    return apportioned
+
+
+def matches(weights: Weights, targets: Weights, tolerance: float=TOLERANCE) -> bool:
+    return all(abs(weights.get(stack_id, 0.0) - target) <= tolerance
+               for stack_id, target in targets.items())
+
+
+def _backwards_plan(base_id: str, targets: Weights) -> Plan:
+    """
+    Sets every non-zero target except ``base_id``, the last one first in the
+    list getting its final weight right away and the earlier ones scaled up
+    by the share the later changes take from them. Each percentage is rounded
+    against the share the rounded later changes really leave, so the errors
+    don't add up; ``base_id`` takes what is left.
+    """
+    ordered = sorted((stack_id for stack_id, target in targets.items()
+                      if target and stack_id != base_id),
+                     key=lambda stack_id: (targets[stack_id], stack_id))
+    plan = []
+    left = 1.0  # share of a weight set now that the later changes leave
+    for stack_id in reversed(ordered):
+        percentage = min(100, int(round(targets[stack_id] / left)))
+        plan.append((stack_id, percentage))
+        left *= (100 - percentage) / 100
+    plan.reverse()
+    return plan
+
+
+def plan_changes(current: Weights, targets: Weights) -> Plan:
+    """
+    Returns the shortest plan found that turns the ``current`` weights into
+    the ``targets``.
+
+    ``targets`` must contain every stack of ``current`` and add up to 100.
+    The result is checked with :data:`PLAN_TOLERANCE`.
+    """
+    if matches(current, targets):
+        return []
+
+    for stack_id, target in sorted(targets.items()):
+        plan = [(stack_id, target)]
+        if matches(simulate(current, plan), targets, PLAN_TOLERANCE):
+            return plan
+
+    # the stack with the biggest target absorbs the rounding of the others
+    base_id = max(sorted(targets), key=lambda stack_id: targets[stack_id])
+    plan = _backwards_plan(base_id, targets)
+    if matches(simulate(current, plan), targets, PLAN_TOLERANCE):
+        return plan
+
+    # giving all the traffic to the base stack resets the other weights
+    if current.get(base_id) != 100:
+        plan.insert(0, (base_id, 100))
+    return plan
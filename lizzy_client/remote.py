@@ -0,0 +1,164 @@
+"""
+Fetching of remote definitions and parameter files
+
+Sources on HTTP config servers are downloaded concurrently, with a timeout,
+over a shared session, and kept in an HTTP cache in ``LIZZY_HOME``. Cached
+responses are used without a request while ``Cache-Control: max-age`` says
+they are fresh and revalidated with their ``ETag``/``Last-Modified``
+otherwise.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import requests
+
+from . import tracing
+from .configuration import Configuration
+
+FETCH_TIMEOUT = 10  # seconds
+MAX_FETCH_WORKERS = 8
+
+MAX_AGE_PATTERN = re.compile(r'(?:^|,)\s*(?:s-)?max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+_session = requests.Session()
+_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS)
+
+Downloads = Dict[str, Future]
+
+
+def is_remote(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+def _cache_path(url: str) -> str:
+    name = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(Configuration().home_dir, 'http-cache', name)
+
+
+def _cache_directives(headers) -> set:
+    return {directive.strip().split('=', 1)[0].lower()
+            for directive in headers.get('Cache-Control', '').split(',')}
+
+
+def _fresh_until(headers, now: float) -> float:
+    directives = _cache_directives(headers)
+    if 'no-cache' in directives:
+        return 0.0
+    match = MAX_AGE_PATTERN.search(headers.get('Cache-Control', ''))
+    if match is None:
+        return 0.0  # always revalidate, the validators make it cheap
+    return now + int(match.group(1))
+
+
+def read_cache(url: str) -> (Optional[dict], Optional[bytes]):
+    path = _cache_path(url)
+    try:
+        with open(path + '.json') as fd:
+            metadata = json.load(fd)
+        with open(path + '.body', 'rb') as fd:
+            body = fd.read()
+    except (OSError, ValueError):
+        return None, None
+    if metadata.get('url') != url:
+        return None, None
+    return metadata, body
+
+
+def _write_atomically(path: str, data: bytes):
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as fd:
+        fd.write(data)
+    os.replace(fd.name, path)
+
+
+def write_cache(url: str, metadata: dict, body: Optional[bytes]=None):
+    path = _cache_path(url)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        if body is not None:
+            _write_atomically(path + '.body', body)
+        _write_atomically(path + '.json', json.dumps(metadata).encode())
+    except OSError:
+        pass  # the cache is only an optimization
+
+
+def _metadata(url: str, response: requests.Response, now: float) -> dict:
+    return {'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fresh_until': _fresh_until(response.headers, now)}
+
+
+def _fetch(url: str, timeout: float, use_cache: bool) -> bytes:
+    metadata, body = read_cache(url) if use_cache else (None, None)
+    now = time.time()
+    if metadata is not None and now < metadata.get('fresh_until', 0):
+        return body
+
+    headers = {}
+    if metadata is not None:
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    start = time.perf_counter()
+    response = None
+    try:
+        response = _session.get(url, headers=headers, timeout=timeout)
+    finally:
+        tracing.record_request('GET', url, response, start)
+
+    if response.status_code == 304 and metadata is not None:
+        # a 304 may leave out the validators, keep the ones already cached
+        metadata.update((key, value) for key, value in _metadata(url, response, now).items()
+                        if value is not None)
+        write_cache(url, metadata)
+        return body
+    response.raise_for_status()
+    if use_cache and 'no-store' not in _cache_directives(response.headers):
+        write_cache(url, _metadata(url, response, now), response.content)
+    return response.content
+
+
+def prefetch(urls: Iterable[str], timeout: float=FETCH_TIMEOUT, use_cache: bool=True,
+             downloads: Optional[Downloads]=None) -> Downloads:
+    """
+    Starts downloading the remote ones of ``urls`` in the background and
+    returns them added to ``downloads`` (a new mapping by default), for
+    :func:`fetch` to pick up. The caller drops them with :func:`cancel`.
+    """
+    downloads = {} if downloads is None else downloads
+    for url in urls:
+        if is_remote(url) and url not in downloads:
+            downloads[url] = _executor.submit(_fetch, url, timeout, use_cache)
+    return downloads
+
+
+def cancel(downloads: Downloads):
+    """
+    Cancels the ``downloads`` that haven't started and forgets all of them
+    """
+    for future in downloads.values():
+        future.cancel()
+    downloads.clear()
+
+
+def fetch(url: str, timeout: float=FETCH_TIMEOUT, use_cache: bool=True,
+          downloads: Optional[Downloads]=None) -> bytes:
+    """
+    Returns the body of ``url``, waiting for its download if it is one of
+    the prefetched ``downloads``.
+
+    :raises requests.RequestException: if the download failed
+    """
+    future = downloads.pop(url, None) if downloads is not None else None
+    if future is not None:
+        return future.result()
+    return _fetch(url, timeout, use_cache)
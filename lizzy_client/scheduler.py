@@ -0,0 +1,147 @@
+"""
+Deployment queue
+
+Limits how many ``create`` commands deploy to the same agent at a time, across
+all lizzy processes of a machine (e.g. the pipelines of a CI runner). The
+queue is a JSON file in ``LIZZY_HOME`` guarded by an ``fcntl`` lock. Waiting
+deployments get a slot by priority class and then in the order they arrived,
+so hotfixes overtake routine deployments.
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from .configuration import Configuration
+
+# priority classes, the first ones get a slot first
+PRIORITIES = ['hotfix', 'normal', 'low']
+DEFAULT_PRIORITY = 'normal'
+
+POLL_INTERVAL = 2  # seconds between checks for a free slot
+
+
+def queue_path(agent_url: str) -> str:
+    name = hashlib.sha1(str(agent_url).rstrip('/').encode()).hexdigest()
+    return os.path.join(Configuration().home_dir, 'queue', name + '.json')
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running as another user
+    return True
+
+
+@contextmanager
+def _locked_queue(path: str):
+    """
+    Yields the queue, saving it back when the block finishes, while holding
+    an exclusive lock
+    """
+    import fcntl  # not available on Windows, where the queue can't be used
+
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path) as fd:
+                    queue = json.load(fd)
+            except (OSError, ValueError):
+                queue = {'running': [], 'waiting': []}
+            # drop the entries of processes that died without leaving the queue
+            for entries in queue.values():
+                entries[:] = [entry for entry in entries if _is_alive(entry['pid'])]
+            yield queue
+            with open(path + '.tmp', 'w') as fd:
+                json.dump(queue, fd)
+            os.replace(path + '.tmp', path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _sort_key(entry: dict) -> tuple:
+    return PRIORITIES.index(entry['priority']), entry['enqueued']
+
+
+class DeploymentSlot:
+    """
+    A place in the queue of an agent; :meth:`acquire` blocks until fewer
+    than ``max_concurrent`` deployments are running
+    """
+
+    def __init__(self, agent_url: str, max_concurrent: int,
+                 priority: str=DEFAULT_PRIORITY, label: Optional[str]=None,
+                 path: Optional[str]=None):
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority {}'.format(priority))
+        self.path = path or queue_path(agent_url)
+        self.max_concurrent = max_concurrent
+        self.entry = {'id': uuid.uuid4().hex,
+                      'pid': os.getpid(),
+                      'priority': priority,
+                      'label': label,
+                      'enqueued': time.time()}
+        self.acquired = False
+        self.queued = False
+
+    def _try_acquire(self, queue: dict) -> bool:
+        if all(entry['id'] != self.entry['id'] for entry in queue['waiting']):
+            # the queue file was lost or reset, wait again at the same place
+            queue['waiting'].append(self.entry)
+        waiting = sorted(queue['waiting'], key=_sort_key)
+        position = [entry['id'] for entry in waiting].index(self.entry['id'])
+        # the deployments ahead take the free slots first
+        if position >= self.max_concurrent - len(queue['running']):
+            return False
+        queue['waiting'] = [entry for entry in waiting if entry['id'] != self.entry['id']]
+        queue['running'].append(dict(self.entry, started=time.time()))
+        return True
+
+    def _count_ahead(self, queue: dict) -> int:
+        return len(queue['running']) + len([entry for entry in queue['waiting']
+                                            if _sort_key(entry) < _sort_key(self.entry)])
+
+    def acquire(self, timeout: Optional[float]=None,
+                on_wait: Optional[Callable[[int], None]]=None) -> bool:
+        """
+        Waits for a slot and returns whether one was acquired before the
+        ``timeout``. ``on_wait`` gets the number of deployments running or
+        ahead in the queue before every wait.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with _locked_queue(self.path) as queue:
+            queue['waiting'].append(self.entry)
+            self.acquired = self._try_acquire(queue)
+            ahead = self._count_ahead(queue)
+        self.queued = True
+        while not self.acquired:
+            if deadline is not None and time.monotonic() >= deadline:
+                self.release()
+                return False
+            if on_wait is not None:
+                on_wait(ahead)
+            time.sleep(POLL_INTERVAL)
+            with _locked_queue(self.path) as queue:
+                self.acquired = self._try_acquire(queue)
+                ahead = self._count_ahead(queue)
+        return True
+
+    def release(self):
+        """
+        Leaves the queue, whether the slot was acquired or not
+        """
+        if not self.queued:
+            return
+        with _locked_queue(self.path) as queue:
+            for key in ('running', 'waiting'):
+                queue[key] = [entry for entry in queue[key] if entry['id'] != self.entry['id']]
+        self.acquired = self.queued = False
@@ -0,0 +1,157 @@
+"""
+Offline snapshots of the stack inventory
+
+``lizzy snapshot`` saves the stacks of one or more regions, with the traffic
+weight of the serving ones, to a gzip compressed JSON file with one list per
+column. Taking a new snapshot over an old one only requests the traffic of
+the applications whose stacks changed since then (or whose weights are older
+than ``max_age``), the other weights are carried over. ``list`` and
+``traffic`` can read a snapshot instead of asking the agent.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from .lizzy import Lizzy
+from .models import Stack, make_stack_id
+from .workflows import SERVING_STATES
+
+FORMAT_VERSION = 1
+COLUMNS = ['region', 'stack_name', 'version', 'status', 'creation_time',
+           'description', 'weight', 'weight_fetched_at']
+MAX_TRAFFIC_WORKERS = 8
+TRAFFIC_MAX_AGE = 24 * 60 * 60  # seconds
+
+SnapshotEntry = namedtuple('SnapshotEntry', COLUMNS)
+
+
+class SnapshotError(Exception):
+    """
+    The snapshot file can't be read
+    """
+
+
+def _in_region(entry: SnapshotEntry, region: Optional[str]) -> bool:
+    # entries without a region were taken in the agent's default region,
+    # which could be any
+    return region is None or entry.region is None or entry.region == region
+
+
+class Snapshot:
+    """
+    Stacks and traffic weights of an agent at the time the snapshot was
+    taken
+    """
+
+    def __init__(self, agent_url: str, taken_at: float, entries: Iterable[SnapshotEntry]=()):
+        self.agent_url = agent_url
+        self.taken_at = taken_at
+        self.entries = list(entries)
+
+    def stacks(self, region: Optional[str]=None) -> List[Stack]:
+        return [Stack(entry.stack_name, entry.version, status=entry.status,
+                      creation_time=entry.creation_time, description=entry.description)
+                for entry in self.entries if _in_region(entry, region)]
+
+    def weights(self, stack_name: str, region: Optional[str]=None) -> Dict[str, float]:
+        """
+        Traffic weight of each serving version of ``stack_name``
+        """
+        return OrderedDict((entry.version, entry.weight) for entry in self.entries
+                           if entry.stack_name == stack_name and entry.weight is not None and
+                           _in_region(entry, region))
+
+    def to_columns(self) -> dict:
+        return {'format': FORMAT_VERSION,
+                'agent_url': self.agent_url,
+                'taken_at': self.taken_at,
+                'columns': {column: [getattr(entry, column) for entry in self.entries]
+                            for column in COLUMNS}}
+
+    @classmethod
+    def from_columns(cls, data: dict) -> 'Snapshot':
+        if data.get('format') != FORMAT_VERSION:
+            raise SnapshotError('Unsupported snapshot format {}'.format(data.get('format')))
+        columns = data['columns']
+        return cls(data['agent_url'], data['taken_at'],
+                   (SnapshotEntry(*row) for row in zip(*(columns[column] for column in COLUMNS))))
+
+
+def load(path: str) -> Snapshot:
+    """
+    :raises SnapshotError: if the file is missing or isn't a snapshot
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as fd:
+            return Snapshot.from_columns(json.load(fd))
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+        raise SnapshotError('Can\'t read snapshot {}: {}'.format(path, e))
+
+
+def save(snapshot: Snapshot, path: str):
+    """
+    Atomically replaces ``path`` with the snapshot
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as fd:
+        with gzip.GzipFile(fileobj=fd, mode='wb', mtime=0) as compressed:
+            compressed.write(json.dumps(snapshot.to_columns(), separators=(',', ':')).encode())
+    os.replace(fd.name, path)
+
+
+def take(lizzy: Lizzy, regions: Iterable[Optional[str]], *,
+         previous: Optional[Snapshot]=None, max_age: float=TRAFFIC_MAX_AGE,
+         page_size: Optional[int]=None, max_workers: int=MAX_TRAFFIC_WORKERS) -> (Snapshot, int):
+    """
+    Takes a snapshot of the stacks in ``regions``, reusing the traffic
+    weights of ``previous`` where nothing changed.
+
+    Returns the snapshot and the number of traffic requests sent.
+    """
+    now = time.time()
+    if previous is not None and previous.agent_url != str(lizzy.api_url):
+        previous = None
+    old_entries = {_stack_key(entry): entry
+                   for entry in (previous.entries if previous is not None else ())}
+
+    entries = []
+    for region in regions:
+        entries.extend(SnapshotEntry(region, stack.stack_name, stack.version, stack.status,
+                                     stack.raw_creation_time, stack.description, None, None)
+                       for stack in lizzy.iter_stacks(region=region, page_size=page_size))
+
+    # deployments shift the traffic between all versions of an application, so
+    # a new, changed or deleted stack invalidates the weights of its siblings
+    changed = {key[:2] for key in set(map(_stack_key, entries)).symmetric_difference(old_entries)}
+
+    def fetch_weight(entry: SnapshotEntry) -> float:
+        stack_id = make_stack_id(entry.stack_name, entry.version)
+        return lizzy.get_traffic(stack_id, region=entry.region)['weight']
+
+    fetching = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for index, entry in enumerate(entries):
+            if entry.status not in SERVING_STATES:
+                continue
+            old = old_entries.get(_stack_key(entry))
+            if (old is not None and old.weight is not None and
+                    (entry.region, entry.stack_name) not in changed and
+                    now - old.weight_fetched_at <= max_age):
+                entries[index] = entry._replace(weight=old.weight,
+                                                weight_fetched_at=old.weight_fetched_at)
+            else:
+                fetching[index] = executor.submit(fetch_weight, entry)
+        for index, future in fetching.items():
+            entries[index] = entries[index]._replace(weight=future.result(), weight_fetched_at=now)
+    entries.sort(key=lambda entry: (entry.region or '', entry.stack_name, entry.version))
+    return Snapshot(str(lizzy.api_url), now, entries), len(fetching)
+
+
+def _stack_key(entry: SnapshotEntry) -> tuple:
+    return entry.region, entry.stack_name, entry.version, entry.status, entry.creation_time
@@ -1,13 +1,96 @@
+import threading
+from typing import Callable, Optional
+
 import tokens
 
+# seconds between background checks of the token; tokens.get only requests a
+# new one when the cached token is about to expire
+REFRESH_INTERVAL = 60
+
+# tokens.manage forgets the cached token, so it's only called again when the
+# configuration changes
+_managed_configuration = None
+
 
 def get_token(url: str, scopes: str, credentials_dir: str) -> dict:
     """
     Get access token info.
     """
+    global _managed_configuration
 
-    tokens.configure(url=url, dir=credentials_dir)
-    tokens.manage('lizzy', [scopes])
-    tokens.start()
+    configuration = (url, scopes, credentials_dir)
+    if configuration != _managed_configuration or 'lizzy' not in tokens.TOKENS:
+        tokens.configure(url=url, dir=credentials_dir)
+        tokens.manage('lizzy', [scopes])
+        tokens.start()
+        _managed_configuration = configuration
 
     return tokens.get('lizzy')
+
+
+def refresh_token(url: str, scopes: str, credentials_dir: str) -> str:
+    """
+    Requests a new access token even if the cached one didn't expire yet
+    """
+    get_token(url, scopes, credentials_dir)
+    return tokens.refresh('lizzy')['access_token']
+
+
+class TokenProvider:
+    """
+    Holds the access token of a client, keeping it fresh for long running
+    commands.
+
+    ``fetch`` returns a valid token, reusing it while it isn't about to
+    expire, and ``refresh`` forces a new one, e.g. after the agent rejected
+    the current token. Once :meth:`start` is called, ``fetch`` is called in
+    the background every ``interval`` seconds so the token is renewed before
+    it expires.
+    """
+
+    def __init__(self, fetch: Callable[[], str], refresh: Optional[Callable[[], str]]=None,
+                 token: Optional[str]=None, interval: float=REFRESH_INTERVAL):
+        self._fetch = fetch
+        self._refresh = refresh or fetch
+        self._token = token
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def fixed(cls, token: str) -> 'TokenProvider':
+        return cls(lambda: token, token=token)
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token is None:
+                self._token = self._fetch()
+            return self._token
+
+    def refresh(self) -> str:
+        """
+        Replaces the token with a new one and returns it
+        """
+        with self._lock:
+            self._token = self._refresh()
+            return self._token
+
+    def _keep_fresh(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                token = self._fetch()
+            except Exception:
+                continue  # keep the current token, a 401 will force a refresh
+            with self._lock:
+                self._token = token
+
+    def start(self) -> 'TokenProvider':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._keep_fresh, name='lizzy-token',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,146 @@
+"""
+Timeline of the phases and HTTP requests of a lizzy run
+
+Code marks its phases with :func:`phase` and the client reports each HTTP
+request with :func:`record_request`. Both are no-ops unless a recorder, like
+:class:`Tracer`, was registered with :func:`add_recorder`.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import click
+import requests
+
+_recorders = []
+
+
+def add_recorder(recorder):
+    _recorders.append(recorder)
+
+
+def remove_recorder(recorder):
+    if recorder in _recorders:
+        _recorders.remove(recorder)
+
+
+def is_recording() -> bool:
+    return bool(_recorders)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Records the time spent inside the block as the phase ``name``
+    """
+    if not _recorders:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, start, time.perf_counter() - start)
+
+
+def record_phase(name: str, start: float, duration: float):
+    for recorder in list(_recorders):
+        recorder.on_phase(name, start, duration)
+
+
+def record_request(method: str, url: str,
+                   response: Optional[requests.Response], start: float):
+    """
+    Reports a finished HTTP request. ``response`` is None when the request
+    failed without a response.
+    """
+    if not _recorders:
+        return
+    duration = time.perf_counter() - start
+    status = size = None
+    if response is not None:
+        status = response.status_code
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None:
+            size = int(content_length)
+        elif getattr(response, '_content_consumed', True):
+            size = len(response.content or b'')
+    for recorder in list(_recorders):
+        recorder.on_request(method, url, status, size, start, duration)
+
+
+class Tracer:
+    """
+    Keeps the timeline of a run in memory
+    """
+
+    def __init__(self, started_at: Optional[float]=None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.events = []  # type: List[dict]
+
+    def on_phase(self, name: str, start: float, duration: float):
+        self.events.append({'name': name, 'cat': 'phase',
+                            'start': start, 'duration': duration,
+                            'tid': threading.get_ident(), 'args': {}})
+
+    def on_request(self, method: str, url: str, status: Optional[int],
+                   size: Optional[int], start: float, duration: float):
+        self.events.append({'name': '{} {}'.format(method, url), 'cat': 'http',
+                            'start': start, 'duration': duration,
+                            'tid': threading.get_ident(),
+                            'args': {'method': method, 'url': url,
+                                     'status': status, 'bytes': size}})
+
+    def sorted_events(self) -> List[dict]:
+        return sorted(self.events, key=lambda event: event['start'])
+
+    def print_summary(self):
+        events = self.sorted_events()
+        total = time.perf_counter() - self.started_at
+        click.echo('Trace (total {:.3f}s):'.format(total), err=True)
+        for event in events:
+            offset = event['start'] - self.started_at
+            if event['cat'] == 'http':
+                args = event['args']
+                description = '{} {} {} ({} bytes)'.format(args['method'],
+                                                           args['status'] or 'ERR',
+                                                           args['url'],
+                                                           args['bytes'] if args['bytes'] is not None else '?')
+            else:
+                description = event['name']
+            click.echo('  +{:8.3f}s {:10.1f}ms  {}'.format(offset,
+                                                           event['duration'] * 1000,
+                                                           description),
+                       err=True)
+
+        http_events = [event for event in events if event['cat'] == 'http']
+        if http_events:
+            http_time = sum(event['duration'] for event in http_events)
+            click.echo('  {} HTTP requests, {:.1f}ms in total'.format(len(http_events),
+                                                                      http_time * 1000),
+                       err=True)
+
+    def chrome_trace(self) -> dict:
+        """
+        Timeline in the Trace Event Format read by chrome://tracing
+        """
+        pid = os.getpid()
+        trace_events = []
+        for event in self.sorted_events():
+            trace_events.append({'name': event['name'],
+                                 'cat': event['cat'],
+                                 'ph': 'X',
+                                 'ts': round((event['start'] - self.started_at) * 1e6),
+                                 'dur': round(event['duration'] * 1e6),
+                                 'pid': pid,
+                                 'tid': event['tid'],
+                                 'args': event['args']})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path: str):
+        with open(path, 'w') as fd:
+            json.dump(self.chrome_trace(), fd)
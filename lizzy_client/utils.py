@@ -1,29 +1,115 @@
+import datetime
+import math
 import os
 import re
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from numbers import Number
+from typing import Iterable, List, Optional, Union
 from urllib.error import URLError
 from urllib.parse import quote
 from urllib.request import urlopen
 
 import click
+import dateutil.parser
+import requests
 import yaml
 
+from . import remote, tracing
+
 StackReference = namedtuple('StackReference', 'name version')
+ScaleTarget = namedtuple('ScaleTarget', 'name version new_scale')
+
+MAX_SCALE = 999
+
+VERSION_REF_PATTERN = re.compile(r'v[0-9][a-zA-Z0-9-]*$')
+
+ISO_8601_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})'
+                              r'(?:\.(\d{1,6})\d*)?'
+                              r'(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def get_scale_targets(words: List[str]) -> List[ScaleTarget]:
+    """
+    Parses ``stack_name stack_version new_scale`` triples. Scales are
+    clamped to 0..999.
+    """
+    if len(words) % 3:
+        raise click.UsageError('Expected STACK_NAME STACK_VERSION NEW_SCALE triples')
+    targets = []
+    for name, version, new_scale in zip(*[iter(words)] * 3):
+        try:
+            new_scale = int(new_scale)
+        except ValueError:
+            raise click.UsageError('{} is not a valid scale for {} {}'.format(new_scale, name, version))
+        targets.append(ScaleTarget(name, version, min(max(new_scale, 0), MAX_SCALE)))
+    return targets
+
+
+def read_scale_file(lines: Iterable[str]) -> List[ScaleTarget]:
+    """
+    Reads one ``stack_name stack_version new_scale`` triple per line, ignoring
+    empty lines and comments
+    """
+    words = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        triple = line.split()
+        if len(triple) != 3:
+            raise click.UsageError('Line {}: expected STACK_NAME STACK_VERSION NEW_SCALE'.format(line_number))
+        words.extend(triple)
+    return get_scale_targets(words)
 
 
 def read_parameter_file(parameter_file):  # copy pasted from Senza
+    with tracing.phase('parameter_file'):
+        return _read_parameter_file(parameter_file)
+
+
+def read_parameter_files(parameter_files: Iterable[str],
+                         downloads: Optional[remote.Downloads]=None) -> List[str]:
+    """
+    Reads and merges many parameter files, downloading the remote ones
+    concurrently (picking up the ones already in ``downloads``). Values of
+    later files win, the parameters keep the order in which they first
+    appear.
+    """
+    parameter_files = list(parameter_files)
+    values = OrderedDict()
+    with tracing.phase('parameter_file'):
+        downloads = remote.prefetch(parameter_files, downloads=downloads)
+        try:
+            for parameter_file in parameter_files:
+                for parameter in _read_parameter_file(parameter_file, downloads):
+                    key, _, value = parameter.partition('=')
+                    values[key] = value
+        finally:
+            remote.cancel(downloads)
+    return ['{}={}'.format(key, value) for key, value in values.items()]
+
+
+def _read_parameter_file(parameter_file, downloads: Optional[remote.Downloads]=None):
     paras = []
 
-    try:
-        url = (parameter_file if '://' in parameter_file
-               else 'file://{}'.format(quote(os.path.abspath(parameter_file))))
+    if remote.is_remote(parameter_file):
+        try:
+            content = remote.fetch(parameter_file, downloads=downloads)
+        except requests.RequestException:
+            raise click.UsageError('Can\'t read parameter file "{}"'.format(parameter_file))
+    else:
+        try:
+            url = (parameter_file if '://' in parameter_file
+                   else 'file://{}'.format(quote(os.path.abspath(parameter_file))))
 
-        response = urlopen(url)
-    except URLError:
-        raise click.UsageError('Can\'t read parameter file "{}"'.format(parameter_file))
+            response = urlopen(url, timeout=remote.FETCH_TIMEOUT)
+        except URLError:
+            raise click.UsageError('Can\'t read parameter file "{}"'.format(parameter_file))
+        content = response.read()
 
     try:
-        cfg = yaml.safe_load(response.read())
+        cfg = yaml.safe_load(content)
         for key, val in cfg.items():
             paras.append("{}={}".format(key, val))
     except yaml.YAMLError as e:
@@ -32,6 +118,67 @@ def read_parameter_file(parameter_file):  # copy pasted from Senza
     return paras
 
 
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: Union[str, Number]) -> datetime.datetime:
+    """
+    Parses a timestamp sent by the agent.
+
+    Unix epochs and the ISO 8601 format used by the agent are parsed directly,
+    anything else falls back to dateutil's (much slower) heuristic parser.
+    """
+    if isinstance(value, Number):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+
+    match = ISO_8601_PATTERN.match(value)
+    if match:
+        year, month, day, hour, minute, second, fraction, offset = match.groups()
+        microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+        if offset is None:
+            tzinfo = None
+        elif offset == 'Z':
+            tzinfo = datetime.timezone.utc
+        else:
+            offset = offset.replace(':', '')
+            delta = datetime.timedelta(hours=int(offset[1:3]),
+                                       minutes=int(offset[3:5]))
+            tzinfo = datetime.timezone(-delta if offset[0] == '-' else delta)
+        return datetime.datetime(int(year), int(month), int(day),
+                                 int(hour), int(minute), int(second),
+                                 microsecond, tzinfo=tzinfo)
+
+    try:
+        epoch = float(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of ``values``
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(percent * len(ordered) / 100) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def read_stack_name(ref: str) -> str:
+    """
+    Returns the stack name of a Senza definition file or ``ref`` itself if
+    it isn't a file.
+    """
+    if not os.path.isfile(ref):
+        return ref
+    try:
+        with open(ref) as fd:
+            data = yaml.safe_load(fd)
+        return data['SenzaInfo']['StackName']
+    except (OSError, KeyError, TypeError, yaml.YAMLError):
+        raise click.UsageError('Invalid senza definition {}'.format(ref))
+
+
 def get_stack_refs(refs: list):  # copy pasted from Senza
     """
     Returns a list of stack references with name and version.
@@ -42,16 +189,11 @@ def get_stack_refs(refs: list):  # copy pasted from Senza
     last_stack = None
     while refs:
         ref = refs.pop()
-        if last_stack is not None and re.compile(r'v[0-9][a-zA-Z0-9-]*$').match(ref):
+        if last_stack is not None and VERSION_REF_PATTERN.match(ref):
             stack_refs.append(StackReference(last_stack, ref))
         else:
-            try:
-                with open(ref) as fd:
-                    data = yaml.safe_load(fd)
-                ref = data['SenzaInfo']['StackName']
-            except (OSError, IOError):
-                # It's still possible that the ref is a regex
-                pass
+            # if it's not a file it's still possible that the ref is a regex
+            ref = read_stack_name(ref)
 
             if refs:
                 version = refs.pop()
@@ -60,3 +202,25 @@ def get_stack_refs(refs: list):  # copy pasted from Senza
             stack_refs.append(StackReference(ref, version))
             last_stack = ref
     return stack_refs
+
+
+def _compile_ref(pattern: str):
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+def match_stack_refs(stack_refs: Iterable[StackReference], stacks: Iterable) -> list:
+    """
+    Returns the ``stacks`` matched by any of the references, in their order.
+
+    Like in Senza, the names and versions of the references are regular
+    expressions that must match in full.
+    """
+    patterns = [(_compile_ref(ref.name), _compile_ref(ref.version) if ref.version else None)
+                for ref in stack_refs]
+    return [stack for stack in stacks
+            if any(name.fullmatch(stack.stack_name) and
+                   (version is None or version.fullmatch(stack.version))
+                   for name, version in patterns)]
@@ -0,0 +1,180 @@
+"""
+Local validation of Senza definitions
+
+Catches the mistakes the agent (or Cloud Formation, minutes later) would
+reject: a malformed SenzaInfo, missing or unknown parameters and badly
+formatted tags. The checks run in parallel and their results are cached in
+``LIZZY_HOME`` by a hash of everything they look at.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from .configuration import Configuration
+
+CACHE_VERSION = 1  # bump when the checks change
+
+STACK_NAME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9-]*$')
+MAX_STACK_ID_LENGTH = 128
+MAX_TAG_KEY_LENGTH = 128
+MAX_TAG_VALUE_LENGTH = 256
+
+ValidationIssue = namedtuple('ValidationIssue', 'check message')
+
+
+def check_senza_info(definition, version: str, parameters: List[str], tags: List[str]) -> List[str]:
+    if not isinstance(definition, dict):
+        return ['The definition must be a mapping']
+    senza_info = definition.get('SenzaInfo')
+    if not isinstance(senza_info, dict):
+        return ['SenzaInfo must be a mapping']
+
+    issues = []
+    stack_name = senza_info.get('StackName')
+    if not isinstance(stack_name, str):
+        issues.append('SenzaInfo.StackName is missing')
+    elif not STACK_NAME_PATTERN.match(stack_name):
+        issues.append('SenzaInfo.StackName "{}" must match {}'.format(stack_name,
+                                                                      STACK_NAME_PATTERN.pattern))
+    elif len(stack_name) + len(version) + 1 > MAX_STACK_ID_LENGTH:
+        issues.append('Stack ID {}-{} is longer than {} characters'.format(
+            stack_name, version, MAX_STACK_ID_LENGTH))
+
+    for key in ('Parameters', 'Tags'):
+        entries = senza_info.get(key, [])
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) and len(entry) == 1
+                                                    for entry in entries):
+            issues.append('SenzaInfo.{} must be a list of single key mappings'.format(key))
+    if not isinstance(definition.get('SenzaComponents', []), list):
+        issues.append('SenzaComponents must be a list')
+    return issues
+
+
+def _definition_parameters(definition) -> Optional[list]:
+    try:
+        entries = definition['SenzaInfo'].get('Parameters', [])
+        return [(name, options or {}) for entry in entries for name, options in entry.items()]
+    except (AttributeError, KeyError, TypeError):
+        return None  # reported by check_senza_info
+
+
+def check_parameters(definition, version: str, parameters: List[str], tags: List[str]) -> List[str]:
+    """
+    Checks the parameters like Senza assigns them: positional values in the
+    order of the definition, ``name=value`` ones by name
+    """
+    definition_parameters = _definition_parameters(definition)
+    if definition_parameters is None:
+        return []
+    names = [name for name, _ in definition_parameters]
+
+    issues = []
+    values = {}
+    positional = [parameter for parameter in parameters if '=' not in parameter]
+    if len(positional) > len(names):
+        issues.append('Got {} positional parameters but the definition only has {}'.format(
+            len(positional), len(names)))
+    values.update(zip(names, positional))
+    for parameter in parameters:
+        if '=' not in parameter:
+            continue
+        name, _, value = parameter.partition('=')
+        if name not in names:
+            issues.append('Unknown parameter {}'.format(name))
+        elif name in values:
+            issues.append('Parameter {} is given more than once'.format(name))
+        values[name] = value
+
+    for name, options in definition_parameters:
+        if name not in values:
+            if 'Default' not in options:
+                issues.append('Missing value for parameter {}'.format(name))
+            continue
+        allowed_values = options.get('AllowedValues')
+        if allowed_values and values[name] not in [str(allowed) for allowed in allowed_values]:
+            issues.append('Parameter {} must be one of {}'.format(name, ', '.join(map(str, allowed_values))))
+    return issues
+
+
+def check_tags(definition, version: str, parameters: List[str], tags: List[str]) -> List[str]:
+    issues = []
+    keys = set()
+    for tag in tags:
+        key, separator, value = tag.partition('=')
+        if not separator or not key:
+            issues.append('Tag "{}" must have the format key=value'.format(tag))
+            continue
+        if key.lower().startswith('aws:'):
+            issues.append('Tag {} uses the reserved prefix "aws:"'.format(key))
+        if len(key) > MAX_TAG_KEY_LENGTH:
+            issues.append('Tag key {} is longer than {} characters'.format(key, MAX_TAG_KEY_LENGTH))
+        if len(value) > MAX_TAG_VALUE_LENGTH:
+            issues.append('Value of tag {} is longer than {} characters'.format(key, MAX_TAG_VALUE_LENGTH))
+        if key in keys:
+            issues.append('Tag {} is given more than once'.format(key))
+        keys.add(key)
+    return issues
+
+
+VALIDATORS = [('senza_info', check_senza_info),
+              ('parameters', check_parameters),
+              ('tags', check_tags)]
+
+
+def cache_key(definition, version: str, parameters: List[str], tags: List[str]) -> str:
+    data = json.dumps([CACHE_VERSION, definition, version, parameters, tags],
+                      sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(Configuration().home_dir, 'validation', key + '.json')
+
+
+def _read_cache(key: str) -> Optional[List[ValidationIssue]]:
+    try:
+        with open(_cache_path(key)) as fd:
+            return [ValidationIssue(*issue) for issue in json.load(fd)]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _write_cache(key: str, issues: List[ValidationIssue]):
+    path = _cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as fd:
+            json.dump(issues, fd)
+        os.replace(fd.name, path)
+    except OSError:
+        pass  # the cache is only an optimization
+
+
+def validate(definition, version: str, parameters: List[str]=(), tags: List[str]=(),
+             use_cache: bool=True) -> List[ValidationIssue]:
+    """
+    Runs all checks and returns the issues found
+    """
+    parameters, tags = list(parameters), list(tags)
+    key = cache_key(definition, version, parameters, tags)
+    if use_cache:
+        issues = _read_cache(key)
+        if issues is not None:
+            return issues
+
+    with ThreadPoolExecutor(max_workers=len(VALIDATORS)) as executor:
+        futures = [(name, executor.submit(check, definition, version, parameters, tags))
+                   for name, check in VALIDATORS]
+        issues = [ValidationIssue(name, message)
+                  for name, future in futures
+                  for message in future.result()]
+
+    if use_cache:
+        _write_cache(key, issues)
+    return issues
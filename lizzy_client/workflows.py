@@ -0,0 +1,416 @@
+"""
+Deployment workflows
+
+The steps of a deployment (create, wait, traffic change and clean up) as a
+Python API. Nothing here prints or exits: results are returned as tuples,
+failed deployments raise :mod:`lizzy_client.exceptions` errors and errors
+talking to the agent are raised as ``requests`` exceptions, so many
+deployments can be driven from a single process::
+
+    lizzy = Lizzy(agent_url, access_token)
+    result = deploy(lizzy, definition, 'v42', ['1.0'], traffic=100, keep_stacks=1)
+"""
+
+import datetime
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+
+from . import deadlines, rebalance, tracing
+from .exceptions import (DeploymentError, InvalidTrafficWeights,
+                         StackRolledBack, TrafficChangeError, TrafficMismatch)
+from .lizzy import Lizzy
+from .models import Stack, make_stack_id
+from .utils import ScaleTarget, StackReference, match_stack_refs
+
+COMPLETE_STATES = [
+    'CREATE_COMPLETE',
+    'ROLLBACK_COMPLETE',
+    'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_COMPLETE'
+]
+
+CLEANUP_RETRY_INTERVAL = 5
+WAIT_INTERVAL = 10
+
+# states wait_for_stacks reports for stacks missing from the listing
+NOT_FOUND = 'NOT_FOUND'
+DELETE_COMPLETE = 'DELETE_COMPLETE'
+
+DeploymentResult = namedtuple('DeploymentResult', 'stack output final_status cleanup')
+CleanupResult = namedtuple('CleanupResult', 'removed failed timed_out')
+ScaleResult = namedtuple('ScaleResult', 'stack_id new_scale error duration')
+RebalanceResult = namedtuple('RebalanceResult', 'changes batch weights')
+DeploymentPlan = namedtuple('DeploymentPlan',
+                            'stack_id existing delete current_weights weights warnings')
+
+SERVING_STATES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+
+MAX_SCALE_WORKERS = 8
+
+
+def request_stack(lizzy: Lizzy, definition: dict, version: str,
+                  parameters: Iterable[str]=(), *,
+                  region: Optional[str]=None,
+                  disable_rollback: bool=False,
+                  dry_run: bool=False,
+                  tags: Iterable[str]=(),
+                  keep_stacks: Optional[int]=None,
+                  traffic: Optional[int]=None) -> (Stack, str):
+    """
+    Requests a new stack and returns it with the agent output
+    """
+    return lizzy.new_stack(keep_stacks, traffic, definition, version,
+                           disable_rollback, list(parameters),
+                           region=region, dry_run=dry_run, tags=tags)
+
+
+def wait_for_stack(lizzy: Lizzy, stack_id: str, *,
+                   region: Optional[str]=None,
+                   on_state: Optional[Callable[[str], None]]=None) -> str:
+    """
+    Waits until the stack reaches a final state and returns it.
+
+    :raises StackRolledBack: if Cloud Formation rolled the stack back
+    :raises DeploymentError: if the stack ended in any other unsuccessful state
+    """
+    last_state = None
+    for state in lizzy.wait_for_deployment(stack_id, region=region):
+        if on_state is not None:
+            on_state(state)
+        last_state = state
+
+    # TODO be prepared to handle all final AWS CF states
+    if last_state == 'ROLLBACK_COMPLETE':
+        raise StackRolledBack(stack_id)
+    elif last_state != 'CREATE_COMPLETE':
+        raise DeploymentError(stack_id, last_state)
+    return last_state
+
+
+def is_final_state(state: Optional[str]) -> bool:
+    return state is not None and (state in (NOT_FOUND, DELETE_COMPLETE) or
+                                  state.endswith('_COMPLETE') or state.endswith('_FAILED'))
+
+
+def wait_for_stacks(lizzy: Lizzy, stack_ids: Iterable[str], *,
+                    region: Optional[str]=None,
+                    interval: float=WAIT_INTERVAL,
+                    timeout: Optional[float]=None,
+                    on_update: Optional[Callable[[Dict[str, Optional[str]]], None]]=None
+                    ) -> Dict[str, Optional[str]]:
+    """
+    Waits until all stacks reach a final state, polling all of them with a
+    single listing per round, and returns the last state of each.
+
+    ``on_update`` gets the states of all stacks after every round. Stacks
+    that disappear during the wait are reported as ``DELETE_COMPLETE``, the
+    ones that never showed up as ``NOT_FOUND``. Stacks still in progress
+    after ``timeout`` seconds keep their last state.
+    """
+    stack_ids = list(OrderedDict.fromkeys(stack_ids))
+    stack_names = sorted({stack_id.rsplit('-', 1)[0] for stack_id in stack_ids})
+    states = OrderedDict.fromkeys(stack_ids)  # type: Dict[str, Optional[str]]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    retries = 3
+    while True:
+        pending = [stack_id for stack_id in stack_ids if not is_final_state(states[stack_id])]
+        try:
+            with tracing.phase('poll'):
+                found = {stack.stack_id: stack.status
+                         for stack in lizzy.iter_stacks(stack_names, region=region)}
+        except requests.RequestException:
+            retries -= 1
+            if not retries:
+                raise
+        else:
+            retries = 3
+            for stack_id in pending:
+                if stack_id in found:
+                    states[stack_id] = found[stack_id]
+                else:
+                    states[stack_id] = NOT_FOUND if states[stack_id] is None else DELETE_COMPLETE
+            if on_update is not None:
+                on_update(OrderedDict(states))
+
+        if all(is_final_state(state) for state in states.values()):
+            return states
+        if deadline is not None and time.monotonic() + interval > deadline:
+            return states
+        with tracing.phase('sleep'):
+            time.sleep(interval)
+
+
+def resolve_stack_refs(lizzy: Lizzy, stack_refs: Iterable[StackReference], *,
+                       region: Optional[str]=None,
+                       page_size: Optional[int]=None) -> List[str]:
+    """
+    Returns the IDs of the stacks matching ``stack_refs`` (see
+    :func:`lizzy_client.utils.match_stack_refs`), listing the stacks once
+    for all references
+    """
+    stack_refs = list(stack_refs)
+    if not stack_refs:
+        return []
+    names = list(OrderedDict.fromkeys(ref.name for ref in stack_refs))
+    stacks = lizzy.iter_stacks(names, region=region, page_size=page_size)
+    return [stack.stack_id for stack in match_stack_refs(stack_refs, stacks)]
+
+
+def select_stacks_to_remove(stacks: Iterable[Stack], versions_to_keep: int) -> List[Stack]:
+    """
+    Returns the ``stacks`` older than the newest ``versions_to_keep`` ones,
+    oldest first
+    """
+    stacks = sorted(stacks, key=Stack.creation_order)
+    return stacks[:max(len(stacks) - versions_to_keep, 0)]
+
+
+def find_stacks_to_remove(lizzy: Lizzy, stack_name: str, keep_stacks: int, *,
+                          region: Optional[str]=None,
+                          page_size: Optional[int]=None) -> List[Stack]:
+    """
+    Returns the versions of ``stack_name`` older than the newest
+    ``keep_stacks`` + 1 ones, oldest first
+    """
+    return select_stacks_to_remove(lizzy.iter_stacks([stack_name], region=region,
+                                                     page_size=page_size),
+                                   keep_stacks + 1)
+
+
+def remove_old_stacks(lizzy: Lizzy, stack_name: str, keep_stacks: int, *,
+                      region: Optional[str]=None,
+                      timeout: float=120,
+                      page_size: Optional[int]=None,
+                      on_delete: Optional[Callable[[Stack], None]]=None,
+                      on_pending: Optional[Callable[[Stack], None]]=None,
+                      on_error: Optional[Callable[[Stack, Exception], None]]=None
+                      ) -> CleanupResult:
+    """
+    Deletes the old versions of ``stack_name``, keeping the newest
+    ``keep_stacks`` besides the current one.
+
+    Stacks that are not in a complete state yet, or that failed to be
+    deleted, are retried until ``timeout`` seconds passed or the deadline of
+    the operation is near. Errors listing the stacks are raised.
+    """
+    removed = []
+    failed = {}
+    end_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=deadlines.bound(timeout))
+    stacks_to_remove_counter = 1
+    while (stacks_to_remove_counter > 0 and datetime.datetime.utcnow() <= end_time and
+           not deadlines.expired()):
+        stacks_to_remove = find_stacks_to_remove(lizzy, stack_name, keep_stacks,
+                                                 region=region, page_size=page_size)
+        stacks_to_remove_counter = len(stacks_to_remove)
+        for old_stack in stacks_to_remove:
+            if old_stack.status not in COMPLETE_STATES:
+                if on_pending is not None:
+                    on_pending(old_stack)
+                continue
+            if on_delete is not None:
+                on_delete(old_stack)
+            try:
+                lizzy.delete(old_stack.stack_id, region=region)
+            except requests.RequestException as e:
+                failed[old_stack.stack_id] = e
+                if on_error is not None:
+                    on_error(old_stack, e)
+            else:
+                failed.pop(old_stack.stack_id, None)
+                removed.append(old_stack)
+                stacks_to_remove_counter -= 1
+        if stacks_to_remove_counter > 0:
+            with tracing.phase('sleep'):
+                time.sleep(deadlines.bound(CLEANUP_RETRY_INTERVAL))
+
+    timed_out = stacks_to_remove_counter > 0
+    return CleanupResult(removed, failed, timed_out)
+
+
+def scale_stacks(lizzy: Lizzy, targets: Iterable[ScaleTarget], *,
+                 region: Optional[str]=None,
+                 max_workers: int=MAX_SCALE_WORKERS,
+                 on_result: Optional[Callable[[ScaleResult], None]]=None
+                 ) -> List[ScaleResult]:
+    """
+    Rescales many stacks concurrently, with at most ``max_workers`` requests
+    in flight.
+
+    Failures don't stop the other stacks: the results, in the order of
+    ``targets``, carry the error of each failed stack.
+    """
+    def scale(target: ScaleTarget) -> ScaleResult:
+        stack_id = make_stack_id(target.name, target.version)
+        start = time.perf_counter()
+        try:
+            lizzy.scale(stack_id, target.new_scale, region=region)
+        except requests.RequestException as e:
+            error = e
+        else:
+            error = None
+        return ScaleResult(stack_id, target.new_scale, error, time.perf_counter() - start)
+
+    targets = list(targets)
+    results = [None] * len(targets)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scale, target): index
+                   for index, target in enumerate(targets)}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def get_traffic_weights(lizzy: Lizzy, stack_name: str, *,
+                        region: Optional[str]=None) -> Dict[str, float]:
+    """
+    Returns the traffic weight of each serving version of ``stack_name``, by
+    stack id
+    """
+    return {stack.stack_id: lizzy.get_traffic(stack.stack_id, region=region)['weight']
+            for stack in lizzy.get_stacks([stack_name], region=region)
+            if stack.status in SERVING_STATES}
+
+
+def rebalance_traffic(lizzy: Lizzy, stack_name: str, targets: Dict[str, float], *,
+                      region: Optional[str]=None,
+                      on_change: Optional[Callable[[str, float], None]]=None
+                      ) -> RebalanceResult:
+    """
+    Distributes the traffic of ``stack_name`` between its versions as given
+    by ``targets``, the percentage for each version. Versions left out get
+    no traffic. The targets are rounded to whole percentages.
+
+    All weights are set with one request if the agent supports it, otherwise
+    with as few traffic changes as possible. The weights are checked once
+    at the end.
+
+    :raises InvalidTrafficWeights: if the targets don't add up to 100 or name
+                                   unknown versions
+    :raises TrafficMismatch: if the final weights differ from the targets
+    """
+    current = get_traffic_weights(lizzy, stack_name, region=region)
+    target_weights = {stack_id: 0.0 for stack_id in current}
+    for version, weight in targets.items():
+        stack_id = make_stack_id(stack_name, version)
+        if stack_id not in current:
+            raise InvalidTrafficWeights('{} has no serving version {}'.format(stack_name, version))
+        target_weights[stack_id] = float(weight)
+    if abs(sum(target_weights.values()) - 100) > rebalance.TOLERANCE:
+        raise InvalidTrafficWeights('Traffic weights must add up to 100')
+    target_weights = rebalance.apportion(target_weights)
+
+    if rebalance.matches(current, target_weights):
+        return RebalanceResult([], False, current)
+
+    changes = []
+    batch = lizzy.set_traffic_weights(stack_name, target_weights, region=region)
+    if not batch:
+        changes = rebalance.plan_changes(current, target_weights)
+        for stack_id, percentage in changes:
+            lizzy.traffic(stack_id, percentage, region=region)
+            if on_change is not None:
+                on_change(stack_id, percentage)
+
+    weights = get_traffic_weights(lizzy, stack_name, region=region)
+    if not rebalance.matches(weights, target_weights, tolerance=1):
+        raise TrafficMismatch(stack_name, target_weights, weights)
+    return RebalanceResult(changes, batch, weights)
+
+
+def plan_deployment(lizzy: Lizzy, definition: dict, version: str, *,
+                    region: Optional[str]=None,
+                    traffic: Optional[int]=None,
+                    keep_stacks: Optional[int]=None,
+                    page_size: Optional[int]=None) -> DeploymentPlan:
+    """
+    Works out what :func:`deploy` would do without changing anything: the
+    stack it would create, the existing stacks oldest first, the ones it would
+    delete and the traffic weights before and after, by stack id (None
+    without ``traffic``).
+
+    The stacks are listed once. The agent doesn't list the traffic weights,
+    so with ``traffic`` the weight of each serving version is requested.
+    """
+    stack_name = definition['SenzaInfo']['StackName']
+    stack_id = make_stack_id(stack_name, version)
+    existing = sorted(lizzy.iter_stacks([stack_name], region=region, page_size=page_size),
+                      key=Stack.creation_order)
+
+    warnings = []
+    if any(stack.stack_id == stack_id for stack in existing):
+        warnings.append('Stack {} already exists'.format(stack_id))
+
+    delete = []
+    if keep_stacks is not None:
+        # the new stack will be the newest one
+        delete = select_stacks_to_remove(existing, keep_stacks)
+        for stack in delete:
+            if stack.status not in COMPLETE_STATES:
+                warnings.append('{} is {}, the cleanup will wait for it'.format(
+                    stack.stack_id, stack.status))
+
+    current = weights = None
+    if traffic is not None:
+        current = OrderedDict((stack.stack_id, lizzy.get_traffic(stack.stack_id, region=region)['weight'])
+                              for stack in existing if stack.status in SERVING_STATES)
+        weights = rebalance.apply_change(current, stack_id, traffic)
+
+    return DeploymentPlan(stack_id, existing, delete, current, weights, warnings)
+
+
+def deploy(lizzy: Lizzy, definition: dict, version: str,
+           parameters: Iterable[str]=(), *,
+           region: Optional[str]=None,
+           disable_rollback: bool=False,
+           dry_run: bool=False,
+           tags: Iterable[str]=(),
+           traffic: Optional[int]=None,
+           keep_stacks: Optional[int]=None,
+           cleanup_timeout: float=120,
+           page_size: Optional[int]=None,
+           deadline: Optional[float]=None,
+           on_state: Optional[Callable[[str], None]]=None) -> DeploymentResult:
+    """
+    Creates a new stack, waits for it, switches ``traffic`` percent of the
+    traffic to it and deletes all but ``keep_stacks`` older versions, all
+    within ``deadline`` seconds if given.
+
+    In ``dry_run`` mode only the stack request is sent.
+
+    :raises StackRolledBack: if Cloud Formation rolled the stack back
+    :raises DeploymentError: if the stack ended in any other unsuccessful state
+    :raises TrafficChangeError: if the traffic could not be switched
+    :raises DeadlineExceeded: if the deadline passed before the stack was
+                              deployed and its traffic switched
+    """
+    with deadlines.deadline(deadline):
+        stack, output = request_stack(lizzy, definition, version, parameters,
+                                      region=region,
+                                      disable_rollback=disable_rollback,
+                                      dry_run=dry_run, tags=tags,
+                                      keep_stacks=keep_stacks, traffic=traffic)
+        if dry_run:
+            return DeploymentResult(stack, output, None, None)
+
+        final_status = wait_for_stack(lizzy, stack.stack_id, region=region,
+                                      on_state=on_state)
+
+        if traffic is not None:
+            try:
+                lizzy.traffic(stack.stack_id, traffic, region=region)
+            except requests.RequestException as e:
+                raise TrafficChangeError(stack.stack_id, e) from e
+
+        cleanup = None
+        if keep_stacks is not None:
+            cleanup = remove_old_stacks(lizzy, stack.stack_name, keep_stacks,
+                                        region=region, timeout=cleanup_timeout,
+                                        page_size=page_size)
+
+        return DeploymentResult(stack, output, final_status, cleanup)
@@ -75,5 +75,6 @@ setup(
     long_description='Lizzy-client',
     entry_points={'console_scripts': ['lizzy = lizzy_client.cli:main_with_metrics',
                                       'please = lizzy_client.cli:main_with_metrics',
-                                      'pretty-please = lizzy_client.cli:main_with_metrics']},
+                                      'pretty-please = lizzy_client.cli:main_with_metrics',
+                                      'lizzy-complete = lizzy_client.completion:main']},
 )
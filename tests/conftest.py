@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock
+
+import pytest
+from lizzy_client.fake_agent import FakeAgent
+
+
+@pytest.fixture(autouse=True)
+def lizzy_home(tmpdir, monkeypatch):
+    """
+    Keeps the local state of the tests out of the user's home
+    """
+    home = tmpdir.join('lizzy-home')
+    monkeypatch.setenv('LIZZY_HOME', str(home))
+    return home
+
+
+@pytest.fixture
+def agent_stacks():
+    """
+    Stacks the fake agent starts with as (stack name, version, traffic)
+    tuples, test modules override it
+    """
+    return [('app', 'v1', None)]
+
+
+@pytest.fixture
+def agent_options():
+    """
+    Keyword arguments of the fake agent, test modules override it
+    """
+    return {}
+
+
+@pytest.fixture
+def agent(agent_stacks, agent_options, monkeypatch):
+    """
+    Fake agent the command line client talks to
+    """
+    with FakeAgent(**agent_options) as agent:
+        for stack_name, version, _ in agent_stacks:
+            agent.add_stack(stack_name, version)
+        for stack_name, version, weight in agent_stacks:
+            if weight is not None:
+                agent.set_traffic('{}-{}'.format(stack_name, version), weight)
+        monkeypatch.setenv('LIZZY_URL', agent.url)
+        monkeypatch.setenv('OAUTH2_ACCESS_TOKEN_URL', agent.token_url)
+        monkeypatch.delenv('AWS_DEFAULT_REGION', raising=False)
+        monkeypatch.setattr('lizzy_client.cli.get_token', MagicMock(return_value=agent.access_token))
+        yield agent
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """
+    Makes the polling loops of the client go on right away
+    """
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+    return sleep
@@ -0,0 +1,46 @@
+import json
+
+from click.testing import CliRunner
+from lizzy_client.bench import SCENARIOS, compare, run_benchmarks
+from lizzy_client.cli import main
+
+
+def test_run_benchmarks():
+    report = run_benchmarks(stacks=5, iterations=2)
+    assert report['environment']['stacks'] == 5
+    assert sorted(report['results']) == sorted(SCENARIOS)
+    for result in report['results'].values():
+        assert result['iterations'] == 2
+        assert result['p50_ms'] > 0
+
+
+def test_compare():
+    baseline = {'results': {'list': {'p50_ms': 10.0}, 'delete': {'p50_ms': 10.0}}}
+    report = {'results': {'list': {'p50_ms': 13.0}, 'delete': {'p50_ms': 11.0}, 'token': {'p50_ms': 1.0}}}
+    rows = compare(report, baseline, max_regression=20)
+    assert rows == [{'scenario': 'list', 'baseline_p50_ms': 10.0, 'p50_ms': 13.0,
+                     'change%': 30.0, 'regression': True},
+                    {'scenario': 'delete', 'baseline_p50_ms': 10.0, 'p50_ms': 11.0,
+                     'change%': 10.0, 'regression': False}]
+
+
+def test_bench_command(tmpdir):
+    results_path = str(tmpdir.join('results.json'))
+    runner = CliRunner()
+    result = runner.invoke(main, ['bench', '--stacks', '3', '--iterations', '2', '--save', results_path],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'Running benchmarks.. OK' in result.output
+    with open(results_path) as fd:
+        report = json.load(fd)
+    assert sorted(report['results']) == sorted(SCENARIOS)
+
+    baseline_path = str(tmpdir.join('baseline.json'))
+    for result in report['results'].values():
+        result['p50_ms'] /= 1000
+    with open(baseline_path, 'w') as fd:
+        json.dump(report, fd)
+    result = runner.invoke(main, ['bench', '--stacks', '3', '--iterations', '2', '--baseline', baseline_path],
+                           catch_exceptions=False)
+    assert 'Slower than the baseline' in result.output
+    assert result.exit_code == 1
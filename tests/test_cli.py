@@ -8,16 +8,21 @@ from urllib.parse import quote
 
 import pytest
 import requests
+import yaml
 from click import UsageError
 from click.testing import CliRunner
 from lizzy_client.cli import fetch_token, main, parse_stack_refs
+from lizzy_client.fake_agent import FakeAgent
 from lizzy_client.lizzy import Lizzy
+from lizzy_client.models import Stack
 from lizzy_client.version import MAJOR_VERSION, MINOR_VERSION, VERSION
 from tokens import InvalidCredentialsError
 from urlpath import URL
 
 fixtures_dir = Path(__file__).parent / 'fixtures'
 config_path = str(fixtures_dir / 'test_config.yaml')
+with open(config_path) as config_file:
+    config_yaml = yaml.dump(yaml.safe_load(config_file))
 
 FAKE_ENV = {'OAUTH2_ACCESS_TOKEN_URL': 'oauth.example.com',
             'LIZZY_URL': 'lizzy.example.com'}
@@ -47,7 +52,9 @@ class FakeLizzy(Lizzy):
     def __init__(self):
         self.access_token = "TOKEN"
         self.api_url = URL('https://localhost')
+        self.stacks = None  # listed by the agent mock unless set
         self._delete_mock = MagicMock()
+        self._list_mock = MagicMock()
 
     @classmethod
     def reset(cls):
@@ -66,6 +73,12 @@ class FakeLizzy(Lizzy):
             pytest.fail("Arity of mocked method not compatible with implementation")
         self._delete_mock(*args, **kwargs)
 
+    def iter_stacks(self, stack_reference=None, region=None, page_size=None):
+        if self.stacks is None:
+            return super().iter_stacks(stack_reference, region=region, page_size=page_size)
+        self._list_mock(stack_reference, region=region)
+        return iter(self.stacks)
+
     def wait_for_deployment(self, stack_id: str, region=None) -> [str]:
         return ['CF:WAITING', self.final_state]
 
@@ -230,12 +243,12 @@ def test_default_does_not_call_traffic(mock_get_token, mock_fake_lizzy,
                                                 'region': 'aa-bbbb-1',
                                                 'parameters': ['1.0', ],
                                                 'dry_run': False,
-                                                'senza_yaml': 'SenzaInfo: [Something]\n',
+                                                'senza_yaml': config_yaml,
                                                 'new_traffic': None,
                                                 'stack_version': '42',
                                                 'tags': ()
                                             },
-                                            verify=False)
+                                            verify=False, timeout=Lizzy.timeout)
     FakeLizzy.traffic.assert_not_called()
     mock_fake_lizzy._delete_mock.assert_not_called()
     mock_lizzy_post.reset_mock()
@@ -267,12 +280,12 @@ def test_create_with_parameters(mock_get_token, mock_fake_lizzy,
                                                 'parameters': ['1.0',
                                                                'param0=value0'],
                                                 'dry_run': False,
-                                                'senza_yaml': 'SenzaInfo: [Something]\n',
+                                                'senza_yaml': config_yaml,
                                                 'new_traffic': 0,
                                                 'stack_version': '42',
                                                 'tags': ()
                                             },
-                                            verify=False)
+                                            verify=False, timeout=Lizzy.timeout)
     FakeLizzy.traffic.assert_called_once_with('stack1-d42', 0, region='aa-bbbb-1')
     mock_fake_lizzy._delete_mock.assert_not_called()
     mock_lizzy_post.reset_mock()
@@ -300,12 +313,12 @@ def test_create_with_parameters(mock_get_token, mock_fake_lizzy,
                                                                'param0=value0',
                                                                'param1=value1'],
                                                 'dry_run': False,
-                                                'senza_yaml': 'SenzaInfo: [Something]\n',
+                                                'senza_yaml': config_yaml,
                                                 'new_traffic': 0,
                                                 'stack_version': '42',
                                                 'tags': ()
                                             },
-                                            verify=False)
+                                            verify=False, timeout=Lizzy.timeout)
 
 
 @pytest.mark.parametrize(
@@ -318,6 +331,8 @@ def test_create_with_parameters(mock_get_token, mock_fake_lizzy,
     ])
 def test_delete(mock_get_token, mock_fake_lizzy,
                 stack_name, stack_version, region, dry_run):
+    mock_fake_lizzy.stacks = [Stack(stack_name, stack_version, 'CREATE_COMPLETE'),
+                              Stack(stack_name, stack_version + '0', 'CREATE_COMPLETE')]
     runner = CliRunner()
     dry_run_flag = ['--dry-run'] if dry_run else []
     result = runner.invoke(main,
@@ -329,6 +344,7 @@ def test_delete(mock_get_token, mock_fake_lizzy,
     assert "Requesting stack '{}-{}' deletion.. OK".format(stack_name, stack_version) in result.output
     stack_id = "{}-{}".format(stack_name, stack_version)
     mock_fake_lizzy._delete_mock.assert_called_once_with(stack_id, dry_run=dry_run, region=region)
+    mock_fake_lizzy._list_mock.assert_called_once_with([stack_name], region=region)
 
 
 @pytest.mark.parametrize(
@@ -341,6 +357,10 @@ def test_delete(mock_get_token, mock_fake_lizzy,
     ])
 def test_delete_multiple(mock_get_token, mock_fake_lizzy,
                          stack_refs, region, dry_run, expected_calls):
+    mock_fake_lizzy.stacks = [Stack('stack_id', '1', 'CREATE_COMPLETE'),
+                              Stack('stack_id', '2', 'CREATE_COMPLETE')]
+    mock_fake_lizzy.stacks += [Stack('foobar-stack', version, 'CREATE_COMPLETE')
+                               for version in ('v1', 'v2', 'v99', 'v100')]
     runner = CliRunner()
     dry_run_flag = ['--dry-run'] if dry_run else []
     runner.invoke(main,
@@ -350,16 +370,25 @@ def test_delete_multiple(mock_get_token, mock_fake_lizzy,
                   + stack_refs,
                   env=FAKE_ENV, catch_exceptions=False)
     assert mock_fake_lizzy._delete_mock.call_count == expected_calls
+    assert mock_fake_lizzy._list_mock.call_count == 1
 
 
 @pytest.mark.parametrize(
     "stack_refs, region, dry_run, expected_calls",
     [
-        (["stack_id"], 'eu-central-1', False, 1),
-        (['foobar-stack', '1', 'other-stack'], 'eu-central-1', False, 2),
+        (["stack_id"], 'eu-central-1', False, 2),
+        (['foobar-stack', '1', 'other-stack'], 'eu-central-1', False, 3),
+        (['stack_.*'], 'eu-central-1', False, 3),
     ])
 def test_delete_multiple_force(mock_get_token, mock_fake_lizzy,
                                stack_refs, region, dry_run, expected_calls):
+    mock_fake_lizzy.stacks = [Stack('stack_id', '1', 'CREATE_COMPLETE'),
+                              Stack('stack_id', '2', 'CREATE_COMPLETE'),
+                              Stack('stack_other', '1', 'CREATE_COMPLETE'),
+                              Stack('foobar-stack', '1', 'CREATE_COMPLETE'),
+                              Stack('foobar-stack', '2', 'CREATE_COMPLETE'),
+                              Stack('other-stack', '1', 'CREATE_COMPLETE'),
+                              Stack('other-stack', '2', 'CREATE_COMPLETE')]
     runner = CliRunner()
     dry_run_flag = ['--dry-run'] if dry_run else []
     result = runner.invoke(main,
@@ -397,7 +426,7 @@ def test_traffic(mock_get_token, mock_fake_lizzy):
 
     # Use traffic command to print the traffic of instances
     with patch.object(mock_fake_lizzy, 'get_stacks', return_value=[
-            {'stack_name': 'lizzy-test', 'version': 'v1', 'status': 'UPDATE_COMPLETE'}]), patch.object(
+            Stack('lizzy-test', 'v1', 'UPDATE_COMPLETE')]), patch.object(
                 mock_fake_lizzy, 'get_traffic', return_value={'weight': 100}):
         runner = CliRunner()
         result = runner.invoke(main, ['traffic', 'lizzy-test'], env=FAKE_ENV,
@@ -411,7 +440,7 @@ def test_traffic(mock_get_token, mock_fake_lizzy):
 
     # Use traffic command to print the traffic of instances in a different region
     with patch.object(mock_fake_lizzy, 'get_stacks', return_value=[
-            {'stack_name': 'lizzy-test', 'version': 'v1', 'status': 'UPDATE_COMPLETE'}]), patch.object(
+            Stack('lizzy-test', 'v1', 'UPDATE_COMPLETE')]), patch.object(
                 mock_fake_lizzy, 'get_traffic', return_value={'weight': 100}):
         runner = CliRunner()
         result = runner.invoke(main, ['traffic', 'lizzy-test', '--region', 'ab-bar-7'],
@@ -427,7 +456,7 @@ def test_traffic(mock_get_token, mock_fake_lizzy):
     # as a stack filter (on the Senza cli side in the agent) and
     # not as traffic change percentage.
     with patch.object(mock_fake_lizzy, 'get_stacks', return_value=[
-            {'stack_name': 'lizzy-test', 'version': 'v1', 'status': 'UPDATE_COMPLETE'}]), patch.object(
+            Stack('lizzy-test', 'v1', 'UPDATE_COMPLETE')]), patch.object(
                 mock_fake_lizzy, 'get_traffic', return_value={'weight': 100}):
         runner = CliRunner()
         result = runner.invoke(main, ['traffic', 'lizzy-test', '90'], env=FAKE_ENV,
@@ -446,6 +475,30 @@ def test_scale(mock_get_token, mock_fake_lizzy):
     mock_fake_lizzy.scale.assert_called_once_with('lizzy-test-v10', 2,
                                                     region=None)
 
+
+def test_scale_many(mock_get_token, mock_fake_lizzy):
+    mock_fake_lizzy.scale.reset_mock()
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('scale.txt', 'w') as fd:
+            fd.write('lizzy-other v1 0\n')
+        result = runner.invoke(main, ['scale', 'lizzy-test', 'v10', '2', 'lizzy-test', 'v11', '3',
+                                      '--from-file', 'scale.txt', '-j', '2'],
+                               env=FAKE_ENV, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'Rescaled 3 of 3 stacks' in result.output
+    assert mock_fake_lizzy.scale.call_count == 3
+    mock_fake_lizzy.scale.assert_any_call('lizzy-other-v1', 0, region=None)
+
+    mock_fake_lizzy.scale.side_effect = [None, requests.HTTPError('Not found')]
+    result = runner.invoke(main, ['scale', 'lizzy-test', 'v10', '2', 'lizzy-test', 'v11', '3',
+                                  '-j', '1'],
+                           env=FAKE_ENV, catch_exceptions=False)
+    mock_fake_lizzy.scale.side_effect = None
+    assert result.exit_code == 1
+    assert 'FAILED' in result.output
+    assert 'Rescaled 1 of 2 stacks' in result.output
+
 def test_version():
     runner = CliRunner()
     result = runner.invoke(main, ['version'], env=FAKE_ENV, catch_exceptions=False)
@@ -583,3 +636,20 @@ def test_config_missing_lizzy_url(mock_get_token):
 
     assert 'LIZZY_URL is not set' in result.output
     assert result.exit_code == 1
+
+
+def test_create_plan(monkeypatch):
+    with FakeAgent() as agent:
+        agent.add_stack('stack1', '41')
+        agent.set_traffic('stack1-41', 100)
+        monkeypatch.setattr('lizzy_client.cli.get_token', MagicMock(return_value=agent.access_token))
+        env = {'OAUTH2_ACCESS_TOKEN_URL': agent.token_url, 'LIZZY_URL': agent.url}
+        runner = CliRunner()
+        result = runner.invoke(main, ['create', config_path, '42', '1.0', '--plan', '--keep-stacks', '0',
+                                      '--traffic', '10', '-o', 'json'],
+                               env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        rows = json.loads(result.output[result.output.index('['):])
+        assert [(row['action'], row['stack_id'], row['weight_after']) for row in rows] == \
+            [('create', 'stack1-42', 10), ('delete', 'stack1-41', 90.0)]
+        assert sorted(agent.stacks) == ['stack1-41']
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import completion
+from lizzy_client.cli import main
+from lizzy_client.fake_agent import FakeAgent
+
+VALUE_OPTIONS = {None: {'--profile'}, 'traffic': {'--region', '-r', '--remote'}}
+COMMANDS = ['create', 'delete', 'list', 'scale', 'traffic']
+STACKS = {'lizzy-test': ['v1', 'v2'], 'lizzy-other': ['v7'], 'app': ['1']}
+
+
+@pytest.mark.parametrize(
+    "words, candidates",
+    [
+        ([''], COMMANDS),
+        (['--profile', 'out', 'tr'], ['traffic']),
+        (['traffic', 'lizzy-'], ['lizzy-other', 'lizzy-test']),
+        (['traffic', '--region', 'eu-central-1', 'lizzy-test', ''], ['v1', 'v2']),
+        (['traffic', '--region', ''], []),
+        (['traffic', 'lizzy-test', 'v1', ''], []),
+        (['traffic', '--'], []),
+        (['delete', 'lizzy-test', 'v1', 'v'], ['v1', 'v2']),
+        (['list', 'app', ''], ['app', 'lizzy-other', 'lizzy-test']),
+        (['create', ''], []),
+    ])
+def test_complete(words, candidates):
+    assert completion.complete(words, COMMANDS, VALUE_OPTIONS, STACKS) == candidates
+
+
+def test_cache(tmpdir):
+    path = str(tmpdir.join('completion', 'cache.json'))
+    assert completion.read_cache(path) is None
+    assert completion.is_stale(None)
+
+    completion.write_cache(path, STACKS)
+    cache = completion.read_cache(path)
+    assert cache['stacks'] == STACKS
+    assert not completion.is_stale(cache)
+    assert completion.is_stale(cache, ttl=-1)
+
+
+def test_single_refresh(tmpdir, monkeypatch):
+    popen = MagicMock()
+    monkeypatch.setattr('subprocess.Popen', popen)
+    path = str(tmpdir.join('cache.json'))
+
+    completion.spawn_refresh(path, 'https://lizzy.example', 'eu-west-1')
+    completion.spawn_refresh(path, 'https://lizzy.example', 'eu-west-1')
+    assert popen.call_count == 1
+    assert popen.call_args[0][0][-6:] == ['completion', 'refresh',
+                                          '--remote', 'https://lizzy.example',
+                                          '--region', 'eu-west-1']
+
+    completion.release_refresh(path)
+    completion.spawn_refresh(path, None, None)
+    assert popen.call_count == 2
+
+
+def test_candidates_from_agent(tmpdir, monkeypatch):
+    monkeypatch.setenv('LIZZY_HOME', str(tmpdir))
+    monkeypatch.delenv('AWS_DEFAULT_REGION', raising=False)
+    popen = MagicMock()
+    monkeypatch.setattr('subprocess.Popen', popen)
+    runner = CliRunner()
+
+    with FakeAgent() as agent:
+        agent.add_stack('lizzy-test', 'v1')
+        agent.add_stack('lizzy-test', 'v2')
+        monkeypatch.setenv('LIZZY_URL', agent.url)
+        monkeypatch.setenv('OAUTH2_ACCESS_TOKEN_URL', agent.token_url)
+        monkeypatch.setattr('lizzy_client.cli.get_token', MagicMock(return_value=agent.access_token))
+
+        # nothing cached yet, a refresh is started in the background
+        result = runner.invoke(main, ['completion', 'candidates', '--', 'scale', ''])
+        assert result.output == ''
+        assert popen.call_count == 1
+
+        result = runner.invoke(main, ['completion', 'refresh'], catch_exceptions=False)
+        assert result.exit_code == 0
+        requests_before = agent.request_count
+
+        start = time.perf_counter()
+        result = runner.invoke(main, ['completion', 'candidates', '--', 'scale', 'lizzy-test', ''])
+        assert time.perf_counter() - start < 0.5
+        assert result.output == 'v1\nv2\n'
+        assert agent.request_count == requests_before
+        assert popen.call_count == 1
+        assert not os.path.exists(completion.cache_path(agent.url, None) + '.lock')
+
+
+def test_candidates_without_cli(tmpdir):
+    env = dict(os.environ, LIZZY_HOME=str(tmpdir), LIZZY_URL='https://lizzy.example')
+    runner = CliRunner()
+    runner.invoke(main, ['completion', 'script', 'bash'], env=env, catch_exceptions=False)
+    assert os.path.exists(str(tmpdir.join('completion', 'options.json')))
+
+    code = ('import sys; from lizzy_client import completion; '
+            'print(completion.candidates(["--profile", "out", "tra"]), "lizzy_client.cli" in sys.modules)')
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+    assert output == "['traffic'] False\n"
+
+
+def test_cli_imports_completion_lazily():
+    code = ('import sys, lizzy_client.cli; '
+            'print(sorted(name for name in ("bench", "completion", "fake_agent") '
+            'if "lizzy_client." + name in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    assert output == '[]\n'
@@ -0,0 +1,89 @@
+import io
+import os
+import threading
+import time
+
+import click
+import pytest
+from lizzy_client import daemon
+from lizzy_client.cli import main, main_with_metrics
+from lizzy_client.version import VERSION
+
+
+def serve(command: click.BaseCommand, path: str) -> threading.Thread:
+    thread = threading.Thread(target=daemon.serve, args=(command, path), daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    return thread
+
+
+@pytest.fixture
+def daemon_socket(tmpdir):
+    path = str(tmpdir.join('daemon.sock'))
+    thread = serve(main, path)
+    yield path
+    daemon.stop(path)
+    thread.join(5)
+
+
+def test_forward(daemon_socket, capsys):
+    assert daemon.forward(['version'], daemon_socket) == 0
+    assert capsys.readouterr().out == 'Lizzy Client {}\n'.format(VERSION)
+
+    assert daemon.forward(['traffic'], daemon_socket) != 0
+    output = capsys.readouterr()
+    assert output.out == ''
+    assert 'Missing argument' in output.err
+
+    assert daemon.status(daemon_socket)['commands_run'] == 2
+
+    # long running and daemon management commands run locally
+    assert daemon.forward(['list', '--watch', '5'], daemon_socket) is None
+    assert daemon.forward(['list', '--watch=5'], daemon_socket) is None
+    assert daemon.forward(['list', '-w5'], daemon_socket) is None
+    assert daemon.forward(['daemon', 'status'], daemon_socket) is None
+
+
+def test_forward_streams(tmpdir, monkeypatch, capsys):
+    @click.command()
+    def upper():
+        for line in click.get_text_stream('stdin'):
+            click.echo(line.upper(), nl=False)
+            click.echo('read {} characters'.format(len(line)), err=True)
+        raise SystemExit(3)
+
+    path = str(tmpdir.join('daemon.sock'))
+    thread = serve(upper, path)
+    monkeypatch.setattr('sys.stdin', io.TextIOWrapper(io.BytesIO(b'one\ntwo\n')))
+    try:
+        assert daemon.forward([], path) == 3
+    finally:
+        daemon.stop(path)
+        thread.join(5)
+    output = capsys.readouterr()
+    assert output.out == 'ONE\nTWO\n'
+    assert output.err == 'read 4 characters\nread 4 characters\n'
+
+
+def test_main_with_metrics_forwards(daemon_socket, monkeypatch, capsys):
+    monkeypatch.setenv('LIZZY_DAEMON_SOCKET', daemon_socket)
+    monkeypatch.setattr('sys.argv', ['lizzy', 'version'])
+    with pytest.raises(SystemExit) as exc_info:
+        main_with_metrics()
+    assert exc_info.value.code == 0
+    assert capsys.readouterr().out == 'Lizzy Client {}\n'.format(VERSION)
+    assert daemon.status(daemon_socket)['commands_run'] == 1
+
+
+def test_stop(daemon_socket):
+    assert daemon.stop(daemon_socket)
+    for _ in range(100):
+        if not os.path.exists(daemon_socket):
+            break
+        time.sleep(0.01)
+    assert daemon.status(daemon_socket) is None
+    assert daemon.forward(['version'], daemon_socket) is None
+    assert not daemon.stop(daemon_socket)
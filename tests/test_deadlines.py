@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+from lizzy_client import deadlines, workflows
+from lizzy_client.exceptions import DeadlineExceeded
+from lizzy_client.fake_agent import FakeAgent
+from lizzy_client.lizzy import Lizzy
+
+
+def test_nested_deadlines():
+    assert deadlines.remaining() is None
+    assert deadlines.bound(10) == 10
+    with deadlines.deadline(5):
+        assert 4 < deadlines.remaining() <= 5
+        with deadlines.deadline(60):
+            assert deadlines.remaining() <= 5  # the earlier deadline wins
+        with deadlines.deadline(1):
+            assert deadlines.bound_timeout((5, 60)) == pytest.approx((1, 1), abs=0.1)
+        assert 4 < deadlines.remaining() <= 5
+    assert deadlines.remaining() is None
+
+    with deadlines.deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            deadlines.check('Listing')
+        assert deadlines.bound(10) == 0
+        with pytest.raises(DeadlineExceeded):
+            deadlines.bound_timeout((5, 60), 'Listing')
+
+
+def test_deadlines_per_thread():
+    seen = {}
+
+    def run(name: str):
+        seen[name] = deadlines.remaining()
+
+    with deadlines.deadline(5):
+        thread = threading.Thread(target=run, args=('plain',))
+        thread.start()
+        thread.join()
+        thread = threading.Thread(target=deadlines.bind(run), args=('bound',))
+        thread.start()
+        thread.join()
+    assert seen['plain'] is None
+    assert 4 < seen['bound'] <= 5
+
+
+def test_request_timeout():
+    with FakeAgent(stacks=3, latency=1) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded), deadlines.deadline(0.2):
+            lizzy.get_stacks()
+        assert time.perf_counter() - start < 0.9
+
+
+def test_deploy_deadline():
+    with FakeAgent(create_polls=100) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            workflows.deploy(lizzy, {'SenzaInfo': {'StackName': 'app'}}, 'v1', deadline=0.3)
+        assert time.perf_counter() - start < 2
+        assert deadlines.remaining() is None
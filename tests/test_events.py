@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import events
+from lizzy_client.cli import main
+
+
+@pytest.fixture
+def agent_stacks():
+    return [('lizzy-test', 'v1', None), ('lizzy-test', 'v2', 100)]
+
+
+def parse_events(output: str) -> list:
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+
+def test_emit_without_stream(capsys):
+    events.emit('stack', stack_name='lizzy-test')
+    assert not events.is_streaming()
+    assert capsys.readouterr().out == ''
+
+
+def test_event_stream(capsys):
+    with events.EventStream('test'):
+        assert events.is_streaming()
+        print('Human readable')
+        events.emit('stack', stack_name='lizzy-test')
+    assert not events.is_streaming()
+
+    captured = capsys.readouterr()
+    assert captured.err == 'Human readable\n'
+    lines = [json.loads(line) for line in captured.out.splitlines()]
+    assert [line['event'] for line in lines] == ['start', 'stack', 'end']
+    assert lines[1]['stack_name'] == 'lizzy-test'
+    assert lines[2]['exit_code'] == 0
+
+
+def test_event_stream_exit_code(capsys):
+    with pytest.raises(SystemExit):
+        with events.EventStream('test'):
+            raise SystemExit(1)
+    end = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert end['event'] == 'end'
+    assert end['exit_code'] == 1
+
+
+def test_list(agent):
+    runner = CliRunner()
+    result = runner.invoke(main, ['list', '-o', 'ndjson'], catch_exceptions=False)
+    lines = parse_events(result.output)
+    assert lines[0] == dict(lines[0], event='start', command='list')
+    stacks = [line for line in lines if line['event'] == 'stack']
+    assert sorted(stack['version'] for stack in stacks) == ['v1', 'v2']
+    assert any(line['event'] == 'request' and line['status'] == 200 for line in lines)
+    assert lines[-1]['event'] == 'end'
+    assert lines[-1]['exit_code'] == 0
+
+
+def test_traffic(agent):
+    runner = CliRunner()
+    result = runner.invoke(main, ['traffic', '-o', 'ndjson', 'lizzy-test'],
+                           catch_exceptions=False)
+    weights = [line for line in parse_events(result.output) if line['event'] == 'traffic']
+    assert [(weight['identifier'], weight['weight%']) for weight in weights] == \
+        [('lizzy-test-v1', 0.0), ('lizzy-test-v2', 100.0)]
+
+    result = runner.invoke(main, ['traffic', '-o', 'ndjson', 'lizzy-test', 'v1', '50'],
+                           catch_exceptions=False)
+    changes = [line for line in parse_events(result.output) if line['event'] == 'traffic_changed']
+    assert changes == [dict(changes[0], stack_id='lizzy-test-v1', weight=50)]
+
+
+def test_create(agent, tmpdir):
+    definition = tmpdir.join('lizzy-test.yaml')
+    definition.write('SenzaInfo:\n  StackName: lizzy-test\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['create', '-o', 'ndjson', '--keep-stacks', '0',
+                                  '--traffic', '100', str(definition), 'v3'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    lines = parse_events(result.output)
+    names = [line['event'] for line in lines if line['event'] not in ('request', 'phase')]
+    assert names[0] == 'start'
+    assert names[-2:] == ['result', 'end']
+    for name in ('stack_requested', 'agent_output', 'state', 'deployed',
+                 'traffic_changed', 'stack_deleting', 'cleanup'):
+        assert name in names
+    cleanup = next(line for line in lines if line['event'] == 'cleanup')
+    assert cleanup['removed'] == ['lizzy-test-v1', 'lizzy-test-v2']
+
+
+def test_agent_error(agent):
+    runner = CliRunner()
+    result = runner.invoke(main, ['delete', '-o', 'ndjson', 'lizzy-test', 'v42'])
+    lines = parse_events(result.output)
+    assert lines[-2]['event'] == 'error'
+    assert lines[-1]['exit_code'] == 1
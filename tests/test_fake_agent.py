@@ -0,0 +1,170 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from click.testing import CliRunner
+from lizzy_client import fake_agent, workflows
+from lizzy_client.exceptions import StackRolledBack
+from lizzy_client.fake_agent import FakeAgent
+from lizzy_client.lizzy import Lizzy
+from lizzy_client.token import TokenProvider
+
+DEFINITION = {'SenzaInfo': {'StackName': 'app'}}
+
+
+def test_create_progress(no_sleep):
+    with FakeAgent(create_polls=2) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        stack, _ = workflows.request_stack(lizzy, DEFINITION, 'v1')
+        assert stack.status == 'CREATE_IN_PROGRESS'
+        states = list(lizzy.wait_for_deployment('app-v1'))
+        assert states == ['CREATE_IN_PROGRESS', 'CREATE_IN_PROGRESS', 'CREATE_COMPLETE']
+        assert lizzy.get_stack('app-v1').status == 'CREATE_COMPLETE'
+
+
+def test_create_rolled_back(no_sleep):
+    with FakeAgent(create_polls=1, final_status='ROLLBACK_COMPLETE') as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        with pytest.raises(StackRolledBack):
+            workflows.deploy(lizzy, DEFINITION, 'v1')
+
+
+def test_delete_progress():
+    with FakeAgent(delete_polls=2) as agent:
+        agent.add_stack('app', 'v1')
+        lizzy = Lizzy(agent.url, agent.access_token)
+        lizzy.delete('app-v1')
+        assert [stack.status for stack in lizzy.get_stacks(['app'])] == ['DELETE_IN_PROGRESS']
+        assert lizzy.get_stack('app-v1').status == 'DELETE_IN_PROGRESS'
+        assert lizzy.get_stacks(['app']) == []
+        with pytest.raises(requests.HTTPError):
+            lizzy.get_stack('app-v1')
+
+
+def test_cleanup_waits_for_stacks_in_progress(monkeypatch):
+    monkeypatch.setattr('lizzy_client.workflows.time.sleep', MagicMock())
+    with FakeAgent() as agent:
+        agent.add_stack('app', 'v1', statuses=['UPDATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS',
+                                               'UPDATE_COMPLETE'])
+        agent.add_stack('app', 'v2')
+        lizzy = Lizzy(agent.url, agent.access_token)
+        pending = []
+        result = workflows.remove_old_stacks(lizzy, 'app', 0, on_pending=pending.append)
+        assert [stack.stack_id for stack in pending] == ['app-v1', 'app-v1']
+        assert [stack.stack_id for stack in result.removed] == ['app-v1']
+        assert list(agent.stacks) == ['app-v2']
+
+
+def test_failures(no_sleep):
+    with FakeAgent() as agent:
+        agent.add_stack('app', 'v1')
+        lizzy = Lizzy(agent.url, agent.access_token)
+
+        agent.failures = 2
+        states = list(lizzy.wait_for_deployment('app-v1'))
+        assert len(states) == 3
+        assert states[0].startswith('Failed to get stack (2 retries left): HTTPError(')
+        assert states[-1] == 'CREATE_COMPLETE'
+
+        agent.failures = 1
+        with pytest.raises(requests.HTTPError) as exc_info:
+            lizzy.get_stacks()
+        assert exc_info.value.response.status_code == 503
+        assert agent.errors_served == 3
+
+
+def test_error_rate():
+    with FakeAgent(stacks=1, error_rate=0.5, seed=42) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        failed = 0
+        for _ in range(40):
+            try:
+                lizzy.get_stacks()
+            except requests.HTTPError:
+                failed += 1
+        assert 5 < failed < 35
+        assert failed == agent.errors_served
+
+        # the token endpoint never fails
+        agent.error_rate = 1
+        assert requests.post(agent.token_url).status_code == 200
+
+
+def test_latency():
+    with FakeAgent(stacks=1, latency=0.05) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        start = time.perf_counter()
+        lizzy.get_stacks()
+        assert time.perf_counter() - start >= 0.05
+
+
+def test_main(monkeypatch):
+    monkeypatch.setattr('lizzy_client.fake_agent.time.sleep', MagicMock(side_effect=KeyboardInterrupt))
+    runner = CliRunner()
+    result = runner.invoke(fake_agent.main, ['--port', '0', '--stacks', '3', '--create-polls', '2'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'Fake Lizzy agent listening on http://127.0.0.1:' in result.output
+
+
+def test_streamed_output():
+    with FakeAgent(stream_output=True) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        stack, output = workflows.request_stack(lizzy, DEFINITION, 'v1')
+        assert list(agent.outputs) == [0]
+        assert list(output) == ['[AGENT] Generating Cloud Formation template.. OK',
+                                '[AGENT] Creating Cloud Formation stack app.. OK']
+        assert agent.outputs == {}  # read from the output endpoint
+        assert list(output) == []  # and not kept
+
+        # falls back to the header when the output can't be streamed
+        output = lizzy.delete('app-v1')
+        agent.outputs.clear()
+        assert str(output) == '[AGENT] Deleting Cloud Formation stack app-v1.. OK'
+
+        stack, output = workflows.request_stack(lizzy, DEFINITION, 'v2')
+        output_id, = agent.outputs
+        agent.outputs[output_id].insert(1, None)
+        lines = list(output)
+        assert lines[0] == '[AGENT] Generating Cloud Formation template.. OK'
+        assert lines[1].startswith('Agent output cut off: ')
+        assert len(lines) == 2
+
+
+def test_pushed_states(no_sleep):
+    with FakeAgent(create_polls=3, events=True) as agent:
+        lizzy = Lizzy(agent.url, agent.access_token)
+        stack, _ = workflows.request_stack(lizzy, DEFINITION, 'v1')
+        assert lizzy.events_url is not None
+        states = list(lizzy.wait_for_deployment('app-v1'))
+        assert states == ['CREATE_IN_PROGRESS', 'CREATE_IN_PROGRESS', 'CREATE_COMPLETE']
+        assert agent.event_streams == 1
+        assert not time.sleep.called  # no polling
+
+        # polls when the stream isn't available
+        stack, _ = workflows.request_stack(lizzy, DEFINITION, 'v2')
+        agent.events = False
+        states = list(lizzy.wait_for_deployment('app-v2'))
+        assert states[-1] == 'CREATE_COMPLETE'
+        assert agent.event_streams == 1
+        assert time.sleep.called
+
+
+def test_expired_token():
+    with FakeAgent() as agent:
+        agent.add_stack('app', 'v1')
+        lizzy = Lizzy(agent.url, TokenProvider(lambda: agent.access_token))
+        assert lizzy.get_stack('app-v1').status == 'CREATE_COMPLETE'
+
+        old_token = lizzy.access_token
+        agent.rotate_token()
+        assert lizzy.get_stack('app-v1').status == 'CREATE_COMPLETE'  # sent again with a new token
+        assert lizzy.access_token == agent.access_token
+        assert agent.request_count == 3
+
+        # a fixed token can't be refreshed
+        lizzy = Lizzy(agent.url, old_token)
+        with pytest.raises(requests.HTTPError) as exc_info:
+            lizzy.get_stack('app-v1')
+        assert exc_info.value.response.status_code == 401
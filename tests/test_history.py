@@ -0,0 +1,101 @@
+import json
+import time
+
+from click.testing import CliRunner
+from lizzy_client import history
+from lizzy_client.cli import main
+
+
+def make_record(stack_name, result=history.SUCCESS, started=None, **phases):
+    return {'stack_name': stack_name, 'version': 'v1', 'region': None,
+            'started': started or time.time(), 'result': result, 'status': 'CREATE_COMPLETE',
+            'phases': phases, 'states': []}
+
+
+def test_append_and_read(tmpdir):
+    path = str(tmpdir.join('home', 'history.jsonl'))
+    assert list(history.read(path)) == []
+
+    history.append(make_record('app', total=10), path)
+    with open(path, 'a') as fd:
+        fd.write('{"not json\n')
+    history.append(make_record('other', total=20), path)
+
+    records = list(history.read(path))
+    assert [record['stack_name'] for record in records] == ['app', 'other']
+    with open(path) as fd:
+        assert ' ' not in fd.readline()  # compact
+
+
+def test_summarize():
+    records = [make_record('app', new_stack=1, wait_for_deployment=100, total=110),
+               make_record('app', new_stack=3, wait_for_deployment=300, total=330),
+               make_record('app', history.FAILED, new_stack=2, total=900),
+               make_record('old', started=1, total=10),
+               make_record('other', new_stack=1, total=5)]
+
+    rows = history.summarize(records, ['app', 'old'], since=time.time() - 3600)
+    assert [(row['stack_name'], row['phase']) for row in rows] == [
+        ('app', 'new_stack'), ('app', 'wait_for_deployment'), ('app', 'total')]
+    total = rows[-1]
+    assert (total['deployments'], total['failed'], total['samples']) == (3, 1, 2)
+    assert (total['p50_s'], total['p90_s'], total['max_s']) == (110, 330, 330)
+
+    rows = history.summarize(records, ['app'], include_failed=True)
+    assert rows[-1]['samples'] == 3
+    assert rows[-1]['max_s'] == 900
+
+
+def test_recorder_cancelled(tmpdir):
+    path = str(tmpdir.join('history.jsonl'))
+    deployment = history.DeploymentRecorder('app', 'v1')
+    deployment.start()
+    deployment.cancel()
+    deployment.finish(path)
+    assert list(history.read(path)) == []
+
+
+def test_create_records_history(agent, tmpdir):
+    definition = tmpdir.join('app.yaml')
+    definition.write('SenzaInfo:\n  StackName: app\n')
+    runner = CliRunner()
+
+    result = runner.invoke(main, ['create', '--dry-run', str(definition), 'v2'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert list(history.read()) == []
+
+    result = runner.invoke(main, ['create', '--traffic', '100', '--keep-stacks', '0',
+                                  '--max-concurrent', '2', str(definition), 'v2'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    record, = history.read()
+    assert record['stack_name'] == 'app'
+    assert record['version'] == 'v2'
+    assert record['result'] == history.SUCCESS
+    assert record['status'] == 'CREATE_COMPLETE'
+    assert [state for state, _ in record['states']] == ['CREATE_COMPLETE']
+    assert sorted(record['phases']) == ['cleanup', 'new_stack', 'queue', 'total', 'traffic',
+                                        'wait_for_deployment']
+
+    result = runner.invoke(main, ['stats', '-o', 'json', 'app'], catch_exceptions=False)
+    rows = json.loads(result.output)
+    assert [row['phase'] for row in rows] == history.STATS_PHASES
+    assert all(row['deployments'] == 1 for row in rows)
+
+
+def test_create_forced_without_senza_info(agent, tmpdir):
+    definition = tmpdir.join('app.yaml')
+    definition.write('SenzaInfo: []\n')
+    result = CliRunner().invoke(main, ['create', '--force', '--max-concurrent', '2',
+                                       str(definition), 'v2'])
+    assert 'SenzaInfo must be a mapping' in result.output
+    assert isinstance(result.exception, SystemExit)
+    assert result.exit_code == 1
+
+
+def test_stats_without_history():
+    runner = CliRunner()
+    result = runner.invoke(main, ['stats'], catch_exceptions=False)
+    assert 'No deployments recorded in' in result.output
+    assert result.exit_code == 0
@@ -2,8 +2,12 @@ import json
 from unittest.mock import MagicMock
 
 import pytest
-from lizzy_client.lizzy import Lizzy, make_header
+import requests
+from lizzy_client.lizzy import (CONNECT_TIMEOUT, EVENTS_READ_TIMEOUT, Lizzy,
+                                iter_server_sent_events, make_header)
+from lizzy_client.models import Stack
 from requests import Response
+from urlpath import URL
 
 
 STACK1 = """{"creation_time": 1460635167,
@@ -60,35 +64,76 @@ def test_delete(monkeypatch, stack_id, region, dry_run):
     mock_delete.assert_called_once_with(url,
                                         json=expected_data,
                                         headers=header,
-                                        verify=False)
+                                        verify=False, timeout=Lizzy.timeout)
 
 
 def test_get_stack(monkeypatch):
     mock_get = MagicMock()
-    mock_get.return_value = FakeResponse(200, '{"stack":"fake"}')
+    mock_get.return_value = FakeResponse(200, STACK1)
     monkeypatch.setattr('requests.get', mock_get)
 
     lizzy = Lizzy('https://lizzy.example', '7E5770K3N')
     stack = lizzy.get_stack('574CC')
 
     header = make_header('7E5770K3N')
-    mock_get.assert_called_once_with('https://lizzy.example/api/stacks/574CC', None, headers=header, verify=False)
+    mock_get.assert_called_once_with('https://lizzy.example/api/stacks/574CC', None, headers=header, verify=False,
+                                     timeout=Lizzy.timeout)
 
-    assert stack['stack'] == 'fake'
+    assert stack.stack_id == 'lizzy-bus-257'
+    assert stack.status == 'CREATE_COMPLETE'
+
+
+def test_session():
+    session = MagicMock()
+    session.request.return_value = FakeResponse(200, STACK1)
+
+    lizzy = Lizzy('https://lizzy.example', '7E5770K3N', session=session)
+    assert lizzy.get_stack('574CC').stack_id == 'lizzy-bus-257'
+
+    session.request.assert_called_once_with('get', 'https://lizzy.example/api/stacks/574CC',
+                                            headers=make_header('7E5770K3N'), verify=False,
+                                            timeout=Lizzy.timeout)
 
 
 def test_get_stacks(monkeypatch):
     mock_get = MagicMock()
-    mock_get.return_value = FakeResponse(200, '["stack1","stack2"]')
+    mock_get.return_value = FakeResponse(200, '[{}]'.format(STACK1))
     monkeypatch.setattr('requests.get', mock_get)
 
     lizzy = Lizzy('https://lizzy.example', '7E5770K3N')
     stacks = lizzy.get_stacks()
 
     header = make_header('7E5770K3N')
-    mock_get.assert_called_once_with('https://lizzy.example/api/stacks', None, headers=header, verify=False)
+    mock_get.assert_called_once_with('https://lizzy.example/api/stacks', None, headers=header, verify=False,
+                                     timeout=Lizzy.timeout)
+
+    assert stacks == [Stack('lizzy-bus', '257', 'CREATE_COMPLETE', 1460635167,
+                            'Lizzy Bus (ImageVersion: 257)')]
 
-    assert stacks == ["stack1", "stack2"]
+
+def test_get_stacks_paginated(monkeypatch):
+    def page(*versions):
+        return [{'stack_name': 'lizzy', 'version': version, 'status': 'CREATE_COMPLETE'}
+                for version in versions]
+
+    first_page = FakeResponse(200, json.dumps({'stacks': page('v1', 'v2'), 'next_cursor': 'c2'}))
+    second_page = FakeResponse(200, json.dumps({'stacks': page('v3')}))
+    third_page = FakeResponse(200, json.dumps(page('v4')))
+    second_page.headers['link'] = '</api/stacks?cursor=c3&page_size=2>; rel="next"'
+    mock_get = MagicMock(side_effect=[first_page, second_page, third_page])
+    monkeypatch.setattr('requests.get', mock_get)
+
+    lizzy = Lizzy('https://lizzy.example', '7E5770K3N')
+    stacks = lizzy.iter_stacks(['lizzy'], page_size=2)
+    assert next(stacks).stack_id == 'lizzy-v1'
+    assert [stack.stack_id for stack in stacks] == ['lizzy-v2', 'lizzy-v3', 'lizzy-v4']
+
+    header = make_header('7E5770K3N')
+    urls = [call[0][0] for call in mock_get.call_args_list]
+    assert urls == ['https://lizzy.example/api/stacks?page_size=2&references=lizzy',
+                    'https://lizzy.example/api/stacks?cursor=c2&page_size=2&references=lizzy',
+                    'https://lizzy.example/api/stacks?cursor=c3&page_size=2']
+    mock_get.assert_called_with(urls[-1], None, headers=header, verify=False, timeout=Lizzy.timeout)
 
 
 def test_traffic(monkeypatch):
@@ -104,7 +149,7 @@ def test_traffic(monkeypatch):
                                        headers=header,
                                        data=None,
                                        json={"new_traffic": 42},
-                                       verify=False)
+                                       verify=False, timeout=Lizzy.timeout)
 
     # call with region payload
     mock_patch.reset_mock()
@@ -117,7 +162,7 @@ def test_traffic(monkeypatch):
                                        data=None,
                                        json={'new_traffic': 42,
                                              'region': 'ab-foo-7'},
-                                       verify=False)
+                                       verify=False, timeout=Lizzy.timeout)
 
 
 def test_get_traffic(monkeypatch):
@@ -131,7 +176,7 @@ def test_get_traffic(monkeypatch):
     header = make_header('7E5770K3N')
     mock_request.assert_called_once_with(
         'https://lizzy.example/api/stacks/lizzy-test/traffic', None,
-        headers=header, verify=False)
+        headers=header, verify=False, timeout=Lizzy.timeout)
 
     mock_request.reset_mock()
     mock_request.return_value = FakeResponse(200, '["stack1","stack2"]')
@@ -142,7 +187,7 @@ def test_get_traffic(monkeypatch):
     header = make_header('7E5770K3N')
     url = 'https://lizzy.example/api/stacks/574CC/traffic?region=ab-foo-7'
     mock_request.assert_called_once_with(url, None, headers=header,
-                                         verify=False)
+                                         verify=False, timeout=Lizzy.timeout)
 
 
 def test_scale(monkeypatch):
@@ -157,7 +202,7 @@ def test_scale(monkeypatch):
                                        headers=header,
                                        data=None,
                                        json={"new_scale": 3},
-                                       verify=False)
+                                       verify=False, timeout=Lizzy.timeout)
 
     # call with region payload
     mock_patch.reset_mock()
@@ -170,7 +215,7 @@ def test_scale(monkeypatch):
                                        data=None,
                                        json={'new_scale': 3,
                                              'region': 'ab-foo-7'},
-                                       verify=False)
+                                       verify=False, timeout=Lizzy.timeout)
 
 
 @pytest.mark.parametrize(
@@ -199,8 +244,8 @@ def test_new_stack(monkeypatch,
                                     dry_run=dry_run,
                                     region=region,
                                     tags=tags)
-    stack_name = stack['stack_name']
-    assert stack_name == 'lizzy-bus'
+    assert stack.stack_name == 'lizzy-bus'
+    assert stack.stack_id == 'lizzy-bus-257'
 
     header = make_header('7E5770K3N')
     data = {'keep_stacks': keep_stacks,
@@ -220,14 +265,14 @@ def test_new_stack(monkeypatch,
                                       headers=header,
                                       json=data,
                                       data=None,
-                                      verify=False)
+                                      verify=False, timeout=Lizzy.timeout)
 
 
 def test_wait_for_deployment(monkeypatch):
     monkeypatch.setattr('time.sleep', MagicMock())
     mock_get_stack = MagicMock()
-    mock_get_stack.side_effect = [{'status': 'CF:SOME_STATE'}, {'status': 'CF:SOME_STATE'},
-                                  {'status': 'CF:SOME_OTHER_STATE'}, {'status': 'CREATE_COMPLETE'}]
+    mock_get_stack.side_effect = [Stack('lizzy', 'v1', status) for status in
+                                  ['CF:SOME_STATE', 'CF:SOME_STATE', 'CF:SOME_OTHER_STATE', 'CREATE_COMPLETE']]
     monkeypatch.setattr('lizzy_client.lizzy.Lizzy.get_stack', mock_get_stack)
 
     lizzy = Lizzy('https://lizzy.example', '7E5770K3N')
@@ -236,9 +281,25 @@ def test_wait_for_deployment(monkeypatch):
     assert states == ['CF:SOME_STATE', 'CF:SOME_STATE', 'CF:SOME_OTHER_STATE', 'CREATE_COMPLETE']
 
     mock_get_stack.reset_mock()
-    mock_get_stack.side_effect = [{'wrong_key': 'CF:SOME_STATE'}, {'wrong_key': 'CF:SOME_STATE'},
-                                  {'wrong_key': 'CF:SOME_STATE'}]
+    mock_get_stack.side_effect = [KeyError('status'), KeyError('status'), KeyError('status')]
     states = list(lizzy.wait_for_deployment('574CC1D'))
     assert states == ["Failed to get stack (2 retries left): KeyError('status',).",
                       "Failed to get stack (1 retries left): KeyError('status',).",
                       "Failed to get stack (0 retries left): KeyError('status',).", ]
+
+
+def test_iter_server_sent_events():
+    lines = [': keep-alive', '', 'event: stack', 'data: {"status":', 'data:  "A"}', '', 'id: 1',
+             'data: plain', '', 'event: unfinished']
+    assert list(iter_server_sent_events(lines)) == [('stack', '{"status":\n "A"}'),
+                                                    ('message', 'plain')]
+
+
+def test_follow_stack_events_timeout():
+    lizzy = Lizzy('https://lizzy.example', '7E5770K3N')
+    lizzy.events_url = URL('https://lizzy.example/api/events')
+    lizzy._request = MagicMock(side_effect=requests.ConnectionError('refused'))
+    with pytest.raises(requests.ConnectionError):
+        list(lizzy.follow_stack_events('lizzy-test-v1'))
+    # a dead agent fails quickly, an idle stream only after the keep-alive comments stop
+    assert lizzy._request.call_args[1]['timeout'] == (CONNECT_TIMEOUT, EVENTS_READ_TIMEOUT)
@@ -0,0 +1,80 @@
+import datetime
+
+import pytest
+from lizzy_client.models import AgentOutput, Stack, TrafficWeight
+
+
+def test_stack_from_dict():
+    stack = Stack.from_dict({'stack_name': 'lizzy-bus',
+                             'version': '257',
+                             'status': 'CREATE_COMPLETE',
+                             'creation_time': '2016-01-01T12:00:00Z',
+                             'description': 'Lizzy Bus (ImageVersion: 257)'})
+    assert stack.stack_id == 'lizzy-bus-257'
+    assert stack.creation_time == datetime.datetime(2016, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    assert stack.as_row() == {'stack_name': 'lizzy-bus',
+                              'version': '257',
+                              'status': 'CREATE_COMPLETE',
+                              'creation_time': 1451649600.0,
+                              'description': 'Lizzy Bus (ImageVersion: 257)'}
+
+    with pytest.raises(KeyError):
+        Stack.from_dict({'stack_name': 'lizzy-bus', 'version': '257'})
+
+
+def test_stack_creation_time():
+    assert Stack('lizzy', 'v1', creation_time=1451649600).creation_time.year == 2016
+    assert Stack('lizzy', 'v1').creation_time is None
+    assert Stack('lizzy', 'v1').as_row()['creation_time'] is None
+
+
+def test_records_are_hashable():
+    assert len({Stack('lizzy', 'v1', 'CREATE_COMPLETE'), Stack('lizzy', 'v1', 'CREATE_COMPLETE'),
+                Stack('lizzy', 'v2', 'CREATE_COMPLETE')}) == 2
+    assert len({TrafficWeight('lizzy', 'v1', 50), TrafficWeight('lizzy', 'v1', 50.0)}) == 1
+
+
+def test_stack_creation_order():
+    stacks = [Stack('lizzy', 'v3'),
+              Stack('lizzy', 'v2', creation_time='2016-01-01T13:00:00+02:00'),
+              Stack('lizzy', 'v1', creation_time='2016-01-01T10:30:00')]
+    assert [stack.version for stack in sorted(stacks, key=Stack.creation_order)] == ['v1', 'v2', 'v3']
+
+
+def test_stack_slots():
+    stack = Stack('lizzy', 'v1', 'CREATE_COMPLETE')
+    with pytest.raises(AttributeError):
+        stack.unknown_field = 42
+
+
+def test_traffic_weight():
+    weight = TrafficWeight('lizzy', 'v1', 42.0)
+    assert weight.stack_id == 'lizzy-v1'
+    assert weight.as_row() == {'stack_name': 'lizzy',
+                               'version': 'v1',
+                               'identifier': 'lizzy-v1',
+                               'weight%': 42.0}
+
+
+def test_agent_output_is_read_lazily():
+    read = []
+
+    def lines():
+        for line in ['[AGENT] one', '[AGENT] two']:
+            read.append(line)
+            yield line
+
+    output = AgentOutput(lines())
+    assert read == []
+    iterator = iter(output)
+    assert next(iterator) == '[AGENT] one'
+    assert read == ['[AGENT] one']
+    assert list(output) == ['[AGENT] two']  # the lines aren't kept
+    assert list(output) == []
+    assert str(AgentOutput()) == ''
+
+    output = AgentOutput(lines())
+    assert str(output) == '[AGENT] one\n[AGENT] two'
+    assert '[AGENT] two' in output
+    assert AgentOutput.from_text('one\ntwo') == output
+    assert list(output) == ['[AGENT] one', '[AGENT] two']
@@ -0,0 +1,53 @@
+import os
+import time
+from unittest.mock import MagicMock
+
+import click
+from click.testing import CliRunner
+from clickclick import print_table
+from lizzy_client.output import print_rows, render_table
+
+STYLES = {'CREATE_COMPLETE': {'fg': 'green'}}
+COLS = ['stack_name', 'status', 'creation_time', 'weight%', 'healthy']
+
+
+def make_rows(count: int) -> list:
+    now = time.time()
+    return [{'stack_name': 'app-{}'.format(index),
+             'status': 'CREATE_COMPLETE' if index % 2 else None,
+             'creation_time': now - index * 3000,
+             'weight%': index * 2.5,
+             'healthy': index % 3 == 0} for index in range(count)]
+
+
+def test_same_as_clickclick():
+    rows = make_rows(12)
+    runner = CliRunner()
+    expected = runner.invoke(click.command()(lambda: print_table(COLS, rows, styles=STYLES,
+                                                                 titles={'weight%': 'Weight'})),
+                             color=True).output
+    rendered = render_table(COLS, rows, styles=STYLES, titles={'weight%': 'Weight'})
+    # clickclick resets the style of every cell, even unstyled ones
+    assert rendered.replace('\x1b[0m', '') == expected.replace('\x1b[0m', '')
+    assert click.unstyle(rendered).splitlines()[0] == 'Stack Name│Status         │Creation Time│Weight│Healthy'
+
+
+def test_pager(monkeypatch):
+    monkeypatch.setattr('lizzy_client.output.sys.stdout', MagicMock(isatty=MagicMock(return_value=True)))
+    monkeypatch.setattr('lizzy_client.output.shutil.get_terminal_size',
+                        MagicMock(return_value=os.terminal_size((80, 10))))
+    pager = MagicMock()
+    echo = MagicMock()
+    monkeypatch.setattr('lizzy_client.output.click.echo_via_pager', pager)
+    monkeypatch.setattr('lizzy_client.output.click.echo', echo)
+
+    print_rows(COLS, make_rows(5), 'text')
+    assert not pager.called
+    assert echo.call_count == 1  # a single write
+
+    print_rows(COLS, make_rows(50), 'text')
+    assert pager.call_count == 1
+
+    print_rows(COLS, make_rows(50), 'text', pager=False)
+    assert pager.call_count == 1
+    assert echo.call_count == 2
@@ -0,0 +1,139 @@
+import io
+
+import click
+import pytest
+from click.testing import CliRunner
+from lizzy_client import workflows
+from lizzy_client.cli import main
+from lizzy_client.lizzy import Lizzy
+from lizzy_client.progress import (LineProgressView, ProgressView,
+                                   TableProgressView, format_duration,
+                                   make_view)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTY(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def agent_stacks():
+    return []
+
+
+def test_format_duration():
+    assert format_duration(5.9) == '5s'
+    assert format_duration(65) == '1m05s'
+    assert format_duration(3720) == '1h02m'
+
+
+def test_line_view_prints_changes_only():
+    clock = FakeClock()
+    stream = io.StringIO()
+    view = LineProgressView(stream, clock=clock)
+    view.update({'app-v1': 'CREATE_IN_PROGRESS', 'app-v2': None})
+    clock.now += 30
+    view.update({'app-v1': 'CREATE_IN_PROGRESS', 'app-v2': 'CREATE_IN_PROGRESS'})
+    clock.now += 45
+    view.update({'app-v1': 'CREATE_COMPLETE', 'app-v2': 'CREATE_IN_PROGRESS'})
+    assert stream.getvalue().splitlines() == ['[    0s] app-v1 CREATE_IN_PROGRESS',
+                                              '[    0s] app-v2 WAITING',
+                                              '[   30s] app-v2 CREATE_IN_PROGRESS',
+                                              '[ 1m15s] app-v1 CREATE_COMPLETE']
+
+
+def test_table_view_redraws_in_place():
+    clock = FakeClock()
+    stream = TTY()
+    view = TableProgressView(stream, clock=clock)
+    view.update({'app-v1': 'CREATE_IN_PROGRESS', 'app-v2': 'CREATE_IN_PROGRESS'})
+    first = stream.getvalue()
+    assert not first.startswith('\x1b[3A')
+    assert first.count('\n') == 3
+
+    clock.now += 20
+    view.update({'app-v1': 'CREATE_COMPLETE', 'app-v2': 'CREATE_IN_PROGRESS'})
+    redraw = stream.getvalue()[len(first):]
+    assert redraw.startswith('\x1b[3A')
+    assert 'from CREATE_IN_PROGRESS 0s ago' in redraw
+    assert '20s ago' in redraw
+    assert table_rows(redraw) == [['app-v1', 'CREATE_COMPLETE', '20s'],
+                                  ['app-v2', 'CREATE_IN_PROGRESS', '20s']]
+
+
+def table_rows(output):
+    lines = click.unstyle(output).splitlines()[1:]
+    return [line.split()[:3] for line in lines]
+
+
+def test_make_view():
+    assert isinstance(make_view(TTY()), TableProgressView)
+    assert isinstance(make_view(io.StringIO()), LineProgressView)
+    with pytest.raises(TypeError):
+        ProgressView(io.StringIO())  # only the subclasses show the changes
+
+
+def test_wait_for_stacks(agent, no_sleep):
+    agent.add_stack('app', 'v1', statuses=['CREATE_IN_PROGRESS', 'CREATE_COMPLETE'])
+    agent.add_stack('app', 'v2', statuses=['CREATE_IN_PROGRESS'] * 3 + ['ROLLBACK_COMPLETE'])
+    agent.add_stack('db', 'v1', statuses=['UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE'])
+    lizzy = Lizzy(agent.url, agent.access_token)
+
+    updates = []
+    requests_before = agent.request_count
+    states = workflows.wait_for_stacks(lizzy, ['app-v1', 'app-v2', 'db-v1', 'db-v9'],
+                                       on_update=updates.append)
+    assert states == {'app-v1': 'CREATE_COMPLETE',
+                      'app-v2': 'ROLLBACK_COMPLETE',
+                      'db-v1': 'UPDATE_COMPLETE',
+                      'db-v9': 'NOT_FOUND'}
+    # a single listing per round for all the stacks
+    assert agent.request_count - requests_before == len(updates) == 4
+    assert updates[0]['app-v1'] == 'CREATE_IN_PROGRESS'
+    assert no_sleep.call_count == 3
+
+
+def test_wait_for_stacks_deleted_and_timeout(agent, no_sleep, monkeypatch):
+    agent.add_stack('app', 'v1', statuses=['DELETE_IN_PROGRESS', None])
+    agent.add_stack('app', 'v2', statuses=['CREATE_IN_PROGRESS'])
+    lizzy = Lizzy(agent.url, agent.access_token)
+    clock = iter(range(0, 1000, 10))
+    monkeypatch.setattr('lizzy_client.workflows.time.monotonic', lambda: next(clock))
+    states = workflows.wait_for_stacks(lizzy, ['app-v1', 'app-v2'], interval=10, timeout=35)
+    assert states == {'app-v1': 'DELETE_COMPLETE', 'app-v2': 'CREATE_IN_PROGRESS'}
+
+
+def test_wait_command(agent, no_sleep):
+    agent.add_stack('app', 'v1')
+    agent.add_stack('app', 'v2', statuses=['CREATE_IN_PROGRESS', 'CREATE_IN_PROGRESS',
+                                           'CREATE_COMPLETE'])
+    agent.add_stack('db', 'v1', statuses=['CREATE_IN_PROGRESS', 'CREATE_COMPLETE'])
+    runner = CliRunner()
+    result = runner.invoke(main, ['wait', 'db', 'v1', 'app'], catch_exceptions=False)
+    assert result.exit_code == 0
+    # only the stack of app in progress is waited for
+    assert 'app-v1' not in result.output
+    assert 'app-v2 CREATE_COMPLETE' in result.output
+    assert 'db-v1 CREATE_COMPLETE' in result.output
+    assert '2 of 2 stacks succeeded' in result.output
+
+
+def test_wait_command_failed(agent, no_sleep):
+    agent.add_stack('app', 'v1', statuses=['CREATE_IN_PROGRESS', 'ROLLBACK_COMPLETE'])
+    runner = CliRunner()
+    result = runner.invoke(main, ['wait', 'app', 'v1', '-o', 'json'], catch_exceptions=False)
+    assert result.exit_code == 1
+    assert '"status": "ROLLBACK_COMPLETE"' in result.output
+    assert '0 of 1 stacks succeeded' in result.output
+
+    result = runner.invoke(main, ['wait', 'unknown'], catch_exceptions=False)
+    assert result.exit_code == 1
+    assert 'No matching stacks found' in result.output
@@ -0,0 +1,134 @@
+import random
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import workflows
+from lizzy_client.cli import main
+from lizzy_client.exceptions import InvalidTrafficWeights
+from lizzy_client.fake_agent import FakeAgent
+from lizzy_client.lizzy import Lizzy
+from lizzy_client.rebalance import PLAN_TOLERANCE, apply_change, apportion, matches, plan_changes, simulate
+
+
+def test_apply_change():
+    assert apply_change({'v1': 50, 'v2': 30, 'v3': 20}, 'v3', 60) == {'v1': 25, 'v2': 15, 'v3': 60}
+    assert apply_change({'v1': 100, 'v2': 0, 'v3': 0}, 'v1', 0) == {'v1': 0, 'v2': 50, 'v3': 50}
+
+
+@pytest.mark.parametrize(
+    "current, targets, expected_plan",
+    [
+        ({'v1': 20, 'v2': 80}, {'v1': 20, 'v2': 80}, []),
+        ({'v1': 100, 'v2': 0}, {'v1': 20, 'v2': 80}, [('v1', 20)]),
+        ({'v1': 50, 'v2': 50, 'v3': 0}, {'v1': 0, 'v2': 0, 'v3': 100}, [('v3', 100)]),
+        ({'v1': 100, 'v2': 0, 'v3': 0}, {'v1': 50, 'v2': 20, 'v3': 30}, [('v2', 29), ('v3', 30)]),
+        ({'v1': 50, 'v2': 50, 'v3': 0}, {'v1': 20, 'v2': 30, 'v3': 50},
+         [('v3', 100), ('v1', 29), ('v2', 30)]),
+    ])
+def test_plan_changes(current, targets, expected_plan):
+    plan = plan_changes(current, targets)
+    assert plan == expected_plan
+    assert matches(simulate(current, plan), targets, PLAN_TOLERANCE)
+
+
+def test_apportion():
+    assert apportion({'v1': 33.4, 'v2': 33.3, 'v3': 33.3}) == {'v1': 34, 'v2': 33, 'v3': 33}
+    assert apportion({'v1': 100 / 3, 'v2': 100 / 3, 'v3': 100 / 3}) == {'v1': 34, 'v2': 33, 'v3': 33}
+    assert apportion({'v1': 12.5, 'v2': 87.5}) == {'v1': 13, 'v2': 87}
+    assert apportion({'v1': 20, 'v2': 80}) == {'v1': 20, 'v2': 80}
+
+
+def test_plan_changes_random():
+    generator = random.Random(42)
+    for _ in range(500):
+        stack_ids = ['v{}'.format(index) for index in range(generator.randint(1, 6))]
+        current = apply_change({stack_id: 0 for stack_id in stack_ids},
+                               generator.choice(stack_ids), 100)
+        for stack_id in stack_ids:
+            current = apply_change(current, stack_id, generator.choice([0, 10, 35, 50]))
+        targets = {stack_id: generator.choice([0, 0, 7, 10, 20, 25]) for stack_id in stack_ids}
+        targets[stack_ids[-1]] += 100 - sum(targets.values())
+        if targets[stack_ids[-1]] < 0:
+            continue
+        plan = plan_changes(current, targets)
+        assert all(isinstance(percentage, int) and 0 <= percentage <= 100 for _, percentage in plan)
+        assert matches(simulate(current, plan), targets, PLAN_TOLERANCE)
+        assert len(plan) <= len([target for target in targets.values() if target]) + 1
+
+
+@pytest.fixture
+def agent_stacks():
+    return [('app', 'v1', 100), ('app', 'v2', None), ('app', 'v3', None)]
+
+
+@pytest.fixture(params=[False, True], ids=['single-changes', 'batch'])
+def agent_options(request):
+    return {'batch_traffic': request.param}
+
+
+def test_rebalance_traffic(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    changes = []
+    result = workflows.rebalance_traffic(lizzy, 'app', {'v2': 20, 'v3': 80},
+                                         on_change=lambda *change: changes.append(change))
+    assert result.batch == agent.batch_traffic
+    assert result.changes == changes
+    assert len(changes) == (0 if agent.batch_traffic else 2)
+    assert result.weights == {'app-v1': 0, 'app-v2': 20, 'app-v3': 80}
+    assert agent.weights == result.weights
+
+
+@pytest.mark.parametrize("targets", [{'v2': 20, 'v3': 70}, {'v4': 100}])
+def test_rebalance_traffic_invalid(agent, targets):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    with pytest.raises(InvalidTrafficWeights):
+        workflows.rebalance_traffic(lizzy, 'app', targets)
+    assert agent.weights['app-v1'] == 100
+
+
+def test_rebalance_traffic_whole_percentages(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    result = workflows.rebalance_traffic(lizzy, 'app', {'v1': 100 / 3, 'v2': 100 / 3, 'v3': 100 / 3})
+    assert all(isinstance(percentage, int) for _, percentage in result.changes)
+    assert matches(agent.weights, {'app-v1': 34, 'app-v2': 33, 'app-v3': 33}, PLAN_TOLERANCE)
+
+
+def test_rebalance(agent, monkeypatch):
+    monkeypatch.setenv('LIZZY_URL', agent.url)
+    monkeypatch.setenv('OAUTH2_ACCESS_TOKEN_URL', agent.token_url)
+    monkeypatch.setattr('lizzy_client.cli.get_token', MagicMock(return_value=agent.access_token))
+    runner = CliRunner()
+
+    result = runner.invoke(main, ['rebalance', 'app', 'v1=20', 'v2=80'],
+                           catch_exceptions=False)
+    assert 'Rebalancing traffic of app..' in result.output
+    assert result.exit_code == 0
+    assert agent.weights == {'app-v1': 20, 'app-v2': 80, 'app-v3': 0}
+
+    result = runner.invoke(main, ['rebalance', 'app', 'v1=20', 'v2=20'],
+                           catch_exceptions=False)
+    assert 'Traffic weights must add up to 100' in result.output
+    assert result.exit_code == 1
+
+    for arguments in (['app'], ['app', 'v1=a'], ['app', 'v1'], ['app', '=100'], ['app', 'v1=120']):
+        result = runner.invoke(main, ['rebalance'] + arguments)
+        assert result.exit_code == 2
+    assert agent.weights == {'app-v1': 20, 'app-v2': 80, 'app-v3': 0}
+
+    result = runner.invoke(main, ['traffic', 'app', 'v1', '50', 'v2'])
+    assert result.exit_code == 2
+
+
+def test_traffic_of_app_named_set(monkeypatch):
+    with FakeAgent() as agent:
+        agent.add_stack('set', 'v1')
+        agent.add_stack('set', 'v2')
+        agent.set_traffic('set-v1', 100)
+        monkeypatch.setenv('LIZZY_URL', agent.url)
+        monkeypatch.setenv('OAUTH2_ACCESS_TOKEN_URL', agent.token_url)
+        monkeypatch.setattr('lizzy_client.cli.get_token', MagicMock(return_value=agent.access_token))
+
+        result = CliRunner().invoke(main, ['traffic', 'set', 'v2', '40'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert agent.weights == {'set-v1': 60, 'set-v2': 40}
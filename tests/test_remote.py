@@ -0,0 +1,130 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+import requests
+from lizzy_client import remote
+from lizzy_client.arguments import DefinitionParamType
+from lizzy_client.utils import read_parameter_files
+
+
+class ConfigServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ConfigHandler)
+        self.files = {}  # path -> (body, headers)
+        self.requests = []
+        self.delay = 0.0
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+
+class ConfigHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        time.sleep(self.server.delay)
+        if self.path not in self.server.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body, headers = self.server.files[self.path]
+        etag = '"{}"'.format(hash(body))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ConfigServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_revalidates_with_etag(server):
+    server.files['/params.yaml'] = (b'a: 1', {})
+    url = server.url + '/params.yaml'
+    assert remote.fetch(url) == b'a: 1'
+    assert remote.fetch(url) == b'a: 1'
+    assert server.requests == [('/params.yaml', None), ('/params.yaml', '"{}"'.format(hash(b'a: 1')))]
+
+    server.files['/params.yaml'] = (b'a: 2', {})
+    assert remote.fetch(url) == b'a: 2'
+
+
+def test_max_age(server):
+    server.files['/params.yaml'] = (b'a: 1', {'Cache-Control': 'public, max-age=300'})
+    url = server.url + '/params.yaml'
+    assert remote.fetch(url) == b'a: 1'
+    server.files['/params.yaml'] = (b'a: 2', {})
+    assert remote.fetch(url) == b'a: 1'  # still fresh
+    assert len(server.requests) == 1
+    assert remote.fetch(url, use_cache=False) == b'a: 2'
+
+
+def test_no_store(server):
+    server.files['/secret.yaml'] = (b'a: 1', {'Cache-Control': 'no-store'})
+    url = server.url + '/secret.yaml'
+    remote.fetch(url)
+    assert remote.read_cache(url) == (None, None)
+    remote.fetch(url)
+    assert server.requests == [('/secret.yaml', None), ('/secret.yaml', None)]
+
+
+def test_fetch_error(server):
+    with pytest.raises(requests.HTTPError):
+        remote.fetch(server.url + '/missing.yaml')
+
+
+def test_prefetch(server):
+    server.files['/params.yaml'] = (b'a: 1', {})
+    url = server.url + '/params.yaml'
+    downloads = remote.prefetch([url, 'params.yaml'])
+    assert list(downloads) == [url]
+    assert remote.fetch(url, downloads=downloads) == b'a: 1'
+    assert downloads == {}
+    assert len(server.requests) == 1
+
+    downloads = remote.prefetch([url])
+    remote.cancel(downloads)
+    assert downloads == {}
+
+
+def test_parameter_files_fetched_concurrently(server, tmpdir):
+    server.delay = 0.2
+    server.files['/a.yaml'] = (b'ImageVersion: "1.0"\nparam0: a', {})
+    server.files['/b.yaml'] = (b'param1: b\nparam0: b', {})
+    server.files['/c.yaml'] = (b'param2: c', {})
+    local = tmpdir.join('local.yaml')
+    local.write('param2: local')
+
+    start = time.perf_counter()
+    parameters = read_parameter_files([server.url + '/a.yaml', server.url + '/b.yaml',
+                                       server.url + '/c.yaml', str(local)])
+    assert time.perf_counter() - start < 0.5
+    assert parameters == ['ImageVersion=1.0', 'param0=b', 'param1=b', 'param2=local']
+
+
+def test_remote_definition(server):
+    server.files['/senza.yaml'] = (b'SenzaInfo:\n  StackName: app', {})
+    definition = DefinitionParamType().convert(server.url + '/senza.yaml', None, None)
+    assert definition == {'SenzaInfo': {'StackName': 'app'}}
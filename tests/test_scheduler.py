@@ -0,0 +1,119 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import scheduler
+from lizzy_client.cli import DEPLOYMENT_PRIORITIES, main
+from lizzy_client.scheduler import DeploymentSlot
+
+
+def read_queue(path):
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def test_max_concurrent(tmpdir):
+    path = str(tmpdir.join('queue.json'))
+    first = DeploymentSlot('https://lizzy.example.com', 2, path=path)
+    second = DeploymentSlot('https://lizzy.example.com', 2, path=path)
+    third = DeploymentSlot('https://lizzy.example.com', 2, path=path)
+    assert first.acquire(timeout=0)
+    assert second.acquire(timeout=0)
+    assert not third.acquire(timeout=0)
+    assert read_queue(path)['waiting'] == []  # gave up
+
+    first.release()
+    assert third.acquire(timeout=0)
+    running = [entry['id'] for entry in read_queue(path)['running']]
+    assert running == [second.entry['id'], third.entry['id']]
+    second.release()
+    third.release()
+    third.release()  # releasing twice is harmless
+    assert read_queue(path) == {'running': [], 'waiting': []}
+
+
+def test_priorities(tmpdir, no_sleep):
+    path = str(tmpdir.join('queue.json'))
+    running = DeploymentSlot('https://lizzy.example.com', 1, path=path)
+    assert running.acquire()
+    routine = DeploymentSlot('https://lizzy.example.com', 1, priority='low', path=path)
+    assert not routine.acquire(timeout=0)
+    # keep the routine deployment waiting in the queue
+    routine.queued = False
+    with scheduler._locked_queue(path) as queue:
+        queue['waiting'].append(routine.entry)
+
+    hotfix = DeploymentSlot('https://lizzy.example.com', 1, priority='hotfix', path=path)
+    ahead = []
+
+    def finish_running(count):
+        ahead.append(count)
+        running.release()
+
+    assert hotfix.acquire(on_wait=finish_running)
+    assert ahead == [1]
+    queue = read_queue(path)
+    assert [entry['priority'] for entry in queue['running']] == ['hotfix']
+    assert [entry['priority'] for entry in queue['waiting']] == ['low']
+
+
+def test_dead_processes_leave_the_queue(tmpdir):
+    path = str(tmpdir.join('queue.json'))
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    with open(path, 'w') as fd:
+        json.dump({'running': [{'id': 'dead', 'pid': process.pid, 'priority': 'normal',
+                                'enqueued': 0}],
+                   'waiting': []}, fd)
+    slot = DeploymentSlot('https://lizzy.example.com', 1, path=path)
+    assert slot.acquire(timeout=0)
+    assert [entry['pid'] for entry in read_queue(path)['running']] == [os.getpid()]
+
+
+def test_lost_queue(tmpdir, no_sleep):
+    path = str(tmpdir.join('queue.json'))
+    running = DeploymentSlot('https://lizzy.example.com', 1, path=path)
+    assert running.acquire()
+    waiting = DeploymentSlot('https://lizzy.example.com', 1, path=path)
+
+    def lose_queue(ahead):
+        os.remove(path)
+
+    assert waiting.acquire(on_wait=lose_queue)
+    assert [entry['id'] for entry in read_queue(path)['running']] == [waiting.entry['id']]
+
+
+def test_unknown_priority():
+    with pytest.raises(ValueError):
+        DeploymentSlot('https://lizzy.example.com', 1, priority='urgent')
+
+
+def test_create_waits_for_slot(agent, monkeypatch, tmpdir):
+    monkeypatch.setenv('LIZZY_MAX_CONCURRENT_CREATES', '1')
+    definition = tmpdir.join('app.yaml')
+    definition.write('SenzaInfo:\n  StackName: app\n')
+
+    busy = DeploymentSlot(agent.url + '/api', 1)
+    assert busy.acquire()
+    monkeypatch.setattr('lizzy_client.scheduler.time.sleep', lambda seconds: busy.release())
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['create', '--priority', 'hotfix', '-o', 'ndjson',
+                                  str(definition), 'v2'], catch_exceptions=False)
+    assert result.exit_code == 0
+    # the progress of the actions goes to the same output in tests
+    events = [json.loads(line[line.index('{"'):]) for line in result.output.splitlines()
+              if '{"' in line]
+    assert [event['event'] for event in events if event['event'] in ('queued', 'slot_acquired')] == [
+        'queued', 'slot_acquired']
+    assert read_queue(scheduler.queue_path(agent.url + '/api')) == {'running': [], 'waiting': []}
+
+
+def test_scheduler_imported_lazily():
+    assert DEPLOYMENT_PRIORITIES == scheduler.PRIORITIES
+    code = 'import sys, lizzy_client.cli; print("lizzy_client.scheduler" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b'False'
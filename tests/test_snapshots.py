@@ -0,0 +1,90 @@
+import gzip
+import json
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import snapshots
+from lizzy_client.cli import main
+from lizzy_client.lizzy import Lizzy
+
+
+@pytest.fixture
+def agent_stacks():
+    return [('app', 'v1', None), ('app', 'v2', 100), ('other', 'v1', None)]
+
+
+def test_take_incremental(agent, tmpdir):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    path = str(tmpdir.join('snapshot.json.gz'))
+
+    snapshot, traffic_requests = snapshots.take(lizzy, [None])
+    assert traffic_requests == 3
+    snapshots.save(snapshot, path)
+    with gzip.open(path, 'rt') as fd:
+        columns = json.load(fd)['columns']
+    assert columns['stack_name'] == ['app', 'app', 'other']
+    assert columns['weight'] == [0.0, 100.0, 0.0]
+
+    previous = snapshots.load(path)
+    assert previous.weights('app') == {'v1': 0.0, 'v2': 100.0}
+    assert [stack.stack_id for stack in previous.stacks()] == ['app-v1', 'app-v2', 'other-v1']
+    # taken in the default region, which may be any
+    assert len(previous.stacks('eu-central-1')) == 3
+    assert previous.weights('app', 'eu-central-1') == {'v1': 0.0, 'v2': 100.0}
+
+    # nothing changed
+    snapshot, traffic_requests = snapshots.take(lizzy, [None], previous=previous)
+    assert traffic_requests == 0
+    assert snapshot.weights('app') == previous.weights('app')
+
+    # a new version of app invalidates the weights of all its versions
+    agent.add_stack('app', 'v3')
+    agent.set_traffic('app-v3', 100)
+    snapshot, traffic_requests = snapshots.take(lizzy, [None], previous=previous)
+    assert traffic_requests == 3
+    assert snapshot.weights('app') == {'v1': 0.0, 'v2': 0.0, 'v3': 100.0}
+    assert snapshot.weights('other') == {'v1': 0.0}
+
+    # old weights are requested again
+    snapshot, traffic_requests = snapshots.take(lizzy, [None], previous=snapshot, max_age=-1)
+    assert traffic_requests == 4
+
+
+def test_load_invalid(tmpdir):
+    path = tmpdir.join('snapshot.json.gz')
+    path.write('not a snapshot')
+    with pytest.raises(snapshots.SnapshotError):
+        snapshots.load(str(path))
+    with pytest.raises(snapshots.SnapshotError):
+        snapshots.load(str(tmpdir.join('missing')))
+
+
+def test_cli(agent, tmpdir):
+    path = str(tmpdir.join('snapshot.json.gz'))
+    runner = CliRunner()
+    result = runner.invoke(main, ['snapshot', path], catch_exceptions=False)
+    assert 'Saved 3 stacks' in result.output
+    assert '3 traffic requests' in result.output
+
+    result = runner.invoke(main, ['snapshot', path], catch_exceptions=False)
+    assert '0 traffic requests' in result.output
+
+    # reading the snapshot doesn't touch the agent
+    agent.request_count = 0
+    result = runner.invoke(main, ['list', '--from-snapshot', path, '-o', 'json', 'app'],
+                           catch_exceptions=False)
+    assert [row['stack_name'] + '-' + row['version'] for row in json.loads(result.output)] == \
+        ['app-v1', 'app-v2']
+
+    result = runner.invoke(main, ['traffic', '--from-snapshot', path, '-o', 'json', 'app'],
+                           catch_exceptions=False)
+    assert [(row['identifier'], row['weight%']) for row in json.loads(result.output)] == \
+        [('app-v1', 0.0), ('app-v2', 100.0)]
+    assert agent.request_count == 0
+
+    result = runner.invoke(main, ['traffic', '--from-snapshot', path, 'app', 'v1', '10'])
+    assert result.exit_code == 2
+
+    result = runner.invoke(main, ['list', '--from-snapshot', str(tmpdir.join('missing'))])
+    assert result.exit_code == 1
+    assert 'Can\'t read snapshot' in result.output
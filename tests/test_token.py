@@ -1,8 +1,11 @@
 from requests import Response
 from tokens import InvalidCredentialsError
 import json
+import time
+from unittest.mock import MagicMock
+
 import pytest
-from lizzy_client.token import get_token
+from lizzy_client.token import TokenProvider, get_token, refresh_token
 
 
 class FakeResponse(Response):
@@ -23,3 +26,24 @@ def test_get_token(monkeypatch):
     monkeypatch.setattr('os.environ', {'OAUTH2_ACCESS_TOKENS': 'lizzy=4CCE5570K3N'})
     access_token = get_token('https://token.example', scopes='scope', credentials_dir='/meta/credentials')
     assert access_token == '4CCE5570K3N'
+
+
+def test_token_provider(monkeypatch):
+    fetched = iter(['first', 'second', 'third'])
+    provider = TokenProvider(lambda: next(fetched), refresh=lambda: 'refreshed', interval=0.01)
+    assert provider.get() == 'first'
+    assert provider.get() == 'first'
+    assert provider.refresh() == 'refreshed'
+
+    provider.start()
+    deadline = time.monotonic() + 5
+    while provider.get() != 'third' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    provider.stop()
+    assert provider.get() == 'third'  # kept after the fetch failed
+
+
+def test_refresh_token(monkeypatch):
+    monkeypatch.setattr('os.environ', {'OAUTH2_ACCESS_TOKENS': 'lizzy=4CCE5570K3N'})
+    monkeypatch.setattr('tokens.refresh', MagicMock(return_value={'access_token': 'N3W'}))
+    assert refresh_token('https://token.example', 'scope', '/meta/credentials') == 'N3W'
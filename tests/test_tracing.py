@@ -0,0 +1,54 @@
+import json
+
+from click.testing import CliRunner
+from lizzy_client import tracing
+from lizzy_client.cli import main
+from lizzy_client.fake_agent import FakeAgent
+from lizzy_client.lizzy import Lizzy
+
+
+def test_tracer_records_phases_and_requests():
+    tracer = tracing.Tracer()
+    tracing.add_recorder(tracer)
+    try:
+        with FakeAgent(stacks=3) as agent, tracing.phase('listing'):
+            Lizzy(agent.url, 'TOKEN').get_stacks()
+    finally:
+        tracing.remove_recorder(tracer)
+
+    phase, request = sorted(tracer.events, key=lambda event: event['cat'], reverse=True)
+    assert phase['name'] == 'listing'
+    assert request['cat'] == 'http'
+    assert request['args']['method'] == 'GET'
+    assert request['args']['status'] == 200
+    assert request['args']['bytes'] > 0
+    assert phase['duration'] >= request['duration']
+
+    trace = tracer.chrome_trace()
+    assert [event['ph'] for event in trace['traceEvents']] == ['X', 'X']
+
+
+def test_phase_without_recorders():
+    with tracing.phase('nothing'):
+        pass
+    assert not tracing.is_recording()
+
+
+def test_trace_options(tmpdir):
+    trace_path = str(tmpdir.join('trace.json'))
+    profile_path = str(tmpdir.join('lizzy.prof'))
+    runner = CliRunner()
+    result = runner.invoke(main, ['--trace', '--trace-file', trace_path, '--profile', profile_path,
+                                  'bench', '--stacks', '1', '--iterations', '1'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'Trace (total' in result.output
+    assert 'HTTP requests' in result.output
+    assert not tracing.is_recording()
+
+    with open(trace_path) as fd:
+        trace = json.load(fd)
+    names = [event['name'] for event in trace['traceEvents']]
+    assert names[0] == 'startup'
+    assert any(name.startswith('POST http://127.0.0.1') for name in names)
+    assert tmpdir.join('lizzy.prof').size() > 0
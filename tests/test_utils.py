@@ -1,11 +1,15 @@
 import tempfile
+from datetime import datetime, timezone
 from unittest.mock import MagicMock
 from urllib.error import URLError
 
 import pytest
 from click.exceptions import UsageError
-from lizzy_client.utils import (StackReference, get_stack_refs,
-                                read_parameter_file)
+from lizzy_client.models import Stack
+from lizzy_client.utils import (ScaleTarget, StackReference,
+                                get_scale_targets, get_stack_refs,
+                                match_stack_refs, parse_timestamp, percentile,
+                                read_parameter_file, read_scale_file)
 
 
 @pytest.mark.parametrize(
@@ -24,6 +28,39 @@ def test_get_stack_refs(input, expected_output):
     assert output == expected_output
 
 
+def test_get_stack_refs_invalid_definition(tmpdir):
+    definition = tmpdir.join('senza.yaml')
+    definition.write('NotValid: impossible')
+    with pytest.raises(UsageError):
+        get_stack_refs([str(definition)])
+
+
+def test_match_stack_refs():
+    stacks = [Stack('app', 'v1'), Stack('app', 'v10'), Stack('app-canary', 'v1'), Stack('other', 'v1')]
+    assert match_stack_refs([StackReference('app', 'v1')], stacks) == [stacks[0]]
+    assert match_stack_refs([StackReference('app', None)], stacks) == stacks[:2]
+    assert match_stack_refs([StackReference('app.*', 'v1'), StackReference('other', None)],
+                            stacks) == [stacks[0], stacks[2], stacks[3]]
+    # invalid patterns are matched literally
+    assert match_stack_refs([StackReference('app[', None)], stacks) == []
+
+
+def test_get_scale_targets():
+    assert get_scale_targets(['app', 'v1', '3', 'other', 'v2', '1000']) == [
+        ScaleTarget('app', 'v1', 3), ScaleTarget('other', 'v2', 999)]
+    with pytest.raises(UsageError):
+        get_scale_targets(['app', 'v1'])
+    with pytest.raises(UsageError):
+        get_scale_targets(['app', 'v1', 'many'])
+
+
+def test_read_scale_file():
+    lines = ['# incident 42', 'app v1 3', '', '  other v2 0  # drain']
+    assert read_scale_file(lines) == [ScaleTarget('app', 'v1', 3), ScaleTarget('other', 'v2', 0)]
+    with pytest.raises(UsageError):
+        read_scale_file(['app v1'])
+
+
 def test_parameter_file():
     with tempfile.NamedTemporaryFile() as temporary_file:
         temporary_file.write(b"param1: value1\nparam2: value2")
@@ -48,3 +85,36 @@ def test_parameter_file_yaml_error(monkeypatch):
         temporary_file.flush()
         with pytest.raises(UsageError):
             read_parameter_file(temporary_file.name)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ('2016-01-01T12:00:00Z', datetime(2016, 1, 1, 12, tzinfo=timezone.utc)),
+        ('2016-01-01 12:00:00.25+00:00', datetime(2016, 1, 1, 12, 0, 0, 250000, tzinfo=timezone.utc)),
+        ('2016-01-01T14:00:00+0200', datetime(2016, 1, 1, 12, tzinfo=timezone.utc)),
+        ('2016-01-01T12:00:00', datetime(2016, 1, 1, 12)),
+        (1451649600, datetime(2016, 1, 1, 12, tzinfo=timezone.utc)),
+        ('1451649600.0', datetime(2016, 1, 1, 12, tzinfo=timezone.utc)),
+        ('Fri, 01 Jan 2016 12:00:00 GMT', datetime(2016, 1, 1, 12, tzinfo=timezone.utc)),
+    ])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+def test_parse_timestamp_fast_path(monkeypatch):
+    parse = MagicMock()
+    monkeypatch.setattr('dateutil.parser.parse', parse)
+    parse_timestamp('2016-02-03T04:05:06Z')
+    parse_timestamp(1454472306)
+    parse.assert_not_called()
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3]
+    assert percentile(values, 50) == 3
+    assert percentile(values, 100) == 5
+    assert percentile(values, 0) == 1
+    assert percentile([], 50) == 0.0
+    assert percentile([110, 330], 50) == 110
+    assert percentile(list(range(1, 11)), 90) == 9
@@ -0,0 +1,91 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+from lizzy_client import validation
+from lizzy_client.cli import main
+
+DEFINITION = {'SenzaInfo': {'StackName': 'app',
+                            'Parameters': [{'ImageVersion': {'Description': 'Docker image version'}},
+                                           {'Stage': {'Default': 'test',
+                                                      'AllowedValues': ['test', 'live']}}]},
+              'SenzaComponents': []}
+
+
+@pytest.mark.parametrize(
+    "definition, issues",
+    [
+        (DEFINITION, []),
+        ([], ['The definition must be a mapping']),
+        ({'SenzaInfo': ['Something']}, ['SenzaInfo must be a mapping']),
+        ({'SenzaInfo': {}}, ['SenzaInfo.StackName is missing']),
+        ({'SenzaInfo': {'StackName': 'my_app'}}, ['SenzaInfo.StackName "my_app" must match ^[a-zA-Z][a-zA-Z0-9-]*$']),
+        ({'SenzaInfo': {'StackName': 'a' * 130}}, ['Stack ID {}-v1 is longer than 128 characters'.format('a' * 130)]),
+        ({'SenzaInfo': {'StackName': 'app', 'Parameters': {'ImageVersion': None}}},
+         ['SenzaInfo.Parameters must be a list of single key mappings']),
+        ({'SenzaInfo': {'StackName': 'app'}, 'SenzaComponents': {}}, ['SenzaComponents must be a list']),
+    ])
+def test_check_senza_info(definition, issues):
+    assert validation.check_senza_info(definition, 'v1', [], []) == issues
+
+
+@pytest.mark.parametrize(
+    "parameters, issues",
+    [
+        (['1.0'], []),
+        (['1.0', 'live'], []),
+        (['ImageVersion=1.0', 'Stage=live'], []),
+        ([], ['Missing value for parameter ImageVersion']),
+        (['1.0', 'live', 'extra'], ['Got 3 positional parameters but the definition only has 2']),
+        (['1.0', 'Other=1'], ['Unknown parameter Other']),
+        (['1.0', 'ImageVersion=2.0'], ['Parameter ImageVersion is given more than once']),
+        (['1.0', 'Stage=prod'], ['Parameter Stage must be one of test, live']),
+    ])
+def test_check_parameters(parameters, issues):
+    assert validation.check_parameters(DEFINITION, 'v1', parameters, []) == issues
+
+
+@pytest.mark.parametrize(
+    "tags, issues",
+    [
+        (['team=platform', 'cost-center='], []),
+        (['team'], ['Tag "team" must have the format key=value']),
+        (['=platform'], ['Tag "=platform" must have the format key=value']),
+        (['aws:team=platform'], ['Tag aws:team uses the reserved prefix "aws:"']),
+        (['team=a', 'team=b'], ['Tag team is given more than once']),
+        (['team=' + 'a' * 257], ['Value of tag team is longer than 256 characters']),
+    ])
+def test_check_tags(tags, issues):
+    assert validation.check_tags(DEFINITION, 'v1', [], tags) == issues
+
+
+def test_validate_cached(lizzy_home, monkeypatch):
+    issues = validation.validate(DEFINITION, 'v1', ['1.0', 'Stage=prod'], ['team'])
+    assert issues == [validation.ValidationIssue('parameters', 'Parameter Stage must be one of test, live'),
+                      validation.ValidationIssue('tags', 'Tag "team" must have the format key=value')]
+    assert len(os.listdir(str(lizzy_home.join('validation')))) == 1
+
+    check = MagicMock(return_value=[])
+    monkeypatch.setattr(validation, 'VALIDATORS', [('check', check)])
+    assert validation.validate(DEFINITION, 'v1', ['1.0', 'Stage=prod'], ['team']) == issues
+    check.assert_not_called()
+
+    assert validation.validate(DEFINITION, 'v2', ['1.0']) == []
+    check.assert_called_once_with(DEFINITION, 'v2', ['1.0'], [])
+
+
+def test_create_invalid_definition(tmpdir, monkeypatch):
+    monkeypatch.setattr('lizzy_client.cli.setup_lizzy_client', MagicMock(side_effect=AssertionError))
+    definition = tmpdir.join('senza.yaml')
+    definition.write('SenzaInfo:\n  StackName: app\n')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['create', str(definition), 'v1', '1.0', '-t', 'team'])
+    assert 'Got 1 positional parameters but the definition only has 0' in result.output
+    assert 'Tag "team" must have the format key=value' in result.output
+    assert 'use --force to create the stack anyway' in result.output
+    assert result.exit_code == 1
+
+    result = runner.invoke(main, ['create', '--force', str(definition), 'v1', '1.0'])
+    assert isinstance(result.exception, AssertionError)  # went on to request the stack
@@ -0,0 +1,139 @@
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from lizzy_client import workflows
+from lizzy_client.exceptions import (DeploymentError, StackRolledBack,
+                                     TrafficChangeError)
+from lizzy_client.lizzy import Lizzy
+from lizzy_client.utils import ScaleTarget, StackReference
+
+DEFINITION = {'SenzaInfo': {'StackName': 'app'}}
+
+
+@pytest.fixture
+def agent_stacks():
+    return [('app', 'v1', None), ('app', 'v2', 100), ('other', 'v1', None)]
+
+
+def test_deploy(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    states = []
+    result = workflows.deploy(lizzy, DEFINITION, 'v3', ['1.0'],
+                              traffic=100, keep_stacks=0, on_state=states.append)
+
+    assert result.stack.stack_id == 'app-v3'
+    assert '[AGENT] Creating Cloud Formation stack app.. OK' in result.output
+    assert result.final_status == 'CREATE_COMPLETE'
+    assert states == ['CREATE_COMPLETE']
+    assert [stack.stack_id for stack in result.cleanup.removed] == ['app-v1', 'app-v2']
+    assert not result.cleanup.timed_out
+    assert sorted(agent.stacks) == ['app-v3', 'other-v1']
+    assert agent.weights['app-v3'] == 100
+
+
+def test_deploy_dry_run(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    result = workflows.deploy(lizzy, DEFINITION, 'v3', dry_run=True, keep_stacks=0)
+    assert result.stack.stack_id == 'app-v3'
+    assert result.final_status is None
+    assert result.cleanup is None
+    assert 'app-v3' not in agent.stacks
+
+
+def test_request_stack_tags():
+    lizzy = MagicMock()
+    lizzy.new_stack.return_value = (None, '')
+    tags = ('team=x', 'owner=y')
+    workflows.request_stack(lizzy, DEFINITION, 'v3', tags=tags)
+    assert lizzy.new_stack.call_args[1]['tags'] is tags
+
+
+@pytest.mark.parametrize(
+    "final_state, exception",
+    [
+        ('ROLLBACK_COMPLETE', StackRolledBack),
+        ('CREATE_FAILED', DeploymentError),
+    ])
+def test_deploy_failed(agent, final_state, exception):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    lizzy.wait_for_deployment = MagicMock(return_value=['CREATE_IN_PROGRESS', final_state])
+    with pytest.raises(exception) as exc_info:
+        workflows.deploy(lizzy, DEFINITION, 'v3', traffic=100, keep_stacks=0)
+    assert exc_info.value.stack_id == 'app-v3'
+    assert exc_info.value.final_status == final_state
+    assert 'app-v1' in agent.stacks
+
+
+def test_deploy_traffic_error(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    lizzy.traffic = MagicMock(side_effect=requests.ConnectionError('refused'))
+    with pytest.raises(TrafficChangeError) as exc_info:
+        workflows.deploy(lizzy, DEFINITION, 'v3', traffic=100)
+    assert exc_info.value.stack_id == 'app-v3'
+
+
+def test_plan_deployment(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    agent.request_count = 0
+    plan = workflows.plan_deployment(lizzy, DEFINITION, 'v3', traffic=50, keep_stacks=1)
+    assert plan.stack_id == 'app-v3'
+    assert [stack.stack_id for stack in plan.existing] == ['app-v1', 'app-v2']
+    assert [stack.stack_id for stack in plan.delete] == ['app-v1']
+    assert plan.current_weights == {'app-v1': 0.0, 'app-v2': 100.0}
+    assert plan.weights == {'app-v1': 0.0, 'app-v2': 50.0, 'app-v3': 50}
+    assert plan.warnings == []
+    assert agent.request_count == 3  # the listing and the weight of each serving stack
+    assert 'app-v3' not in agent.stacks
+
+    agent.request_count = 0
+    plan = workflows.plan_deployment(lizzy, DEFINITION, 'v2', keep_stacks=0)
+    assert [stack.stack_id for stack in plan.delete] == ['app-v1', 'app-v2']
+    assert plan.weights is None
+    assert plan.warnings == ['Stack app-v2 already exists']
+    assert agent.request_count == 1
+
+
+def test_agent_errors_are_not_printed(agent, capsys):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    with pytest.raises(requests.HTTPError):
+        lizzy.traffic('missing-v1', 10)
+    with pytest.raises(requests.HTTPError):
+        lizzy.scale('missing-v1', 1)
+    assert capsys.readouterr() == ('', '')
+
+
+def test_remove_old_stacks_pending(agent, monkeypatch):
+    monkeypatch.setattr('time.sleep', MagicMock())
+    agent.stacks['app-v1']['status'] = 'UPDATE_IN_PROGRESS'
+    lizzy = Lizzy(agent.url, agent.access_token)
+    pending = []
+    result = workflows.remove_old_stacks(lizzy, 'app', 0, timeout=0.1, on_pending=pending.append)
+    assert [stack.stack_id for stack in pending][0] == 'app-v1'
+    assert result.removed == []
+    assert result.timed_out
+
+
+def test_scale_stacks(agent):
+    lizzy = Lizzy(agent.url, agent.access_token)
+    finished = []
+    targets = [ScaleTarget('app', 'v1', 3), ScaleTarget('missing', 'v1', 1),
+               ScaleTarget('other', 'v1', 0)]
+    results = workflows.scale_stacks(lizzy, targets, max_workers=2,
+                                     on_result=finished.append)
+    assert [result.stack_id for result in results] == ['app-v1', 'missing-v1', 'other-v1']
+    assert sorted(finished) == sorted(results)
+    assert results[0].error is None
+    assert isinstance(results[1].error, requests.HTTPError)
+    assert agent.scales == {'app-v1': 3, 'other-v1': 0}
+
+
+def test_resolve_stack_refs(agent):
+    agent.add_stack('app-canary', 'v1')
+    lizzy = Lizzy(agent.url, agent.access_token)
+    requests_before = agent.request_count
+    stack_ids = workflows.resolve_stack_refs(lizzy, [StackReference('app', 'v1'),
+                                                     StackReference('app.*', 'v[0-9]'),
+                                                     StackReference('missing', None)])
+    assert sorted(stack_ids) == ['app-canary-v1', 'app-v1', 'app-v2']
+    assert agent.request_count - requests_before == 1